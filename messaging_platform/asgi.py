@@ -4,5 +4,18 @@ from django.core.asgi import get_asgi_application
 # تعيين إعدادات Django الافتراضية
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'messaging_platform.settings')
 
-# الحصول على تطبيق ASGI الأساسي
-application = get_asgi_application()
\ No newline at end of file
+# الحصول على تطبيق ASGI الأساسي (يجب تهيئته قبل استيراد أي شيء يستخدم النماذج)
+django_asgi_app = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+
+from vite.routing import websocket_urlpatterns
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(
+        AuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+    ),
+})
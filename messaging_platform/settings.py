@@ -69,6 +69,7 @@ cloudinary.config(
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', # Add this line
+    'vite.metrics.MetricsMiddleware',  # زمن الاستجابة وعدد الاستعلامات لكل صفحة (vite/metrics.py)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -166,6 +167,37 @@ USE_TZ = True
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# الملفات المرفوعة تحفظ هنا مؤقتا حتى يرفعها العامل في الخلفية إلى Cloudinary (vite/uploads.py)
+MEDIA_SPOOL_ROOT = os.path.join(BASE_DIR, 'media_spool')
+MEDIA_UPLOAD_WORKERS = int(os.environ.get('MEDIA_UPLOAD_WORKERS', 2))
+# عدد الخيوط التي ترمز نسخ الصور المصغرة (WebP/AVIF) بعد الرفع (vite/images.py)
+IMAGE_ENCODE_WORKERS = int(os.environ.get('IMAGE_ENCODE_WORKERS', os.cpu_count() or 2))
+# True يرفع الملفات مباشرة بعد حفظ الطلب بدلا من خيوط العمل (للاختبارات)
+MEDIA_UPLOADS_INLINE = False
+# مكان حفظ الوسائط: Cloudinary، أو vite.media.LocalBackend لحفظها على القرص دون شبكة (للاختبارات وقياس الأداء)
+MEDIA_BACKEND = os.environ.get('MEDIA_BACKEND', 'vite.media.CloudinaryBackend')
+MEDIA_LOCAL_ROOT = os.environ.get('MEDIA_LOCAL_ROOT', os.path.join(BASE_DIR, 'media_local'))
+# العنوان الذي تبنى عليه روابط الوسائط المحلية (/media/cloudinary/...)
+MEDIA_LOCAL_HOST = os.environ.get('MEDIA_LOCAL_HOST', 'localhost:8000')
+
+# أكواد QR ترسم عند أول عرض وتحفظ هنا (vite/qrcodes.py)
+QR_CACHE_ROOT = os.path.join(BASE_DIR, 'qr_cache')
+# أقصى مدة (بالثواني) قبل كتابة نبضات الحضور المجمعة إلى last_active
+PRESENCE_FLUSH_INTERVAL = int(os.environ.get('PRESENCE_FLUSH_INTERVAL', 60))
+# أقصى مدة (بالثواني) قبل كتابة مشاهدات الريلز المجمعة (vite/reelviews.py)
+REEL_VIEWS_FLUSH_INTERVAL = int(os.environ.get('REEL_VIEWS_FLUSH_INTERVAL', 30))
+# كل كم ثانية تكتب الإشعارات المنتظرة وتجمع المتشابهة منها (vite/notify.py)
+NOTIFICATION_FLUSH_INTERVAL = int(os.environ.get('NOTIFICATION_FLUSH_INTERVAL', 2))
+# True يكتب الإشعارات مباشرة بعد حفظ الطلب بدلا من خيط الخلفية (للاختبارات)
+NOTIFICATIONS_INLINE = False
+# الإشعارات المقروءة الأقدم من هذا (بالأيام) يحذفها manage.py prune_notifications
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 90))
+# الصفحات التي تتجاوز هذا العدد من الاستعلامات أو هذا الزمن (بالمللي ثانية) تسجل تحذيرا
+METRICS_QUERY_BUDGET = int(os.environ.get('METRICS_QUERY_BUDGET', 50))
+METRICS_LATENCY_BUDGET_MS = int(os.environ.get('METRICS_LATENCY_BUDGET_MS', 500))
+# رمز يرسله Prometheus في ترويسة Authorization لقراءة /metrics/
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 LOGIN_REDIRECT_URL = 'home'  # استبدل 'home' باسم المسار الذي تريده بعد تسجيل الدخول
 USE_L10N = True
 LANGUAGE_CODE = 'ar'
@@ -181,19 +213,48 @@ DATABASES = {
         'PORT': '5432',
     }
 }
+# أعمدة INCLUDE في فهارس Postgres تُتجاهل على SQLite (قاعدة الاختبارات)
+SILENCED_SYSTEM_CHECKS = ['models.W040']
 # إعدادات التخزين المؤقت
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': os.path.join(BASE_DIR, 'django_cache'),
-        'TIMEOUT': 60 * 15,  # التخزين المؤقت لمدة 15 دقيقة
-        'OPTIONS': {
-            'MAX_ENTRIES': 1000
+# Redis في الإنتاج: كل العمليات (العمال وأوامر manage.py) تشترك فيه، وincr/add فيه ذرية كما تحتاج
+# العدادات وأجيال الصفحات المخزنة ومشاهدات الريلز. بدونه ذاكرة محلية لعملية تطوير واحدة فقط
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'TIMEOUT': 60 * 15,  # التخزين المؤقت لمدة 15 دقيقة
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'TIMEOUT': 60 * 15,  # التخزين المؤقت لمدة 15 دقيقة
+            'OPTIONS': {
+                'MAX_ENTRIES': 5000
+            }
         }
     }
-}
 
 
+# طبقة القنوات (WebSocket): Redis في الإنتاج، وذاكرة محلية للتطوير والاختبارات
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+            },
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        }
+    }
 
 AUTH_USER_MODEL = 'vite.CustomUser'  # استبدل your_app_name باسم تطبيقك
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5" # Or just "bootstrap5" if it's the only one
@@ -1,6 +1,26 @@
+import atexit
+import sys
+
 from django.apps import AppConfig
 
+
+def running_tests():
+    return sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+
+
 class NewNameConfig(AppConfig):  # تغيير اسم الكلاس
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'vite'  # تغيير هنا
-    label = 'vite'  # إضافة هذا السطر لتجنب التكرار
\ No newline at end of file
+    label = 'vite'  # إضافة هذا السطر لتجنب التكرار
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # Buffered writes are flushed when the process exits, but not under
+        # the test runner: by then it has switched back to the real database.
+        if not running_tests():
+            from . import notify, presence, reelviews
+            atexit.register(presence.flush)
+            atexit.register(reelviews.flush)
+            # The channel layer is gone by then: write without pushing.
+            atexit.register(notify.flush, push=False)
@@ -0,0 +1,243 @@
+# benchmark.py
+"""
+Replays a mix of the app's hottest requests and reports latency percentiles.
+
+Each worker thread plays signed-in users picked from the database (users
+with at least one friend) and draws requests from ``TRAFFIC_MIX``: the chat
+poll, the unread badge poll, a feed page, a like toggle and a reel view.
+Requests go either through Django's test client in this process
+(``target='inprocess'``) or over HTTP to a running server such as
+``daphne messaging_platform.asgi:application`` (``target='http://...'``),
+which then needs the same database to accept the sessions created here.
+
+``run`` returns a JSON-serializable report: p50/p95/p99/mean/max latency,
+request and error counts and throughput per endpoint and overall.
+``compare`` diffs two reports.
+"""
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Max, Min
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from .models import CustomUser, Message, Post, Reel
+
+# name -> weight; see ``Actor.request`` for what each one sends.
+TRAFFIC_MIX = {
+    'chat_poll': 30,
+    'badge_poll': 30,
+    'feed': 15,
+    'like_toggle': 10,
+    'reel_view': 15,
+}
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an ascending list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[rank - 1]
+
+
+def pick_actors(count, rng):
+    """
+    ``[(user, friend username)]`` for up to ``count`` users that have a friend.
+    """
+    through = CustomUser.friends.through
+    bounds = through.objects.aggregate(lo=Min('pk'), hi=Max('pk'))
+    if bounds['hi'] is None:
+        return []
+    actors, seen = [], set()
+    for _ in range(count * 4):
+        row = through.objects.filter(pk__gte=rng.randint(bounds['lo'], bounds['hi'])).order_by('pk').values_list(
+            'from_customuser_id', 'to_customuser__username'
+        ).first()
+        if row and row[0] not in seen:
+            seen.add(row[0])
+            actors.append(row)
+        if len(actors) == count:
+            break
+    users = CustomUser.objects.in_bulk([user_id for user_id, _ in actors])
+    return [(users[user_id], friend) for user_id, friend in actors]
+
+
+class HttpClient:
+    """
+    The slice of ``django.test.Client`` the actors use, over ``requests``.
+    """
+    def __init__(self, base_url, session_key):
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        csrf_token = get_random_string(32)
+        self.session.cookies.set(settings.SESSION_COOKIE_NAME, session_key)
+        self.session.cookies.set(settings.CSRF_COOKIE_NAME, csrf_token)
+        self.session.headers['X-CSRFToken'] = csrf_token
+
+    def get(self, path, data=None):
+        return self.session.get(self.base_url + path, params=data, allow_redirects=False)
+
+    def post(self, path, data=None):
+        return self.session.post(self.base_url + path, data=data, allow_redirects=False)
+
+
+class Actor:
+    def __init__(self, user, friend_username, target, rng, id_ranges):
+        self.user = user
+        self.friend = friend_username
+        self.rng = rng
+        self.id_ranges = id_ranges
+        client = Client()
+        client.force_login(user)
+        if target == 'inprocess':
+            self.client = client
+        else:
+            self.client = HttpClient(target, client.cookies[settings.SESSION_COOKIE_NAME].value)
+
+    def _random_id(self, model):
+        lo, hi = self.id_ranges[model]
+        return self.rng.randint(lo, hi)
+
+    def request(self, name):
+        """
+        Sends one request of kind ``name``; returns the sub-requests' status codes.
+        """
+        if name == 'chat_poll':
+            after_id = self.id_ranges[Message][1]
+            return [self.client.get(reverse('get_messages', args=[self.friend]), {'after_id': after_id}).status_code]
+        if name == 'badge_poll':
+            return [
+                self.client.get(reverse('unread_notifications_count')).status_code,
+                self.client.get(reverse('unread_messages_count')).status_code,
+            ]
+        if name == 'feed':
+            return [self.client.get(reverse('feed_page')).status_code]
+        if name == 'like_toggle':
+            return [self.client.post(reverse('like_post', args=[self._random_id(Post)])).status_code]
+        if name == 'reel_view':
+            return [self.client.post(reverse('record_reel_view', args=[self._random_id(Reel)])).status_code]
+        raise ValueError(name)
+
+
+def _id_ranges():
+    ranges = {}
+    for model in (Message, Post, Reel):
+        bounds = model.objects.aggregate(lo=Min('pk'), hi=Max('pk'))
+        ranges[model] = (bounds['lo'] or 0, bounds['hi'] or 0)
+    return ranges
+
+
+def run(target='inprocess', requests=1000, duration=None, concurrency=4, users=50, mix=None, seed=0):
+    """
+    Sends ``requests`` requests (or keeps going for ``duration`` seconds)
+    from ``concurrency`` threads and returns the report.
+    """
+    mix = mix or TRAFFIC_MIX
+    rng = random.Random(seed)
+    actors = pick_actors(users, rng)
+    if not actors:
+        raise ValueError("No users with friends; run manage.py seed_benchmark first.")
+    id_ranges = _id_ranges()
+    names, weights = zip(*mix.items())
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    remaining = [requests]
+    deadline = time.monotonic() + duration if duration else None
+
+    def take():
+        with lock:
+            if deadline is None:
+                if remaining[0] <= 0:
+                    return False
+                remaining[0] -= 1
+                return True
+        return time.monotonic() < deadline
+
+    # Sessions are created up front so that signing in is not timed.
+    worker_rngs = [random.Random(seed + index + 1) for index in range(concurrency)]
+    worker_actors = [
+        [Actor(user, friend, target, worker_rngs[index], id_ranges) for user, friend in actors[index::concurrency] or actors[:1]]
+        for index in range(concurrency)
+    ]
+
+    def worker(index):
+        worker_rng = worker_rngs[index]
+        try:
+            while take():
+                name = worker_rng.choices(names, weights)[0]
+                actor = worker_rng.choice(worker_actors[index])
+                start = time.perf_counter()
+                try:
+                    statuses = actor.request(name)
+                    failed = any(status >= 400 for status in statuses)
+                except Exception:
+                    failed = True
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies[name].append(elapsed)
+                    if failed:
+                        errors[name] += 1
+        finally:
+            connections.close_all()
+
+    started_at = datetime.now(dt_timezone.utc)
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(index,), name=f'bench-{index}') for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    def summary(values, error_count):
+        values = sorted(values)
+        result = {
+            'requests': len(values),
+            'errors': error_count,
+            'throughput_rps': round(len(values) / wall, 2) if wall else None,
+            'mean_ms': round(sum(values) / len(values) * 1000, 2) if values else None,
+            'max_ms': round(values[-1] * 1000, 2) if values else None,
+        }
+        for pct in PERCENTILES:
+            value = percentile(values, pct)
+            result[f'p{pct}_ms'] = round(value * 1000, 2) if value is not None else None
+        return result
+
+    return {
+        'started_at': started_at.isoformat(),
+        'target': target,
+        'concurrency': concurrency,
+        'actors': len(actors),
+        'mix': dict(mix),
+        'seed': seed,
+        'duration_s': round(wall, 3),
+        'overall': summary([value for values in latencies.values() for value in values], sum(errors.values())),
+        'endpoints': {name: summary(latencies[name], errors[name]) for name in names if latencies[name]},
+    }
+
+
+def compare(baseline, report, key='p95_ms'):
+    """
+    ``{endpoint: (before, after, change %)}`` for ``key`` across two reports.
+    """
+    rows = {}
+    for name, after in {**report['endpoints'], 'overall': report['overall']}.items():
+        before = baseline['overall'] if name == 'overall' else baseline.get('endpoints', {}).get(name)
+        if not before or before.get(key) in (None, 0) or after.get(key) is None:
+            continue
+        rows[name] = (before[key], after[key], round((after[key] - before[key]) / before[key] * 100, 1))
+    return rows
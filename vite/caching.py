@@ -0,0 +1,69 @@
+# caching.py
+"""
+Caching helpers.
+
+Authenticated pages are never cached whole: they are per-user. Instead the
+expensive parts (stories strip, reels strip, post cards) are cached as
+template fragments keyed on the viewer and on a *generation* number. Model
+signals bump the generation (see ``signals.py``), which retires every
+fragment built from the old data without having to find and delete keys.
+"""
+from functools import wraps
+
+from django.core.cache import cache
+from django.views.decorators.cache import cache_page
+
+FRAGMENT_TIMEOUT = 60 * 5
+
+STORIES = 'stories'
+REELS = 'reels'
+
+
+def _generation_key(name):
+    return f"fragment-gen:{name}"
+
+
+def post_fragment(post_id):
+    return f"post:{post_id}"
+
+
+def get_generation(name):
+    return cache.get_or_set(_generation_key(name), 1, None)
+
+
+def get_generations(names):
+    """
+    Batch variant of ``get_generation``: one cache round trip for a page of posts.
+    """
+    keys = {_generation_key(name): name for name in names}
+    found = cache.get_many(keys)
+    missing = {key: 1 for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {keys[key]: value for key, value in found.items()}
+
+
+def invalidate(name):
+    try:
+        cache.incr(_generation_key(name))
+    except ValueError:
+        # No generation stored yet, so nothing was cached under the old one.
+        pass
+
+
+def anonymous_cache_page(timeout):
+    """
+    Like ``cache_page`` but only for anonymous visitors; signed-in users always
+    get a freshly rendered page.
+    """
+    def decorator(view_func):
+        cached_view = cache_page(timeout)(view_func)
+
+        @wraps(view_func)
+        def _wrapped(request, *args, **kwargs):
+            if request.user.is_authenticated:
+                return view_func(request, *args, **kwargs)
+            return cached_view(request, *args, **kwargs)
+        return _wrapped
+    return decorator
@@ -0,0 +1,135 @@
+# consumers.py
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import JsonWebsocketConsumer
+
+from . import counters, graph
+from .messaging import broadcast_new_message, conversation_group_name, delete_message, mark_conversation_seen
+from .models import CustomUser, Message
+from .realtime import user_group_name
+
+
+def _message_id(value):
+    """
+    A client-supplied message id as an int, or ``None``.
+    """
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ChatConsumer(JsonWebsocketConsumer):
+    """
+    One socket per open chat window (``ws/chat/<username>/``).
+
+    Server -> client events:
+        {"type": "message", "message": {...}}
+        {"type": "seen", "ids": [...], "reader": "...", "seen_at": "..."}
+        {"type": "deleted", "id": ...}
+
+    Client -> server actions:
+        {"action": "send", "content": "...", "reply_to": <id>}
+        {"action": "seen"}
+        {"action": "delete", "id": <id>}
+
+    Media messages are still uploaded through the ``send_message`` view, which
+    broadcasts to the same group. Friendship is checked again on every send:
+    unfriending or blocking ends the conversation mid-session too.
+    """
+
+    def connect(self):
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            self.close()
+            return
+
+        username = self.scope["url_route"]["kwargs"]["username"]
+        other_user = CustomUser.objects.filter(username=username).first()
+        if other_user is None or not graph.are_friends(user.id, other_user.id):
+            self.close()
+            return
+
+        self.user = user
+        self.other_user = other_user
+        group_name = conversation_group_name(user.id, other_user.id)
+        # Added to self.groups so the base class discards it on disconnect.
+        self.groups.append(group_name)
+        async_to_sync(self.channel_layer.group_add)(group_name, self.channel_name)
+        self.accept()
+
+    def receive_json(self, content, **kwargs):
+        action = content.get("action")
+        if action == "send":
+            self.send_text_message(content)
+        elif action == "seen":
+            mark_conversation_seen(self.user, self.other_user)
+        elif action == "delete":
+            self.delete_own_message(content.get("id"))
+        else:
+            self.send_json({"type": "error", "error": "إجراء غير معروف."})
+
+    def send_text_message(self, content):
+        text = str(content.get("content", "")).strip()
+        if not text:
+            self.send_json({"type": "error", "error": "لا يمكن إرسال رسالة فارغة"})
+            return
+        other_id = self.other_user.id
+        if not graph.are_friends(self.user.id, other_id) or other_id in graph.hidden_ids(self.user.id):
+            self.send_json({"type": "error", "error": "لا يمكنك مراسلة شخص ليس صديقك."})
+            return
+
+        participants = [self.user, self.other_user]
+        reply_to = None
+        if content.get("reply_to"):
+            reply_to_id = _message_id(content["reply_to"])
+            if reply_to_id is None:
+                self.send_json({"type": "error", "error": "معرف رسالة غير صالح."})
+                return
+            reply_to = Message.objects.filter(
+                id=reply_to_id, sender__in=participants, receiver__in=participants
+            ).select_related('sender').first()
+
+        message = Message.objects.create(
+            sender=self.user,
+            receiver=self.other_user,
+            content=text,
+            reply_to=reply_to,
+        )
+        broadcast_new_message(message)
+
+    def delete_own_message(self, message_id):
+        message_id = _message_id(message_id)
+        message = Message.objects.filter(id=message_id, sender=self.user).first() if message_id else None
+        if message is None:
+            self.send_json({"type": "error", "error": "Message not found or permission denied."})
+            return
+        delete_message(message)
+
+    def client_push(self, event):
+        self.send_json(event["payload"])
+
+
+class UserEventsConsumer(JsonWebsocketConsumer):
+    """
+    Per-user socket (``ws/events/``) opened by every page extending ``base.html``.
+
+    Sends the current unread counters on connect, then every change:
+        {"type": "counters", "notifications": <n>, "messages": <n>}
+    """
+
+    def connect(self):
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            self.close()
+            return
+
+        group_name = user_group_name(user.id)
+        self.groups.append(group_name)
+        async_to_sync(self.channel_layer.group_add)(group_name, self.channel_name)
+        self.accept()
+        self.send_json({"type": "counters", **counters.get_unread_counts(user.id)})
+
+    def client_push(self, event):
+        self.send_json(event["payload"])
@@ -0,0 +1,84 @@
+# counters.py
+"""
+Per-user unread counters (notifications and messages) kept in the cache.
+
+A counter is computed with one COUNT the first time it is read, then kept
+current with ``incr``/``decr`` as rows are created or marked read, once
+the transaction that changed them commits. Counters expire after
+``COUNTER_TIMEOUT`` so any drift heals on the next read. Every change is
+pushed to the user's open sockets (``UserEventsConsumer``) with the values
+that are cached; a write never runs a COUNT just to push.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Message, Notification
+from .realtime import push_to_user
+
+NOTIFICATIONS = 'notifications'
+MESSAGES = 'messages'
+COUNTER_TIMEOUT = 60 * 60
+
+
+def _key(kind, user_id):
+    return f"unread:{kind}:{user_id}"
+
+
+def _count_from_db(kind, user_id):
+    if kind == NOTIFICATIONS:
+        return Notification.objects.filter(recipient_id=user_id, is_read=False).count()
+    return Message.objects.filter(receiver_id=user_id, is_read=False).count()
+
+
+def get_unread_count(kind, user_id):
+    count = cache.get(_key(kind, user_id))
+    if count is None:
+        count = _count_from_db(kind, user_id)
+        cache.set(_key(kind, user_id), count, COUNTER_TIMEOUT)
+    return count
+
+
+def get_unread_counts(user_id):
+    return {
+        NOTIFICATIONS: get_unread_count(NOTIFICATIONS, user_id),
+        MESSAGES: get_unread_count(MESSAGES, user_id),
+    }
+
+
+def adjust(kind, user_id, delta, push=True):
+    """
+    Applies ``delta`` to a cached counter when the current transaction
+    commits (nothing on rollback) and pushes the new counts. A counter that
+    is not cached is left alone; it is recomputed on its next read.
+    """
+    if not delta:
+        return
+    key = _key(kind, user_id)
+
+    def apply():
+        try:
+            value = cache.incr(key, delta)
+        except ValueError:
+            value = None
+        if value is not None and value < 0:
+            cache.delete(key)
+        if push:
+            push_counts(user_id)
+
+    transaction.on_commit(apply)
+
+
+def reset(kind, user_id):
+    cache.set(_key(kind, user_id), 0, COUNTER_TIMEOUT)
+    push_counts(user_id)
+
+
+def push_counts(user_id):
+    """
+    Pushes the user's cached counters; ones that are not cached are left
+    out rather than counted.
+    """
+    cached = cache.get_many([_key(kind, user_id) for kind in (NOTIFICATIONS, MESSAGES)])
+    counts = {kind: cached[_key(kind, user_id)] for kind in (NOTIFICATIONS, MESSAGES) if _key(kind, user_id) in cached}
+    if counts:
+        push_to_user(user_id, {"type": "counters", **counts})
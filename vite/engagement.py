@@ -0,0 +1,74 @@
+# engagement.py
+"""
+Denormalized like and comment counts on posts, reels and stories.
+
+``signals.py`` calls ``adjust`` when a like or comment row is created or
+deleted; the parent's counter column moves with an ``F()`` UPDATE in the
+same transaction as the row, so rendering a count never aggregates. Rows
+deleted along with their parent (a post and its likes) are skipped: the
+counter goes with the parent, and deleting a popular post stays a few
+batched DELETEs instead of an UPDATE per like.
+``reconcile`` (``manage.py reconcile_counters``) recounts and repairs any
+drift, e.g. after raw SQL or bulk deletes that skip signals.
+"""
+from django.db.models import F, QuerySet, Value
+from django.db.models.functions import Greatest
+
+from .feed import count_subquery
+from .models import Comment, Like, Post, Reel, ReelComment, ReelLike, Story, StoryLike
+
+RECONCILE_BATCH_SIZE = 1000
+
+# child model -> (foreign key to the parent, counter column on the parent)
+COUNTED = {
+    Like: ('post', 'likes_count'),
+    Comment: ('post', 'comments_count'),
+    ReelLike: ('reel', 'likes_count'),
+    ReelComment: ('reel', 'comments_count'),
+    StoryLike: ('story', 'likes_count'),
+}
+PARENT_MODELS = {model.__name__.lower(): model for model in (Post, Reel, Story)}
+
+
+def _parent_model(child, fk_name):
+    return child._meta.get_field(fk_name).related_model
+
+
+def deleted_with_parent(instance, origin):
+    """
+    Whether ``instance`` is being deleted by a cascade from its own parent;
+    ``origin`` is what ``delete()`` was called on (``post_delete`` kwarg).
+    """
+    fk_name, _ = COUNTED[type(instance)]
+    parent = _parent_model(type(instance), fk_name)
+    if isinstance(origin, QuerySet):
+        return origin.model is parent
+    return isinstance(origin, parent) and origin.pk == getattr(instance, f"{fk_name}_id")
+
+
+def adjust(instance, delta):
+    fk_name, column = COUNTED[type(instance)]
+    parent = _parent_model(type(instance), fk_name)
+    parent.objects.filter(pk=getattr(instance, f"{fk_name}_id")).update(
+        **{column: Greatest(F(column) + delta, Value(0))}
+    )
+
+
+def reconcile(models=None):
+    """
+    Recounts every counter and rewrites the drifted ones. Returns
+    ``{'Post.likes_count': rows repaired, ...}``.
+    """
+    repaired = {}
+    for child, (fk_name, column) in COUNTED.items():
+        parent = _parent_model(child, fk_name)
+        if models and parent not in models:
+            continue
+        actual = count_subquery(child, fk_name)
+        drifted = list(parent.objects.alias(actual=actual).exclude(**{column: F('actual')}).values_list('pk', flat=True))
+        for start in range(0, len(drifted), RECONCILE_BATCH_SIZE):
+            batch = drifted[start:start + RECONCILE_BATCH_SIZE]
+            parent.objects.filter(pk__in=batch).update(**{column: actual})
+        repaired[f"{parent.__name__}.{column}"] = len(drifted)
+    return repaired
+
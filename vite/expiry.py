@@ -0,0 +1,100 @@
+# expiry.py
+"""
+Story expiry.
+
+``sweep`` deletes stories whose ``expires_at`` has passed, in batches: each
+batch locks its stories, deletes their likes and then the stories with
+plain DELETEs (no per-row signals: the like counters and the cached tray do
+not matter for rows that are going away, the tray already drops expired
+entries) and queues their Cloudinary assets, image variants included, as
+``MediaDeletion`` rows in the same transaction. ``purge_media`` then
+destroys the queued assets with the media backend's bulk delete
+(Cloudinary's ``delete_resources``); a failed call leaves its rows pending
+for the next run, up to ``MAX_ATTEMPTS``.
+
+Both run from ``manage.py sweep_stories`` (cron, or ``--interval`` for a
+long-running worker).
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import images, media
+from .models import MediaDeletion, Story, StoryLike
+
+logger = logging.getLogger(__name__)
+
+SWEEP_BATCH_SIZE = 500
+# Cloudinary accepts at most 100 public ids per delete_resources call.
+PURGE_BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+MEDIA_FIELDS = {'image': 'image', 'video': 'video'}
+
+
+def expired_stories(now=None):
+    return Story.objects.filter(expires_at__lte=now or timezone.now())
+
+
+def sweep(batch_size=SWEEP_BATCH_SIZE, now=None):
+    """
+    Deletes every expired story with its likes. Returns ``(stories, media)``:
+    how many stories were deleted and how many assets were queued.
+    """
+    now = now or timezone.now()
+    stories = media = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                expired_stories(now).order_by('expires_at').select_for_update()
+                .values_list('pk', 'image_variants', *MEDIA_FIELDS)[:batch_size]
+            )
+            if not batch:
+                return stories, media
+            ids = [row[0] for row in batch]
+            deletions = [
+                MediaDeletion(public_id=resource.public_id, resource_type=resource_type)
+                for row in batch
+                for resource, resource_type in zip(row[2:], MEDIA_FIELDS.values())
+                if resource and getattr(resource, 'public_id', None)
+            ]
+            deletions += [deletion for row in batch for entry in row[1].values() for deletion in images.deletions(entry)]
+            MediaDeletion.objects.bulk_create(deletions)
+            StoryLike.objects.filter(story_id__in=ids)._raw_delete(StoryLike.objects.db)
+            Story.objects.filter(pk__in=ids)._raw_delete(Story.objects.db)
+        stories += len(ids)
+        media += len(deletions)
+
+
+def purge_media(limit=None):
+    """
+    Destroys queued assets. Returns ``(destroyed, failed)``; assets Cloudinary
+    no longer has count as destroyed.
+    """
+    pending = MediaDeletion.objects.filter(status=MediaDeletion.PENDING).order_by('created_at')
+    if limit:
+        pending = pending[:limit]
+    by_type = {}
+    for deletion in pending.only('pk', 'public_id', 'resource_type'):
+        by_type.setdefault(deletion.resource_type, []).append(deletion)
+
+    destroyed = failed = 0
+    for resource_type, deletions in by_type.items():
+        for start in range(0, len(deletions), PURGE_BATCH_SIZE):
+            batch = deletions[start:start + PURGE_BATCH_SIZE]
+            ids = [deletion.pk for deletion in batch]
+            try:
+                media.delete_many([deletion.public_id for deletion in batch], resource_type=resource_type)
+            except Exception as e:
+                logger.warning("Destroying %s %s assets failed: %s", len(batch), resource_type, e)
+                MediaDeletion.objects.filter(pk__in=ids).update(
+                    attempts=F('attempts') + 1, error=str(e), updated_at=timezone.now()
+                )
+                failed += MediaDeletion.objects.filter(pk__in=ids, attempts__gte=MAX_ATTEMPTS).update(
+                    status=MediaDeletion.FAILED
+                )
+                continue
+            MediaDeletion.objects.filter(pk__in=ids).delete()
+            destroyed += len(batch)
+    return destroyed, failed
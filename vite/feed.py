@@ -0,0 +1,126 @@
+# feed.py
+"""
+Home feed: keyset pagination over posts with a fixed number of queries per page.
+
+The cursor encodes the ``(created_at, id)`` of the last post on the previous
+page, so every page is a single index range scan instead of an OFFSET.
+Per-post data the templates need (like/save state, counts, a few comments and
+likers) is attached with annotations and sliced prefetches.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Count, Exists, IntegerField, OuterRef, Prefetch, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from . import caching, graph, images, presence
+from .models import Comment, CustomUser, Like, Post, SavedPost
+
+FEED_PAGE_SIZE = 10
+FEED_MAX_PAGE_SIZE = 50
+FEED_COMMENTS_PREVIEW = 5
+FEED_LIKERS_PREVIEW = 20
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(post):
+    raw = f"{post.created_at.isoformat()}|{post.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def count_subquery(model, fk_name):
+    counts = model.objects.filter(**{fk_name: OuterRef('pk')}).order_by().values(fk_name).annotate(
+        total=Count('pk')
+    ).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def annotate_posts(queryset, user):
+    """
+    Attach everything ``post_template.html`` reads so rendering a post costs no extra queries.
+    """
+    friends_through = CustomUser.friends.through
+    author_friends = friends_through.objects.filter(
+        from_customuser_id=OuterRef('user_id')
+    ).order_by().values('from_customuser_id').annotate(total=Count('pk')).values('total')
+
+    return queryset.select_related('user').annotate(
+        is_liked=Exists(Like.objects.filter(post_id=OuterRef('pk'), user=user)),
+        is_saved=Exists(SavedPost.objects.filter(post_id=OuterRef('pk'), user=user)),
+        author_friends_total=Coalesce(Subquery(author_friends, output_field=IntegerField()), Value(0)),
+    ).prefetch_related(
+        Prefetch(
+            'comments',
+            queryset=Comment.objects.select_related('user').order_by('-created_at')[:FEED_COMMENTS_PREVIEW],
+            to_attr='preview_comments',
+        ),
+        Prefetch(
+            'likes',
+            queryset=Like.objects.select_related('user').order_by('-created_at')[:FEED_LIKERS_PREVIEW],
+            to_attr='preview_likes',
+        ),
+    )
+
+
+def finalize_posts(posts):
+    """
+    Copy annotations onto related objects once the queryset has been evaluated.
+    """
+    generations = caching.get_generations(caching.post_fragment(post.pk) for post in posts)
+    presence.attach([post.user for post in posts])
+    for post in posts:
+        post.user.friends_total = post.author_friends_total
+        post.cache_generation = generations[caching.post_fragment(post.pk)]
+        # Oldest first, like the unbounded ``post.comments.all`` used to render.
+        post.preview_comments.reverse()
+    return posts
+
+
+def get_feed_page(user, cursor=None, page_size=FEED_PAGE_SIZE):
+    """
+    Returns ``(posts, next_cursor)`` for the home feed of ``user``.
+
+    ``next_cursor`` is ``None`` on the last page. Raises ``InvalidCursor`` for
+    a malformed cursor.
+    """
+    page_size = max(1, min(page_size, FEED_MAX_PAGE_SIZE))
+    posts = Post.objects.exclude(user_id__in=graph.blocked_ids(user.id))
+
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        posts = posts.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+
+    posts = list(annotate_posts(posts, user).order_by('-created_at', '-pk')[:page_size + 1])
+    next_cursor = None
+    if len(posts) > page_size:
+        posts = posts[:page_size]
+        next_cursor = encode_cursor(posts[-1])
+    return finalize_posts(posts), next_cursor
+
+
+def serialize_post(post):
+    return {
+        'id': post.id,
+        'user': post.user.username,
+        'content': post.content,
+        'image_url': post.image.url if post.image else None,
+        'image_srcset': images.srcsets(post, 'image'),
+        'video_url': post.video.url if post.video else None,
+        'created_at': post.created_at.isoformat(),
+        'likes_count': post.likes_count,
+        'comments_count': post.comments_count,
+        'is_liked': post.is_liked,
+        'is_saved': post.is_saved,
+    }
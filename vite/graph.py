@@ -0,0 +1,138 @@
+# graph.py
+"""
+Friend graph: per-user sets of friend, blocked and friend request ids.
+
+Each set is loaded with one query the first time it is needed and kept in
+the cache, so membership checks (``are_friends``, ``is_blocked``) and
+``friend_count`` cost no query afterwards. ``signals.py`` drops the
+affected sets on ``m2m_changed``; ``GRAPH_TIMEOUT`` bounds anything missed
+(rows removed by cascading deletes). The ``*_many`` variants load the sets
+of a whole page of users at once.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from . import models
+
+FRIENDS = 'friends'
+BLOCKED = 'blocked'
+BLOCKED_BY = 'blocked_by'
+SENT_REQUESTS = 'sent_requests'
+RECEIVED_REQUESTS = 'received_requests'
+GRAPH_TIMEOUT = 60 * 60 * 24
+
+# kind -> (m2m field, column of the owning user, column of the ids in the set)
+_EDGES = {
+    FRIENDS: ('friends', 'from_customuser_id', 'to_customuser_id'),
+    BLOCKED: ('blocked_users', 'from_customuser_id', 'to_customuser_id'),
+    BLOCKED_BY: ('blocked_users', 'to_customuser_id', 'from_customuser_id'),
+    SENT_REQUESTS: ('friend_requests', 'from_customuser_id', 'to_customuser_id'),
+    RECEIVED_REQUESTS: ('friend_requests', 'to_customuser_id', 'from_customuser_id'),
+}
+# m2m field -> (kind seen from the "from" side, kind seen from the "to" side)
+_FIELD_KINDS = {
+    'friends': (FRIENDS, None),
+    'blocked_users': (BLOCKED, BLOCKED_BY),
+    'friend_requests': (SENT_REQUESTS, RECEIVED_REQUESTS),
+}
+
+
+def _key(kind, user_id):
+    return f"graph:{kind}:{user_id}"
+
+
+def _load(kind, user_ids):
+    field, owner, target = _EDGES[kind]
+    through = getattr(models.CustomUser, field).through
+    sets = {user_id: set() for user_id in user_ids}
+    for owner_id, target_id in through.objects.filter(**{f"{owner}__in": user_ids}).values_list(owner, target):
+        sets[owner_id].add(target_id)
+    return {user_id: frozenset(ids) for user_id, ids in sets.items()}
+
+
+def get_ids_many(kind, user_ids):
+    """
+    ``{user_id: frozenset of ids}`` for every user in ``user_ids``: one cache
+    round trip, plus one query for the users that were not cached.
+    """
+    user_ids = set(user_ids)
+    keys = {_key(kind, user_id): user_id for user_id in user_ids}
+    found = {keys[key]: ids for key, ids in cache.get_many(keys).items()}
+    missing = user_ids - found.keys()
+    if missing:
+        loaded = _load(kind, missing)
+        cache.set_many({_key(kind, user_id): ids for user_id, ids in loaded.items()}, GRAPH_TIMEOUT)
+        found.update(loaded)
+    return found
+
+
+def get_ids(kind, user_id):
+    return get_ids_many(kind, [user_id])[user_id]
+
+
+def friend_ids(user_id):
+    return get_ids(FRIENDS, user_id)
+
+
+def blocked_ids(user_id):
+    return get_ids(BLOCKED, user_id)
+
+
+def hidden_ids(user_id):
+    """
+    Users hidden from ``user_id``: those they blocked and those blocking them.
+    """
+    return blocked_ids(user_id) | get_ids(BLOCKED_BY, user_id)
+
+
+def are_friends(user_id, other_id):
+    return other_id in friend_ids(user_id)
+
+
+def is_blocked(user_id, other_id):
+    """
+    Whether ``user_id`` blocked ``other_id``.
+    """
+    return other_id in blocked_ids(user_id)
+
+
+def has_sent_request(user_id, other_id):
+    return other_id in get_ids(SENT_REQUESTS, user_id)
+
+
+def has_received_request(user_id, other_id):
+    return other_id in get_ids(RECEIVED_REQUESTS, user_id)
+
+
+def friend_count(user_id):
+    return len(friend_ids(user_id))
+
+
+def friend_counts(user_ids):
+    return {user_id: len(ids) for user_id, ids in get_ids_many(FRIENDS, user_ids).items()}
+
+
+def attach_friend_counts(users):
+    """
+    Sets ``friends_total`` (read by ``has_blue_badge``) on every user of a list page.
+    """
+    counts = friend_counts(user.pk for user in users)
+    for user in users:
+        user.friends_total = counts[user.pk]
+    return users
+
+
+def invalidate(field, from_ids=(), to_ids=()):
+    """
+    Drops the cached sets touched by a change to the ``field`` m2m between
+    ``from_ids`` and ``to_ids`` users.
+    """
+    from_kind, to_kind = _FIELD_KINDS[field]
+    keys = [_key(from_kind, user_id) for user_id in from_ids]
+    if to_kind:
+        keys += [_key(to_kind, user_id) for user_id in to_ids]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    # Again after commit, in case a concurrent request reloaded the old rows in between.
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,207 @@
+# images.py
+"""
+Responsive image variants.
+
+Before the upload worker (``uploads.py``) sends an image to the media
+backend, ``prepare`` rewrites the spooled file: the EXIF orientation is
+applied, EXIF/GPS/XMP metadata is dropped and the image is scaled down to
+``MAX_WIDTH``. Once the original is stored, ``save_variants`` encodes it at
+each width of ``WIDTHS`` (never wider than the image) in each of
+``FORMATS`` (AVIF when Pillow has it, and WebP) on a thread pool, uploads
+them next to it as ``<public_id>_w<width>_<format>`` and records them in
+the owner's ``image_variants`` column, keyed by field name.
+
+``srcset``, ``srcsets`` and ``url`` read that column, so templates
+(``{% load responsive %}``) and JSON APIs get size-appropriate URLs with no
+queries. Images without variants (uploaded before this, the default avatar)
+fall back to the original URL.
+"""
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import cloudinary
+from django.conf import settings
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from . import media, models
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = (160, 320, 640, 1080)
+MAX_WIDTH = 2048
+FORMATS = tuple(fmt for fmt in ('avif', 'webp') if features.check(fmt))
+DEFAULT_FORMAT = 'webp'
+QUALITY = {'avif': 55, 'webp': 80, 'JPEG': 85}
+# Fields that get variants; QR codes are uploaded by ``qrcodes.py`` instead.
+FIELDS = {'image', 'profile_picture', 'cover_photo'}
+AVATAR_WIDTH = 160
+WORKERS = getattr(settings, 'IMAGE_ENCODE_WORKERS', os.cpu_count() or 2)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='image-encode')
+    return _executor
+
+
+def prepare(path):
+    """
+    Strips the metadata of the spooled image at ``path`` and scales it down
+    to ``MAX_WIDTH``, in place. Returns the decoded image, or ``None`` for
+    files left as they are (not an image, animated).
+    """
+    try:
+        with Image.open(path) as original:
+            if getattr(original, 'is_animated', False):
+                return None
+            source_format = original.format
+            icc_profile = original.info.get('icc_profile')
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return None
+
+    if image.width > MAX_WIDTH:
+        image = image.resize((MAX_WIDTH, max(1, round(image.height * MAX_WIDTH / image.width))), Image.LANCZOS)
+    save_format = source_format if source_format in ('PNG', 'WEBP') else 'JPEG'
+    if save_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    # Only what is passed to save() is written: no EXIF, GPS or XMP.
+    options = {'quality': QUALITY['JPEG']} if save_format == 'JPEG' else {}
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    image.save(tmp_path, format=save_format, **options)
+    os.replace(tmp_path, path)
+    return image
+
+
+def _ladder(width):
+    widths = [w for w in WIDTHS if w < width]
+    if width <= WIDTHS[-1]:
+        widths.append(width)
+    return widths
+
+
+def variant_id(public_id, width, fmt):
+    return f"{public_id}_w{width}_{fmt}"
+
+
+def _encode(image, width, fmt):
+    if width < image.width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+    buffer = BytesIO()
+    image.save(buffer, format=fmt.upper(), quality=QUALITY[fmt])
+    buffer.seek(0)
+    buffer.name = f"{width}.{fmt}"
+    return buffer
+
+
+def upload_variants(image, resource):
+    """
+    Encodes and uploads the variants of ``image``, the prepared original of
+    ``resource``. Returns its ``image_variants`` entry, or ``None``.
+    """
+    if not FORMATS:
+        return None
+    widths = _ladder(image.width)
+
+    def upload(job):
+        width, fmt = job
+        return media.upload(
+            _encode(image, width, fmt), public_id=variant_id(resource.public_id, width, fmt),
+            type=resource.type, resource_type='image', overwrite=True,
+        )
+
+    list(_get_executor().map(upload, [(width, fmt) for width in widths for fmt in FORMATS]))
+    return {'public_id': resource.public_id, 'type': resource.type, 'widths': widths, 'formats': list(FORMATS)}
+
+
+def deletions(entry):
+    """
+    ``MediaDeletion`` rows for every variant of an ``image_variants`` entry.
+    """
+    return [
+        models.MediaDeletion(public_id=variant_id(entry['public_id'], width, fmt), resource_type='image')
+        for width in entry['widths'] for fmt in entry['formats']
+    ]
+
+
+def save_variants(target, field_name, resource, image):
+    """
+    Sets ``resource`` on ``target`` and records its variants, queueing the
+    ones of the image it replaces for deletion. The column is re-read under
+    a row lock: two fields of one row can finish uploading at once.
+    """
+    try:
+        entry = upload_variants(image, resource)
+    except Exception as e:
+        logger.warning("Image variants of %s failed: %s", resource.public_id, e)
+        entry = None
+
+    with transaction.atomic():
+        variants = type(target).objects.select_for_update().values_list('image_variants', flat=True).get(pk=target.pk)
+        previous = variants.pop(field_name, None)
+        if previous and previous['public_id'] != resource.public_id:
+            models.MediaDeletion.objects.bulk_create(deletions(previous))
+        if entry:
+            variants[field_name] = entry
+        target.image_variants = variants
+        setattr(target, field_name, resource)
+        target.save(update_fields=[field_name, 'image_variants'])
+
+
+def _entry(instance, field_name):
+    entry = (getattr(instance, 'image_variants', None) or {}).get(field_name)
+    resource = getattr(instance, field_name, None)
+    if not entry or getattr(resource, 'public_id', None) != entry['public_id']:
+        return None
+    return entry
+
+
+def _variant_url(entry, width, fmt):
+    return cloudinary.CloudinaryImage(
+        variant_id(entry['public_id'], width, fmt), format=fmt, type=entry.get('type', 'upload')
+    ).build_url()
+
+
+def srcset(instance, field_name, fmt=DEFAULT_FORMAT):
+    """
+    The ``srcset`` of ``instance.<field_name>`` in ``fmt``, or ``''``.
+    """
+    entry = _entry(instance, field_name)
+    if entry is None or fmt not in entry['formats']:
+        return ''
+    return ', '.join(f"{_variant_url(entry, width, fmt)} {width}w" for width in entry['widths'])
+
+
+def srcsets(instance, field_name):
+    """
+    ``{format: srcset}`` for JSON APIs, or ``None`` without variants.
+    """
+    entry = _entry(instance, field_name)
+    if entry is None:
+        return None
+    return {fmt: srcset(instance, field_name, fmt) for fmt in entry['formats']}
+
+
+def url(instance, field_name, width, fmt=DEFAULT_FORMAT):
+    """
+    The smallest variant at least ``width`` pixels wide (else the widest);
+    the original's URL without variants, or ``''`` without an image.
+    """
+    entry = _entry(instance, field_name)
+    if entry is None or fmt not in entry['formats']:
+        resource = getattr(instance, field_name, None)
+        return resource.url if resource and hasattr(resource, 'url') else ''
+    fitting = [w for w in entry['widths'] if w >= width]
+    return _variant_url(entry, min(fitting) if fitting else max(entry['widths']), fmt)
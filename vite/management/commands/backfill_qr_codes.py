@@ -0,0 +1,52 @@
+# backfill_qr_codes.py
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import django
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from vite import qrcodes
+from vite.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "يرسم أكواد QR للمستخدمين الذين ليس لديهم كود، ويرفعها إلى Cloudinary عند طلب ذلك"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Processes used to render the PNGs.")
+        parser.add_argument('--upload', action='store_true',
+                            help="Also upload to Cloudinary and store the URL on the user.")
+        parser.add_argument('--upload-threads', type=int, default=8)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true',
+                            help="Include users that already have a QR code.")
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.order_by('pk')
+        if not options['all']:
+            users = users.filter(Q(qr_code__isnull=True) | Q(qr_code=''))
+        rows = list(users.values_list('pk', 'username'))
+        if not rows:
+            self.stdout.write("لا يوجد مستخدمون بحاجة إلى كود QR.")
+            return
+
+        # Rendering is CPU bound (qrcode + PIL), so it runs in separate processes. Workers set
+        # Django up themselves instead of relying on fork, and write where this process reads.
+        render = partial(qrcodes.render_to_disk, root=qrcodes.cache_root())
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            rendered = len(list(pool.map(render, [username for _, username in rows], chunksize=64)))
+        self.stdout.write(f"rendered={rendered}")
+
+        if not options['upload']:
+            return
+
+        # Uploads are network bound; threads are enough.
+        with ThreadPoolExecutor(max_workers=options['upload_threads']) as pool:
+            urls = list(pool.map(qrcodes.upload, *zip(*rows)))
+
+        updated = [CustomUser(pk=pk, qr_code=url) for (pk, _), url in zip(rows, urls)]
+        CustomUser.objects.bulk_update(updated, ['qr_code'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"uploaded={len(updated)}"))
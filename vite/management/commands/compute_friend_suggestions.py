@@ -0,0 +1,20 @@
+# compute_friend_suggestions.py
+from django.core.management.base import BaseCommand
+
+from vite import suggestions
+
+
+class Command(BaseCommand):
+    help = "يحسب اقتراحات الصداقة (أشخاص قد تعرفهم) من الأصدقاء المشتركين ويخزنها"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='*',
+                            help="Only rebuild the suggestions of these user ids.")
+        parser.add_argument('--limit', type=int, default=suggestions.SUGGESTIONS_PER_USER,
+                            help="Suggestions stored per user.")
+        parser.add_argument('--block-size', type=int, default=suggestions.BLOCK_SIZE,
+                            help="Users whose rows are multiplied and written together.")
+
+    def handle(self, *args, **options):
+        written = suggestions.compute(options['users'], limit=options['limit'], block_size=options['block_size'])
+        self.stdout.write(self.style.SUCCESS(f"suggestions={written}"))
@@ -0,0 +1,30 @@
+# process_media_uploads.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from vite import uploads
+
+
+class Command(BaseCommand):
+    help = "يرفع الوسائط المعلقة (بعد إعادة تشغيل الخادم أو فشل محاولة سابقة) إلى Cloudinary"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-minutes', type=int, default=15,
+                            help="Requeue uploads stuck in processing for longer than this.")
+        parser.add_argument('--limit', type=int, default=100)
+
+    def handle(self, *args, **options):
+        requeued = uploads.requeue_stale(timedelta(minutes=options['stale_minutes']))
+        done = failed = 0
+        for upload_id in uploads.pending_uploads().values_list('id', flat=True)[:options['limit']]:
+            upload = uploads.process(upload_id)
+            if upload is None:
+                continue
+            if upload.status == upload.DONE:
+                done += 1
+            elif upload.status == upload.FAILED:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"requeued={requeued} uploaded={done} failed={failed}"
+        ))
@@ -0,0 +1,17 @@
+# prune_notifications.py
+from django.core.management.base import BaseCommand
+
+from vite import notify
+
+
+class Command(BaseCommand):
+    help = "يحذف الإشعارات المقروءة الأقدم من مدة الاحتفاظ على دفعات"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=notify.RETENTION_DAYS,
+                            help="Delete read notifications older than this many days.")
+        parser.add_argument('--batch-size', type=int, default=notify.PRUNE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        deleted = notify.prune(days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"deleted={deleted}"))
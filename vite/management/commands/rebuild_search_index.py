@@ -0,0 +1,15 @@
+# rebuild_search_index.py
+from django.core.management.base import BaseCommand
+
+from vite import search
+
+
+class Command(BaseCommand):
+    help = "يعيد بناء فهرس البحث عن المستخدمين بعد كتابات تتجاوز الإشارات (bulk_create أو SQL مباشر)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        repaired = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"repaired={repaired}"))
@@ -0,0 +1,19 @@
+# reconcile_counters.py
+from django.core.management.base import BaseCommand
+
+from vite import engagement
+
+
+class Command(BaseCommand):
+    help = "يعيد حساب عدادات الإعجابات والتعليقات المخزنة ويصلح أي انحراف"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(engagement.PARENT_MODELS), action='append',
+                            help="Only reconcile this model (repeatable).")
+
+    def handle(self, *args, **options):
+        models = [engagement.PARENT_MODELS[name] for name in options['model'] or []]
+        repaired = engagement.reconcile(models)
+        for counter, rows in repaired.items():
+            self.stdout.write(f"{counter}: repaired={rows}")
+        self.stdout.write(self.style.SUCCESS(f"repaired={sum(repaired.values())}"))
@@ -0,0 +1,47 @@
+# run_benchmark.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vite import benchmark
+
+
+class Command(BaseCommand):
+    help = "يعيد تشغيل مزيج من الطلبات (استطلاع الدردشة والشارات، الصفحة الرئيسية، الإعجاب، مشاهدة الريلز) ويقيس زمن الاستجابة"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', default='inprocess',
+                            help="'inprocess' (Django test client) or a base URL such as http://127.0.0.1:8000")
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--duration', type=float, help="Run for this many seconds instead of --requests.")
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--users', type=int, default=50, help="Distinct signed-in users to play.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+        parser.add_argument('--compare', help="A previous report to compare p95 latencies against.")
+
+    def handle(self, *args, **options):
+        try:
+            report = benchmark.run(
+                target=options['target'],
+                requests=options['requests'],
+                duration=options['duration'],
+                concurrency=options['concurrency'],
+                users=options['users'],
+                seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            for name, (before, after, change) in benchmark.compare(baseline, report).items():
+                self.stdout.write(f"{name}: p95 {before}ms -> {after}ms ({change:+}%)")
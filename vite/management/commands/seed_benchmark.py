@@ -0,0 +1,36 @@
+# seed_benchmark.py
+from django.core.management.base import BaseCommand
+
+from vite import seeding
+
+
+class Command(BaseCommand):
+    help = "ينشئ بيانات اصطناعية كبيرة (مستخدمون، صداقات، رسائل، إشعارات، ريلز) لقياس الأداء"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--friends', type=int, default=10, help="Friends per user.")
+        parser.add_argument('--posts', type=int, default=50000)
+        parser.add_argument('--likes', type=int, default=5, help="Likes per post.")
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--notifications', type=int, default=100000)
+        parser.add_argument('--reels', type=int, default=5000)
+        parser.add_argument('--viewers', type=int, default=20, help="Viewers per reel.")
+        parser.add_argument('--prefix', default='bench', help="Username prefix; must not be taken yet.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        written = seeding.seed_benchmark(
+            users=options['users'],
+            friends=options['friends'],
+            posts=options['posts'],
+            likes=options['likes'],
+            messages=options['messages'],
+            notifications=options['notifications'],
+            reels=options['reels'],
+            viewers=options['viewers'],
+            prefix=options['prefix'],
+            seed=options['seed'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(f"rows={sum(written.values())}"))
@@ -0,0 +1,26 @@
+# sweep_stories.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from vite import expiry
+
+
+class Command(BaseCommand):
+    help = "يحذف القصص المنتهية وإعجاباتها ثم يحذف وسائطها من Cloudinary"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=expiry.SWEEP_BATCH_SIZE)
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Keep running and sweep every this many seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            stories, queued = expiry.sweep(batch_size=options['batch_size'])
+            destroyed, failed = expiry.purge_media()
+            self.stdout.write(self.style.SUCCESS(
+                f"stories={stories} media_queued={queued} media_destroyed={destroyed} media_failed={failed}"
+            ))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
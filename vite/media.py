@@ -0,0 +1,309 @@
+# media.py
+"""
+Media backends.
+
+Everything that stores or deletes media goes through ``get_backend()``,
+picked by the ``MEDIA_BACKEND`` setting:
+
+* ``CloudinaryBackend`` (the default) calls the Cloudinary API.
+* ``LocalBackend`` emulates it on the filesystem under ``MEDIA_LOCAL_ROOT``
+  so tests, benchmarks and offline development never touch the network:
+  uploads get Cloudinary-style public ids, versions and formats and come
+  back as ``CloudinaryResource`` objects like the real ones, ``destroy`` and
+  ``delete_many`` remove the files. It points the Cloudinary URL builder at
+  ``local_media`` (``/media/cloudinary/...``), which serves the stored file
+  and renders the transformations the app uses (width, height, crop and
+  format; a video poster becomes a placeholder image). Only the sizes in
+  ``RENDITIONS`` (the ones the app links to) are rendered, anything else is
+  a 404, and rendered files are keyed by the transformation rather than the
+  URL, so made-up URLs can neither allocate huge images nor fill the disk.
+
+Values stored in a ``CloudinaryField`` are the same with either backend, and
+URLs are still built with ``resource.url``/``build_url``; ``poster_url``
+builds the poster frame URL of a video.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from io import BytesIO
+
+import cloudinary
+from cloudinary import api, uploader
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'vite.media.CloudinaryBackend'
+# What ``cloudinary.config`` needs to build URLs; ``LocalBackend`` overrides it.
+URL_CONFIG = ('cloud_name', 'secure', 'private_cdn', 'secure_distribution', 'cname', 'cdn_subdomain')
+LOCAL_URL_PATH = 'media/cloudinary'
+IMAGE_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'gif': 'GIF'}
+POSTER_SIZE = (300, 500)
+POSTER_COLOR = (40, 40, 40)
+POSTER = {'width': POSTER_SIZE[0], 'height': POSTER_SIZE[1], 'crop': 'fill'}
+# (width, height, crop) of every resized URL the app builds; LocalBackend renders nothing else.
+RENDITIONS = {(POSTER_SIZE[0], POSTER_SIZE[1], 'fill')}
+# Largest rendered width or height; images.MAX_WIDTH is the widest original.
+MAX_DIMENSION = 2048
+# Transformation keys as they appear in URLs (``w_300,h_500,c_fill``).
+TRANSFORMATION_KEYS = {'a', 'ar', 'b', 'c', 'dpr', 'du', 'e', 'eo', 'f', 'fl', 'g', 'h', 'o', 'q', 'r', 'so', 'w', 'x', 'y'}
+
+_lock = threading.Lock()
+_backend = None
+_backend_path = None
+_cloudinary_config = {key: getattr(cloudinary.config(), key, None) for key in URL_CONFIG}
+
+
+def get_backend():
+    """
+    The backend named by ``MEDIA_BACKEND``, created on first use (and again
+    if the setting changes, as it does under ``override_settings``).
+    """
+    global _backend, _backend_path
+    path = getattr(settings, 'MEDIA_BACKEND', DEFAULT_BACKEND)
+    root = getattr(settings, 'MEDIA_LOCAL_ROOT', None)
+    with _lock:
+        if _backend is None or _backend_path != (path, root):
+            _backend = import_string(path)()
+            _backend.activate()
+            _backend_path = (path, root)
+        return _backend
+
+
+def upload(file, **options):
+    return get_backend().upload(file, **options)
+
+
+def destroy(public_id, resource_type='image'):
+    return get_backend().destroy(public_id, resource_type=resource_type)
+
+
+def delete_many(public_ids, resource_type='image'):
+    return get_backend().delete_many(public_ids, resource_type=resource_type)
+
+
+def poster_url(public_id):
+    """
+    The JPEG poster frame of a video, as eagerly generated on upload.
+    """
+    get_backend()
+    return cloudinary.CloudinaryVideo(public_id).build_url(transformation=[POSTER], format='jpg', resource_type='video')
+
+
+class CloudinaryBackend:
+    def activate(self):
+        cloudinary.config(**_cloudinary_config)
+
+    def upload(self, file, **options):
+        """
+        Uploads a path or file object; returns a ``CloudinaryResource``.
+        """
+        return uploader.upload_resource(file, **options)
+
+    def destroy(self, public_id, resource_type='image'):
+        return uploader.destroy(public_id, resource_type=resource_type)
+
+    def delete_many(self, public_ids, resource_type='image'):
+        # At most 100 public ids per call.
+        return api.delete_resources(list(public_ids), resource_type=resource_type)
+
+
+class LocalBackend:
+    def __init__(self):
+        self.root = getattr(settings, 'MEDIA_LOCAL_ROOT', os.path.join(settings.BASE_DIR, 'media_local'))
+        self.host = getattr(settings, 'MEDIA_LOCAL_HOST', 'localhost:8000')
+
+    def activate(self):
+        distribution = f"{self.host}/{LOCAL_URL_PATH}"
+        cloudinary.config(
+            cloud_name='local', secure=False, private_cdn=True, cdn_subdomain=False,
+            secure_distribution=distribution, cname=distribution,
+        )
+
+    def _path(self, resource_type, upload_type, public_id, file_format):
+        name = f"{public_id}.{file_format}" if file_format else public_id
+        path = os.path.normpath(os.path.join(self.root, resource_type, upload_type, name))
+        if not path.startswith(os.path.join(os.path.normpath(self.root), '')):
+            raise ValueError(f"Invalid public id: {public_id}")
+        return path
+
+    def _find(self, resource_type, upload_type, public_id):
+        """
+        The stored file for ``public_id`` whatever its format, or ``None``.
+        """
+        directory, name = os.path.split(self._path(resource_type, upload_type, public_id, None))
+        try:
+            entries = os.listdir(directory)
+        except FileNotFoundError:
+            return None
+        for entry in entries:
+            if entry == name or (entry.startswith(f"{name}.") and '.' not in entry[len(name) + 1:]):
+                return os.path.join(directory, entry)
+        return None
+
+    def upload(self, file, **options):
+        """
+        Stores a path or file object; returns a ``CloudinaryResource`` with the
+        fields Cloudinary's upload response would have.
+        """
+        resource_type = options.get('resource_type', 'image')
+        upload_type = options.get('type', 'upload')
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, 'rb') as f:
+                data = f.read()
+            filename = os.fspath(file)
+        else:
+            if hasattr(file, 'seek'):
+                file.seek(0)
+            data = file.read()
+            filename = getattr(file, 'name', '') or ''
+
+        public_id = options.get('public_id') or uuid.uuid4().hex[:20]
+        folder = (options.get('folder') or '').strip('/')
+        if folder and not public_id.startswith(f"{folder}/"):
+            public_id = f"{folder}/{public_id}"
+        metadata = {}
+        file_format = os.path.splitext(filename)[1].lstrip('.').lower() or None
+        if resource_type == 'image':
+            from PIL import Image
+
+            with Image.open(BytesIO(data)) as image:
+                metadata.update(width=image.width, height=image.height)
+                file_format = {'jpeg': 'jpg'}.get(image.format.lower(), image.format.lower())
+
+        existing = self._find(resource_type, upload_type, public_id)
+        if existing and options.get('overwrite') is False:
+            raise ValueError(f"Resource already exists: {public_id}")
+        if existing:
+            os.remove(existing)
+        path = self._path(resource_type, upload_type, public_id, file_format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as out:
+            out.write(data)
+        os.replace(tmp_path, path)
+
+        resource = cloudinary.CloudinaryResource(
+            public_id, version=str(int(time.time())), format=file_format, type=upload_type, resource_type=resource_type,
+        )
+        metadata.update(
+            public_id=public_id, version=int(resource.version), format=file_format, resource_type=resource_type,
+            type=upload_type, bytes=len(data), url=resource.build_url(), secure_url=resource.build_url(),
+        )
+        resource.metadata = metadata
+        return resource
+
+    def destroy(self, public_id, resource_type='image', upload_type='upload'):
+        path = self._find(resource_type, upload_type, public_id)
+        if path is None:
+            return {'result': 'not found'}
+        os.remove(path)
+        return {'result': 'ok'}
+
+    def delete_many(self, public_ids, resource_type='image'):
+        return {'deleted': {
+            public_id: 'deleted' if self.destroy(public_id, resource_type)['result'] == 'ok' else 'not_found'
+            for public_id in public_ids
+        }}
+
+    def render(self, url_path):
+        """
+        The file to serve for a delivery URL path
+        (``<resource_type>/<type>/[<transformations>/][v<version>/]<public_id>.<format>``),
+        rendering and caching transformed images. Raises ``FileNotFoundError``.
+        """
+        parts = url_path.split('/')
+        if len(parts) < 3:
+            raise FileNotFoundError(url_path)
+        resource_type, upload_type, rest = parts[0], parts[1], parts[2:]
+        transformations = {}
+        while len(rest) > 1 and _is_transformation(rest[0]):
+            for component in rest.pop(0).split(','):
+                key, _, value = component.partition('_')
+                transformations[key] = value
+        if len(rest) > 1 and re.fullmatch(r'v\d+', rest[0]):
+            rest.pop(0)
+        public_id, _, file_format = '/'.join(rest).rpartition('.')
+        if not public_id:
+            public_id, file_format = file_format, ''
+
+        source = self._find(resource_type, upload_type, public_id)
+        if source is None:
+            raise FileNotFoundError(url_path)
+        source_format = os.path.splitext(source)[1].lstrip('.')
+        resized = bool({'w', 'h'} & transformations.keys())
+        if resource_type == 'video':
+            # A sized or image-format URL of a video is its poster frame.
+            if not resized and file_format not in IMAGE_FORMATS:
+                return source
+            file_format = file_format if file_format in IMAGE_FORMATS else 'jpg'
+        elif resource_type != 'image' or (not resized and file_format in ('', source_format)):
+            return source
+        file_format = file_format or source_format
+
+        width, height = (_dimension(transformations.get(key)) for key in ('w', 'h'))
+        if resized and (width, height, _crop(transformations)) not in RENDITIONS:
+            raise FileNotFoundError(url_path)
+        # The source's mtime stands in for the URL version: an overwritten upload renders anew.
+        rendition = f"{source}:{os.stat(source).st_mtime_ns}:{width}x{height}:{_crop(transformations)}"
+        key = hashlib.sha1(rendition.encode()).hexdigest()
+        derived = os.path.join(self.root, 'derived', f"{key}.{file_format}")
+        if not os.path.exists(derived):
+            os.makedirs(os.path.dirname(derived), exist_ok=True)
+            tmp_path = f"{derived}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as out:
+                out.write(_transform(source, resource_type, transformations, file_format))
+            os.replace(tmp_path, derived)
+        return derived
+
+
+def _is_transformation(segment):
+    return all(
+        component.partition('_')[0] in TRANSFORMATION_KEYS and '_' in component for component in segment.split(',')
+    )
+
+
+def _dimension(value):
+    try:
+        return min(max(1, int(float(value))), MAX_DIMENSION)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _crop(transformations):
+    crop = transformations.get('c', 'scale')
+    if crop in ('fill', 'lfill', 'thumb'):
+        return 'fill'
+    return crop if crop in ('scale', 'limit') else 'fit'
+
+
+def _transform(source, resource_type, transformations, file_format):
+    from PIL import Image, ImageOps
+
+    width, height = (_dimension(transformations.get(key)) for key in ('w', 'h'))
+    if resource_type == 'video':
+        # No video decoder here: the poster frame is a plain placeholder.
+        image = Image.new('RGB', (width or POSTER_SIZE[0], height or POSTER_SIZE[1]), POSTER_COLOR)
+    else:
+        with Image.open(source) as original:
+            image = ImageOps.exif_transpose(original)
+            image.load()
+        crop = _crop(transformations)
+        if width and height and crop == 'fill':
+            image = ImageOps.fit(image, (width, height))
+        elif width and height and crop == 'scale':
+            image = image.resize((width, height))
+        elif width or height:
+            ratio = min(width / image.width if width else float('inf'), height / image.height if height else float('inf'))
+            # Scaling up to one side must not push the other past the limit either.
+            ratio = min(ratio, MAX_DIMENSION / image.width, MAX_DIMENSION / image.height)
+            if crop != 'limit' or ratio < 1:
+                image = image.resize((max(1, round(image.width * ratio)), max(1, round(image.height * ratio))))
+    pil_format = IMAGE_FORMATS.get(file_format, 'PNG')
+    if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format=pil_format)
+    return buffer.getvalue()
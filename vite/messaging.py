@@ -0,0 +1,233 @@
+# messaging.py
+"""
+Shared helpers for the chat: message serialization and real-time events.
+
+Events are pushed to a per-conversation channel-layer group that both
+participants' ``ChatConsumer`` sockets join (see ``consumers.py``).
+"""
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from . import counters, images
+from .models import DeletedMessage, Message
+from .realtime import push_to_group
+
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 200
+
+
+def conversation_group_name(user_a_id, user_b_id):
+    low, high = sorted((user_a_id, user_b_id))
+    return f"chat_{low}_{high}"
+
+
+def _conversation_filter(user, other_user):
+    return Q(sender=user, receiver=other_user) | Q(sender=other_user, receiver=user)
+
+
+def conversation_messages(user, other_user):
+    return Message.objects.filter(_conversation_filter(user, other_user)).select_related(
+        'sender', 'receiver', 'reply_to__sender'
+    )
+
+
+def conversation_etag(user, other_user):
+    """
+    Weak ETag over the conversation state: newest message, newest read receipt
+    and newest deletion. Any new, seen or deleted message changes it.
+    """
+    state = Message.objects.filter(_conversation_filter(user, other_user)).aggregate(
+        last_id=Max('id'), last_seen=Max('seen_at')
+    )
+    last_deleted = DeletedMessage.objects.filter(_conversation_filter(user, other_user)).aggregate(
+        last_id=Max('id')
+    )['last_id']
+    last_seen = int(state['last_seen'].timestamp() * 1_000_000) if state['last_seen'] else 0
+    return f'W/"{state["last_id"] or 0}-{last_seen}-{last_deleted or 0}"'
+
+
+def get_history_page(user, other_user, before_id=None, limit=MESSAGES_PAGE_SIZE):
+    """
+    Returns ``(messages, has_more)``: the ``limit`` messages preceding
+    ``before_id`` (or the latest ones), oldest first.
+    """
+    qs = conversation_messages(user, other_user)
+    if before_id is not None:
+        qs = qs.filter(id__lt=before_id)
+    page = list(qs.order_by('-id')[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()
+    return page, has_more
+
+
+def get_changes(user, other_user, after_id, since=None, limit=MESSAGES_MAX_PAGE_SIZE):
+    """
+    Returns ``(new_messages, updated, deleted_ids, has_more)`` for a client
+    that already holds every message up to ``after_id`` and last synced at
+    ``since``.
+    """
+    new_messages = list(
+        conversation_messages(user, other_user).filter(id__gt=after_id).order_by('id')[:limit + 1]
+    )
+    has_more = len(new_messages) > limit
+    new_messages = new_messages[:limit]
+
+    updated, deleted_ids = [], []
+    if since is not None:
+        updated = [
+            {
+                "id": msg_id,
+                "is_read": is_read,
+                "seen_at": seen_at.strftime("%Y-%m-%d %H:%M:%S") if seen_at else None,
+            }
+            # Read receipts only matter for the requester's own messages.
+            for msg_id, is_read, seen_at in Message.objects.filter(
+                sender=user, receiver=other_user, id__lte=after_id, seen_at__gte=since
+            ).values_list('id', 'is_read', 'seen_at')
+        ]
+        deleted_ids = list(
+            DeletedMessage.objects.filter(
+                _conversation_filter(user, other_user), deleted_at__gte=since
+            ).values_list('message_id', flat=True)
+        )
+    return new_messages, updated, deleted_ids, has_more
+
+
+def conversation_summaries(user, query=''):
+    """
+    Chat list rows for every friend of ``user`` in a single query: the last
+    message of each conversation, its media type and the unread count, most
+    recent conversation first.
+    """
+    friend = OuterRef('pk')
+    last_message = Message.objects.filter(
+        Q(sender=user, receiver=friend) | Q(sender=friend, receiver=user)
+    ).order_by('-id')  # ids follow timestamp (auto_now_add); walks message_conversation_idx backwards
+    unread = Message.objects.filter(sender=friend, receiver=user, is_read=False).order_by().values(
+        'sender'
+    ).annotate(total=Count('pk')).values('total')
+
+    def last(field):
+        return Subquery(last_message.values(field)[:1])
+
+    friends = user.friends.all()
+    if query:
+        query = strip_tags(query)
+        friends = friends.filter(Q(username__icontains=query) | Q(full_name__icontains=query))
+
+    friends = friends.annotate(
+        last_message_time=last('timestamp'),
+        last_message_content=last('content'),
+        last_message_image=last('image'),
+        last_message_video=last('video'),
+        last_message_voice_note=last('voice_note'),
+        last_message_receiver_id=last('receiver_id'),
+        last_message_is_read=last('is_read'),
+        unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), Value(0)),
+    ).order_by(F('last_message_time').desc(nulls_last=True), 'username')
+
+    rows = []
+    for friend_user in friends:
+        if friend_user.last_message_time is None:
+            last_message_content = "لا توجد رسائل"
+        elif friend_user.last_message_content:
+            last_message_content = strip_tags(friend_user.last_message_content)
+        elif friend_user.last_message_image:
+            last_message_content = "📷 صورة"
+        elif friend_user.last_message_video:
+            last_message_content = "🎥 فيديو"
+        elif friend_user.last_message_voice_note:
+            last_message_content = "🎙️ رسالة صوتية"
+        else:
+            last_message_content = ""
+
+        rows.append({
+            'user': friend_user,
+            'last_message': last_message_content,
+            'last_time': friend_user.last_message_time,
+            'is_new': friend_user.last_message_receiver_id == user.id and not friend_user.last_message_is_read,
+            'unread_count': friend_user.unread_count,
+        })
+    return rows
+
+
+def serialize_message(msg):
+    reply_to = msg.reply_to
+    return {
+        "id": msg.id,
+        "sender": msg.sender.username,
+        "receiver": msg.receiver.username,
+        "content": msg.content,
+        "image_url": msg.image.url if msg.image else None,
+        "image_srcset": images.srcsets(msg, 'image'),
+        "video_url": msg.video.url if msg.video else None,
+        "voice_note_url": msg.voice_note.url if msg.voice_note else None,
+        "timestamp": msg.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+        "is_read": msg.is_read,
+        "seen_at": msg.seen_at.strftime("%Y-%m-%d %H:%M:%S") if msg.seen_at else None,
+        "is_system_message": msg.is_system_message,
+        # Set by send_message while attachments are still uploading.
+        "media_pending": getattr(msg, 'media_pending', False),
+        "reply_to": {
+            "id": reply_to.id,
+            "sender": reply_to.sender.username,
+            "content": reply_to.content,
+            "image_url": reply_to.image.url if reply_to.image else None,
+            "video_url": reply_to.video.url if reply_to.video else None,
+            "voice_note_url": reply_to.voice_note.url if reply_to.voice_note else None,
+        } if reply_to else None,
+    }
+
+
+def send_conversation_event(user_a_id, user_b_id, payload):
+    push_to_group(conversation_group_name(user_a_id, user_b_id), payload)
+
+
+def broadcast_new_message(message):
+    send_conversation_event(message.sender_id, message.receiver_id, {
+        "type": "message",
+        "message": serialize_message(message),
+    })
+
+
+def delete_message(message):
+    """
+    Deletes ``message``, leaves a tombstone for incremental syncs and tells
+    both participants.
+    """
+    message_id = message.id
+    with transaction.atomic():
+        DeletedMessage.objects.create(
+            sender_id=message.sender_id, receiver_id=message.receiver_id, message_id=message_id
+        )
+        message.delete()
+    send_conversation_event(message.sender_id, message.receiver_id, {
+        "type": "deleted",
+        "id": message_id,
+    })
+
+
+def mark_conversation_seen(reader, other_user):
+    """
+    Marks every unread message from ``other_user`` to ``reader`` as seen in one
+    UPDATE and sends a read receipt to the sender. Returns the affected ids.
+    """
+    unread = Message.objects.filter(sender=other_user, receiver=reader, is_read=False)
+    ids = list(unread.values_list('id', flat=True))
+    if not ids:
+        return ids
+
+    seen_at = timezone.now()
+    marked = Message.objects.filter(id__in=ids, is_read=False).update(is_read=True, seen_at=seen_at)
+    counters.adjust(counters.MESSAGES, reader.id, -marked)
+    send_conversation_event(reader.id, other_user.id, {
+        "type": "seen",
+        "ids": ids,
+        "reader": reader.username,
+        "seen_at": seen_at.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+    return ids
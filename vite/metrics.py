@@ -0,0 +1,268 @@
+# metrics.py
+"""
+Per-view request metrics.
+
+``MetricsMiddleware`` measures every request and files it under the URL
+name of its view (``home``, ``chat_list``, ``get_messages``, ...): latency
+and SQL query count histograms, total database time, repeated statements
+(the same SQL run ``DUPLICATE_THRESHOLD`` times or more in one request,
+usually an N+1) and cache hits and misses. A request over
+``METRICS_QUERY_BUDGET`` queries or ``METRICS_LATENCY_BUDGET_MS`` is logged
+as a JSON warning with its numbers and repeated statements.
+
+Counters live in the process; ``render`` writes them in the Prometheus
+text format for the ``/metrics/`` endpoint, so each worker process is a
+scrape target of its own.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUDGET = getattr(settings, 'METRICS_QUERY_BUDGET', 50)
+LATENCY_BUDGET = getattr(settings, 'METRICS_LATENCY_BUDGET_MS', 500) / 1000
+DUPLICATE_THRESHOLD = 3
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+UNRESOLVED = 'unresolved'
+
+_MISSING = object()
+_current = contextvars.ContextVar('metrics_request', default=None)
+_lock = threading.Lock()
+_views = {}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0.0
+        self.duplicate_queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.responses = Counter()
+        self.over_budget = Counter()
+
+
+class RequestStats:
+    """
+    What one request did; filled by the SQL and cache wrappers below.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = Counter()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.in_cache = False
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.statements.items() if count >= DUPLICATE_THRESHOLD}
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += time.perf_counter() - start
+            stats.statements[sql] += 1
+
+
+def _wrap_get(original):
+    def get(key, default=None, version=None):
+        stats = _current.get()
+        if stats is None or stats.in_cache:
+            return original(key, default, version=version)
+        stats.in_cache = True
+        try:
+            value = original(key, _MISSING, version=version)
+        finally:
+            stats.in_cache = False
+        if value is _MISSING:
+            stats.cache_misses += 1
+            return default
+        stats.cache_hits += 1
+        return value
+    return get
+
+
+def _wrap_get_many(original):
+    def get_many(keys, version=None):
+        stats = _current.get()
+        if stats is None or stats.in_cache:
+            return original(keys, version=version)
+        keys = list(keys)
+        # Some backends implement get_many with get(); count the keys once.
+        stats.in_cache = True
+        try:
+            found = original(keys, version=version)
+        finally:
+            stats.in_cache = False
+        stats.cache_hits += len(found)
+        stats.cache_misses += len(keys) - len(found)
+        return found
+    return get_many
+
+
+def instrument_cache(backend):
+    """
+    Counts hits and misses of ``get``/``get_many`` on a cache backend
+    instance (they are created per thread).
+    """
+    if getattr(backend, '_metrics_instrumented', False):
+        return
+    backend.get = _wrap_get(backend.get)
+    backend.get_many = _wrap_get_many(backend.get_many)
+    backend._metrics_instrumented = True
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNRESOLVED
+    return match.url_name or match.view_name or UNRESOLVED
+
+
+def record(view, status, duration, stats):
+    duplicates = stats.duplicates()
+    over = []
+    if stats.queries > QUERY_BUDGET:
+        over.append('queries')
+    if duration > LATENCY_BUDGET:
+        over.append('latency')
+
+    with _lock:
+        metrics = _views.get(view)
+        if metrics is None:
+            metrics = _views[view] = ViewMetrics()
+        metrics.latency.observe(duration)
+        metrics.queries.observe(stats.queries)
+        metrics.db_seconds += stats.db_seconds
+        metrics.duplicate_queries += sum(duplicates.values())
+        metrics.cache_hits += stats.cache_hits
+        metrics.cache_misses += stats.cache_misses
+        metrics.responses[f"{status // 100}xx"] += 1
+        for budget in over:
+            metrics.over_budget[budget] += 1
+
+    if over:
+        logger.warning("View over budget: %s", json.dumps({
+            'view': view,
+            'status': status,
+            'over': over,
+            'duration_ms': round(duration * 1000, 1),
+            'queries': stats.queries,
+            'db_ms': round(stats.db_seconds * 1000, 1),
+            'cache_hits': stats.cache_hits,
+            'cache_misses': stats.cache_misses,
+            'repeated_queries': [
+                {'count': count, 'sql': sql[:300]}
+                for sql, count in sorted(duplicates.items(), key=lambda item: -item[1])[:5]
+            ],
+        }, ensure_ascii=False))
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        instrument_cache(caches['default'])
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_sql_wrapper))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(view_name(request), response.status_code, time.perf_counter() - start, stats)
+        return response
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(name, view, histogram):
+    labels = f'view="{_label(view)}"'
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        yield f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+    yield f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}'
+    yield f'{name}_sum{{{labels}}} {histogram.sum}'
+    yield f'{name}_count{{{labels}}} {histogram.count}'
+
+
+def render():
+    """
+    The registry in the Prometheus text exposition format.
+    """
+    with _lock:
+        views = sorted(_views.items())
+        lines = [
+            '# HELP vite_request_duration_seconds Request latency by view.',
+            '# TYPE vite_request_duration_seconds histogram',
+        ]
+        for view, metrics in views:
+            lines.extend(_histogram_lines('vite_request_duration_seconds', view, metrics.latency))
+        lines += [
+            '# HELP vite_request_queries SQL queries per request by view.',
+            '# TYPE vite_request_queries histogram',
+        ]
+        for view, metrics in views:
+            lines.extend(_histogram_lines('vite_request_queries', view, metrics.queries))
+
+        counters = (
+            ('vite_requests_total', 'Responses by view and status class.',
+             lambda metrics: [({'status': status}, count) for status, count in sorted(metrics.responses.items())]),
+            ('vite_request_db_seconds_total', 'Time spent in SQL by view.',
+             lambda metrics: [({}, metrics.db_seconds)]),
+            ('vite_duplicate_queries_total', 'Executions of statements repeated within one request.',
+             lambda metrics: [({}, metrics.duplicate_queries)]),
+            ('vite_cache_requests_total', 'Cache lookups by view and result.',
+             lambda metrics: [({'result': 'hit'}, metrics.cache_hits), ({'result': 'miss'}, metrics.cache_misses)]),
+            ('vite_requests_over_budget_total', 'Requests over the query or latency budget.',
+             lambda metrics: [({'budget': budget}, count) for budget, count in sorted(metrics.over_budget.items())]),
+        )
+        for name, help_text, samples in counters:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for view, metrics in views:
+                for extra, value in samples(metrics):
+                    labels = ','.join(f'{key}="{_label(val)}"' for key, val in {'view': view, **extra}.items())
+                    lines.append(f'{name}{{{labels}}} {value}')
+    return '\n'.join(lines) + '\n'
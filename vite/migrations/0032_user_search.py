@@ -0,0 +1,65 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:08
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# Frozen copies of vite.search as of this migration; later changes there must not alter it.
+SQLITE_FTS_TABLE = 'vite_customuser_fts'
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_LETTER_FORMS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+})
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKC', text or '')
+    text = _DIACRITICS.sub('', text).translate(_LETTER_FORMS).casefold()
+    return ' '.join(text.split())
+
+
+def create_search_index(apps, schema_editor):
+    CustomUser = apps.get_model('vite', 'CustomUser')
+    users = list(CustomUser.objects.only('pk', 'username', 'full_name'))
+    for user in users:
+        user.search_name = normalize(f"{user.username} {user.full_name}")
+    CustomUser.objects.bulk_update(users, ['search_name'], batch_size=500)
+
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX customuser_search_trgm_idx ON vite_customuser USING gin (search_name gin_trgm_ops)"
+        )
+    elif vendor == 'sqlite':
+        # Kept in sync by signals.py, not triggers: SQLite rebuilds tables on ALTER and drops their triggers.
+        schema_editor.execute(f"CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5(search_name, tokenize='trigram')")
+        schema_editor.execute(
+            f"INSERT INTO {SQLITE_FTS_TABLE} (rowid, search_name) SELECT id, search_name FROM vite_customuser"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS customuser_search_trgm_idx")
+    elif vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vite', '0031_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='search_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:16
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+COUNTED = [
+    ('Like', 'post', 'Post', 'likes_count'),
+    ('Comment', 'post', 'Post', 'comments_count'),
+    ('ReelLike', 'reel', 'Reel', 'likes_count'),
+    ('ReelComment', 'reel', 'Reel', 'comments_count'),
+    ('StoryLike', 'story', 'Story', 'likes_count'),
+]
+
+
+def backfill_counters(apps, schema_editor):
+    for child_name, fk_name, parent_name, column in COUNTED:
+        child = apps.get_model('vite', child_name)
+        parent = apps.get_model('vite', parent_name)
+        counts = child.objects.filter(**{fk_name: OuterRef('pk')}).order_by().values(fk_name).annotate(
+            total=Count('pk')
+        ).values('total')
+        parent.objects.update(**{column: Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vite', '0033_friendsuggestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='reel',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='reel',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
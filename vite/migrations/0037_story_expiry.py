@@ -0,0 +1,38 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vite', '0036_notification_read_age_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('public_id', models.CharField(max_length=255)),
+                ('resource_type', models.CharField(default='image', max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'في الانتظار'), ('failed', 'فشل الحذف')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='story',
+            name='story_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['expires_at'], name='story_expires_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediadeletion',
+            index=models.Index(fields=['status', 'created_at'], name='vite_mediad_status_c29a00_idx'),
+        ),
+    ]
@@ -1,12 +1,33 @@
 # models.py
-import cloudinary
+import logging
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
 from cloudinary.models import CloudinaryField
-import qrcode
-from io import BytesIO
-from django.core.files import File
+
+from . import graph, media, presence, qrcodes, search
+
+logger = logging.getLogger(__name__)
+
+
+class CounterColumnsMixin:
+    """
+    Keeps plain ``save()`` calls from writing the denormalized counter
+    columns back with stale values; only ``engagement.py`` changes them,
+    with ``F()`` updates.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
 
 
 class CustomUser(AbstractUser):
@@ -41,75 +62,71 @@ class CustomUser(AbstractUser):
                                          related_name='blocked_by')
     points = models.IntegerField(default=0)
     qr_code = CloudinaryField('image', blank=True, null=True)
+    # نسخ الصور بعدة مقاسات (WebP/AVIF) لكل حقل صورة، يكتبها عامل الرفع (انظر images.py)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     last_active = models.DateTimeField(null=True, blank=True)
+    # اسم المستخدم والاسم الكامل بعد التطبيع للبحث (انظر search.py)
+    search_name = models.CharField(max_length=255, blank=True, default='', editable=False)
 
     def __str__(self):
         return f"@{self.username}"
 
+    def save(self, *args, **kwargs):
+        self.search_name = search.search_name_for(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'username', 'full_name'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'search_name'}
+        super().save(*args, **kwargs)
+
     @property
     def has_blue_badge(self):
-        return self.is_verified or self.friends.count() > 10
+        # Feed/list queries annotate the friend count; otherwise it comes from the cached graph.
+        friends_total = getattr(self, 'friends_total', None)
+        if friends_total is None:
+            friends_total = graph.friend_count(self.pk)
+        return self.is_verified or friends_total > 10
 
     @property
     def is_online(self):
-        if self.last_active:
-            return (timezone.now() - self.last_active) < timezone.timedelta(minutes=3)
-        return False
+        return presence.is_online(self)
+
+    @property
+    def last_seen(self):
+        # ``last_active`` is flushed in batches; the latest heartbeat is in the cache.
+        return presence.last_active(self)
 
     def generate_qr_code(self):
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-
-        profile_url = f"https://yourdomain.com/profile/{self.username}" # Replace with your actual domain
-        qr.add_data(profile_url)
-        qr.make(fit=True)
-
-        img = qr.make_image(fill_color="black", back_color="white")
-
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-
-        result = cloudinary.uploader.upload(
-            buffer.getvalue(),
-            folder="qr_codes",
-            public_id=f"user_{self.id}_qr",
-            overwrite=True
-        )
-
-        self.qr_code = result['secure_url']
+        """
+        Uploads the profile QR code to Cloudinary. Not called on registration:
+        the code is rendered on first view (``qrcodes.py``) and uploaded in
+        bulk by ``manage.py backfill_qr_codes --upload``.
+        """
+        self.qr_code = qrcodes.upload(self.id, self.username)
         self.save(update_fields=['qr_code'])
 
         return self.qr_code
 
-    def save(self, *args, **kwargs):
-        is_new = not self.pk
-        generating_qr = is_new and not self.qr_code
-        if 'update_fields' in kwargs and 'qr_code' in kwargs['update_fields'] and generating_qr:
-             fields = list(kwargs['update_fields'])
-             if 'qr_code' in fields:
-                 fields.remove('qr_code')
-             kwargs['update_fields'] = tuple(fields) if fields else None
-
-        super().save(*args, **kwargs)
-        if generating_qr:
-            self.generate_qr_code()
-
 
-class Story(models.Model):
+class Story(CounterColumnsMixin, models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='stories')
     image = CloudinaryField('image', blank=True, null=True)
     video = CloudinaryField('video', resource_type="video", blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('likes_count',)
 
     class Meta:
         ordering = ['-created_at']
         verbose_name = "Story"
         verbose_name_plural = "Stories"
+        indexes = [
+            # Active stories (expires_at > now), the expiry sweep and a user's stories.
+            models.Index(fields=['expires_at'], name='story_expires_idx'),
+            models.Index(fields=['user', '-created_at'], name='story_user_created_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.expires_at:
@@ -126,22 +143,13 @@ class Story(models.Model):
         """
         if self.video and hasattr(self.video, 'public_id'):
             try:
-                return cloudinary.CloudinaryVideo(self.video.public_id).build_url(
-                    transformation=[
-                        {'width': 300, 'height': 500, 'crop': 'fill'},
-                        {'quality': 'auto', 'fetch_format': 'auto', 'format': 'jpg'}
-                    ],
-                    resource_type="video"
-                )
-            except Exception:
+                return media.poster_url(self.video.public_id)
+            except Exception as e:
+                logger.warning("Story %s poster URL failed: %s", self.pk, e)
                 return "/static/images/default_profile.png" # Fallback image
         if self.image:
             return self.image.url
         return "/static/images/default_profile.png" # Fallback image
-        
-    @property
-    def likes_count(self):
-        return self.story_likes.count()
 
 
 class StoryLike(models.Model):
@@ -165,6 +173,7 @@ class Message(models.Model):
     image = CloudinaryField('image', blank=True, null=True)
     video = CloudinaryField('video', resource_type="video", blank=True, null=True)
     voice_note = CloudinaryField('video', resource_type="video", blank=True, null=True, folder="voice_notes")
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
     seen_at = models.DateTimeField(null=True, blank=True)
@@ -172,15 +181,49 @@ class Message(models.Model):
     # إضافة حقل الرد على الرسالة
     reply_to = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='replies')
 
+    class Meta:
+        indexes = [
+            # Conversation history, incremental sync, ETag and last message per chat.
+            # Postgres keeps the read state in the index so the ETag is an index-only scan.
+            models.Index(
+                fields=['sender', 'receiver', 'id'],
+                include=['is_read', 'seen_at'],
+                name='message_conversation_idx',
+            ),
+            # Unread counters and mark-as-seen only ever look at unread rows.
+            models.Index(fields=['receiver', 'sender'], condition=models.Q(is_read=False), name='message_unread_idx'),
+        ]
+
     def __str__(self):
         return f"من {self.sender} إلى {self.receiver}: {self.content[:30]}"
 
     def mark_as_seen(self):
         if not self.is_read:
+            from .counters import MESSAGES, adjust
+
             self.is_read = True
             self.seen_at = timezone.now()
             self.save()
-            
+            adjust(MESSAGES, self.receiver_id, -1)
+
+
+class DeletedMessage(models.Model):
+    """
+    Tombstone left behind when a message is deleted, so incremental syncs
+    (``get_messages?after_id=...&since=...``) can tell clients to drop it.
+    """
+    sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    receiver = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    message_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['sender', 'receiver', 'deleted_at'], name='deletedmessage_conv_idx')]
+
+    def __str__(self):
+        return f"Deleted message {self.message_id}"
+
+
 class Chat(models.Model):
     participants = models.ManyToManyField(CustomUser, related_name='chats')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -189,17 +232,27 @@ class Chat(models.Model):
     def __str__(self):
         return f"Chat {self.id}"
 
-class Post(models.Model):
+class Post(CounterColumnsMixin, models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='posts')
     content = models.TextField()
     image = CloudinaryField('image', blank=True, null=True)
     video = CloudinaryField('video', resource_type="video", blank=True, null=True)
     voice_note = CloudinaryField('video', resource_type="video", blank=True, null=True, folder="voice_notes")
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('likes_count', 'comments_count')
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Home feed keyset pagination and profile pages.
+            models.Index(fields=['-created_at', '-id'], name='post_feed_idx'),
+            models.Index(fields=['user', '-created_at'], name='post_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Post by {self.user.username}"
@@ -211,6 +264,8 @@ class Like(models.Model):
 
     class Meta:
         unique_together = ('user', 'post')
+        # Latest likers shown under each feed post.
+        indexes = [models.Index(fields=['post', '-created_at'], name='like_post_recent_idx')]
 
     def __str__(self):
         return f"{self.user.username} likes {self.post.id}"
@@ -221,6 +276,10 @@ class Comment(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Latest comments shown under each feed post.
+        indexes = [models.Index(fields=['post', '-created_at'], name='comment_post_recent_idx')]
+
     def __str__(self):
         return f"{self.user.username}: {self.content[:20]}"
 
@@ -255,52 +314,50 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
     related_id = models.PositiveIntegerField(null=True, blank=True) # Can be Post ID, User ID, Reel ID etc.
+    # Events collapsed into this row by notify.py ("X و41 آخرون أعجبوا بمنشورك"); sender is the latest.
+    actor_count = models.PositiveIntegerField(default=1)
+    # Ids of those actors, so someone who acts again is not counted twice.
+    actor_ids = models.JSONField(default=list, blank=True, editable=False)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', '-created_at'], name='notification_recipient_idx'),
+            models.Index(fields=['recipient'], condition=models.Q(is_read=False), name='notification_unread_idx'),
+            models.Index(fields=['created_at'], condition=models.Q(is_read=True), name='notification_read_age_idx'),
+        ]
 
     def __str__(self):
         return f"{self.get_notification_type_display()} لـ {self.recipient.username}"
 
-class Reel(models.Model):
+class Reel(CounterColumnsMixin, models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='reels')
     video = CloudinaryField('video', resource_type="video")
     caption = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     views_count = models.PositiveIntegerField(default=0)
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
     viewers = models.ManyToManyField(CustomUser, related_name='viewed_reels', blank=True)
+
+    counter_fields = ('views_count', 'likes_count', 'comments_count')
     
     class Meta:
         ordering = ['-created_at']
+        # Fresh reels at the top of the reels feed.
+        indexes = [models.Index(fields=['-created_at'], name='reel_created_idx')]
 
     def __str__(self):
         return f"Reel by {self.user.username} at {self.created_at.strftime('%Y-%m-%d %H:%M')}"
 
-    @property
-    def likes_count(self):
-        return self.reel_likes.count()
-
-    @property
-    def comments_count(self):
-        return self.reel_comments.count()
-
     @property
     def thumbnail_url(self):
         if self.video and hasattr(self.video, 'public_id'):
             try:
-                thumbnail_url = cloudinary.CloudinaryVideo(self.video.public_id).build_url(
-                    transformation=[
-                        {'width': 300, 'height': 500, 'crop': 'fill'},
-                        {'quality': 'auto'},
-                        {'format': 'jpg'},
-                        {'fetch_format': 'auto'},
-                ],
-                resource_type="video",
-                )
-                return thumbnail_url
+                return media.poster_url(self.video.public_id)
             except Exception as e:
-                print(f"Error generating thumbnail: {e}")
+                logger.warning("Reel %s thumbnail URL failed: %s", self.pk, e)
                 return ""
         return ""
 
@@ -326,4 +383,87 @@ class ReelComment(models.Model):
         ordering = ['created_at']
 
     def __str__(self):
-        return f"Comment by {self.user.username} on Reel {self.reel.id}: {self.content[:20]}"
\ No newline at end of file
+        return f"Comment by {self.user.username} on Reel {self.reel.id}: {self.content[:20]}"
+
+class MediaUpload(models.Model):
+    """
+    A file accepted by a view and spooled to disk, waiting for the background
+    worker (``uploads.py``) to push it to Cloudinary and store the result on
+    ``target_type``/``target_id``.``field_name``.
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'في الانتظار'),
+        (PROCESSING, 'جاري الرفع'),
+        (DONE, 'تم الرفع'),
+        (FAILED, 'فشل الرفع'),
+    )
+
+    owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='media_uploads')
+    target_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    target_id = models.PositiveBigIntegerField()
+    target = GenericForeignKey('target_type', 'target_id')
+    field_name = models.CharField(max_length=50)
+    spool_path = models.CharField(max_length=500)
+    original_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    url = models.URLField(max_length=500, blank=True)
+    thumbnail_url = models.URLField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.field_name} upload {self.id} ({self.status})"
+
+
+class MediaDeletion(models.Model):
+    """
+    A Cloudinary asset whose row is gone (e.g. an expired story swept by
+    ``expiry.py``), waiting to be destroyed. Failed attempts are retried on
+    the next run until ``MAX_ATTEMPTS``.
+    """
+    PENDING = 'pending'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'في الانتظار'),
+        (FAILED, 'فشل الحذف'),
+    )
+
+    public_id = models.CharField(max_length=255)
+    resource_type = models.CharField(max_length=20, default='image')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.resource_type} {self.public_id} ({self.status})"
+
+
+class FriendSuggestion(models.Model):
+    """
+    Precomputed "people you may know" row, rebuilt by ``manage.py compute_friend_suggestions``.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='friend_suggestions')
+    suggested = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    mutual_count = models.PositiveIntegerField()
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('user', 'suggested')
+        indexes = [models.Index(fields=['user', '-mutual_count'], name='suggestion_user_rank_idx')]
+
+    def __str__(self):
+        return f"{self.suggested.username} لـ {self.user.username} ({self.mutual_count})"
@@ -0,0 +1,326 @@
+# notify.py
+"""
+Notification pipeline.
+
+Views ``enqueue`` an event instead of inserting a ``Notification``; after
+the request's transaction commits the event goes into an in-process buffer
+that a background thread flushes every ``NOTIFICATION_FLUSH_INTERVAL``
+seconds. A flush collapses events by ``(recipient, type, related_id)``:
+likes and comments on the same post, reel or story within
+``AGGREGATION_WINDOW`` are merged into the recipient's unread notification
+for it ("X و41 آخرون أعجبوا بمنشورك") instead of adding rows; the row keeps
+its actors' ids, so each actor counts once however often they act. New
+rows are written with one ``bulk_create`` and merged ones with one
+``bulk_update``; then recipients get the notification and their unread
+count over their sockets.
+
+With ``NOTIFICATIONS_INLINE = True`` events are flushed right after commit
+(tests and management commands). Whatever is still buffered is flushed at
+exit (registered in ``apps.py``). Both settings are read at call time. A
+flush whose write fails puts its events back for the next one.
+
+Reading side: ``get_page`` is keyset-paginated like the home feed,
+``group`` folds a page's rows about the same object into one entry,
+``mark_read`` marks everything up to a cursor read with one UPDATE and
+``prune`` (``manage.py prune_notifications``) deletes old read rows in
+batches.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import counters
+from .feed import decode_cursor, encode_cursor
+from .models import CustomUser, Notification
+from .realtime import push_to_user
+
+logger = logging.getLogger(__name__)
+
+AGGREGATION_WINDOW = timedelta(hours=6)
+NOTIFICATIONS_PAGE_SIZE = 20
+NOTIFICATIONS_MAX_PAGE_SIZE = 50
+RETENTION_DAYS = getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 90)
+PRUNE_BATCH_SIZE = 5000
+
+# type -> (one actor, several actors); "{user}" is the latest actor, "{others}" the rest.
+MESSAGES = {
+    'like': ("{user} أعجب بمنشورك", "{user} و{others} آخرون أعجبوا بمنشورك"),
+    'comment': ("{user} علق على منشورك", "{user} و{others} آخرون علقوا على منشورك"),
+    'reel_like': ("أعجب {user} بالريل الخاص بك", "أعجب {user} و{others} آخرون بالريل الخاص بك"),
+    'reel_comment': ("علق {user} على الريل الخاص بك", "علق {user} و{others} آخرون على الريل الخاص بك"),
+    'story_like': ("أعجب {user} بقصتك", "أعجب {user} و{others} آخرون بقصتك"),
+    'friend_request': ("{user} أرسل لك طلب صداقة", None),
+    'friend_accept': ("{user} قبل طلب صداقتك", None),
+}
+AGGREGATED_TYPES = {kind for kind, (_, plural) in MESSAGES.items() if plural}
+
+_buffer = []
+_lock = threading.Lock()
+_thread = None
+
+
+def render_content(notification_type, username, actor_count):
+    single, plural = MESSAGES[notification_type]
+    if actor_count > 1 and plural:
+        return plural.format(user=username, others=actor_count - 1)
+    return single.format(user=username)
+
+
+def enqueue(recipient_id, sender_id, notification_type, related_id=None):
+    """
+    Queues a notification for ``recipient_id``. Nothing is written when the
+    current transaction rolls back, or when users act on their own content.
+    """
+    if recipient_id == sender_id:
+        return
+    event = (recipient_id, sender_id, notification_type, related_id, timezone.now())
+    transaction.on_commit(lambda: _add(event))
+
+
+def _add(event):
+    with _lock:
+        _buffer.append(event)
+    if getattr(settings, 'NOTIFICATIONS_INLINE', False):
+        # The request has committed already; a failed write stays buffered.
+        try:
+            flush()
+        except Exception:
+            logger.exception("Notification flush failed")
+    else:
+        _ensure_thread()
+
+
+def _ensure_thread():
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name='notification-flush', daemon=True)
+            _thread.start()
+
+
+def _run():
+    while True:
+        time.sleep(getattr(settings, 'NOTIFICATION_FLUSH_INTERVAL', 2))
+        try:
+            flush()
+        except Exception:
+            logger.exception("Notification flush failed")
+        finally:
+            close_old_connections()
+
+
+def _collapse(events):
+    """
+    ``{(recipient, type, related_id): [sender ids, oldest first]}``; only the
+    aggregated types share a key, the others get one entry per event.
+    """
+    groups = OrderedDict()
+    for index, (recipient_id, sender_id, kind, related_id, _) in enumerate(events):
+        key = (recipient_id, kind, related_id) if kind in AGGREGATED_TYPES else (recipient_id, kind, related_id, index)
+        senders = groups.setdefault(key, [])
+        if sender_id not in senders:
+            senders.append(sender_id)
+        else:
+            # The same user again (e.g. like, unlike, like): count once, as the latest.
+            senders.remove(sender_id)
+            senders.append(sender_id)
+    return groups
+
+
+def flush(push=True):
+    """
+    Writes the buffered events. Returns ``(created, merged)`` row counts.
+    With ``push=False`` nothing is sent to the sockets (at interpreter exit
+    the channel layer can no longer be reached). If the write fails the
+    events go back to the front of the buffer and the error is raised.
+    """
+    global _buffer
+    with _lock:
+        events, _buffer = _buffer, []
+    if not events:
+        return 0, 0
+    try:
+        created, to_update, usernames = _write(events)
+    except Exception:
+        with _lock:
+            _buffer[:0] = events
+        raise
+
+    new_unread = {}
+    for notification in created:
+        new_unread[notification.recipient_id] = new_unread.get(notification.recipient_id, 0) + 1
+    if push:
+        for notification in [*created, *to_update]:
+            push_to_user(notification.recipient_id, {
+                "type": "notification",
+                "notification": serialize_notification(notification, usernames[notification.sender_id]),
+            })
+    for recipient_id, count in new_unread.items():
+        counters.adjust(counters.NOTIFICATIONS, recipient_id, count, push=push)
+    return len(created), len(to_update)
+
+
+def _write(events):
+    """
+    Collapses ``events`` and writes them in one transaction. Returns
+    ``(created, updated, usernames)``.
+    """
+    groups = _collapse(events)
+    now = timezone.now()
+    usernames = dict(CustomUser.objects.filter(
+        pk__in={sender_id for senders in groups.values() for sender_id in senders}
+    ).values_list('pk', 'username'))
+    recipients = set(CustomUser.objects.filter(
+        pk__in={key[0] for key in groups}
+    ).values_list('pk', flat=True))
+
+    aggregated_keys = [key for key in groups if len(key) == 3 and key[0] in recipients]
+    existing = {}
+    if aggregated_keys:
+        candidates = Notification.objects.filter(
+            recipient_id__in={key[0] for key in aggregated_keys},
+            notification_type__in={key[1] for key in aggregated_keys},
+            related_id__in={key[2] for key in aggregated_keys},
+            is_read=False,
+            created_at__gte=now - AGGREGATION_WINDOW,
+        ).order_by('created_at')
+        for notification in candidates:
+            # Newest wins when several match.
+            existing[(notification.recipient_id, notification.notification_type, notification.related_id)] = notification
+
+    to_create, to_update = [], []
+    for key, senders in groups.items():
+        recipient_id, kind, related_id = key[:3]
+        senders = [sender_id for sender_id in senders if sender_id in usernames]
+        if recipient_id not in recipients or not senders:
+            continue
+        latest = senders[-1]
+        notification = existing.get(key[:3]) if len(key) == 3 else None
+        if notification is not None:
+            # Rows from before actor_ids was kept only know their latest sender.
+            actor_ids = notification.actor_ids or [notification.sender_id]
+            known = set(actor_ids)
+            new_actors = [sender_id for sender_id in senders if sender_id not in known]
+            notification.actor_ids = actor_ids + new_actors
+            notification.actor_count += len(new_actors)
+            notification.sender_id = latest
+            notification.created_at = now
+            notification.content = render_content(kind, usernames[latest], notification.actor_count)
+            to_update.append(notification)
+        else:
+            to_create.append(Notification(
+                recipient_id=recipient_id,
+                sender_id=latest,
+                notification_type=kind,
+                related_id=related_id,
+                actor_count=len(senders),
+                actor_ids=senders,
+                content=render_content(kind, usernames[latest], len(senders)),
+                created_at=now,
+            ))
+
+    with transaction.atomic():
+        created = Notification.objects.bulk_create(to_create)
+        Notification.objects.bulk_update(to_update, ['sender', 'actor_count', 'actor_ids', 'created_at', 'content'])
+    return created, to_update, usernames
+
+
+def get_page(user, cursor=None, page_size=NOTIFICATIONS_PAGE_SIZE):
+    """
+    Returns ``(notifications, next_cursor)``, newest first, with ``sender``
+    loaded. ``next_cursor`` is ``None`` on the last page. Raises
+    ``feed.InvalidCursor`` for a malformed cursor.
+    """
+    page_size = max(1, min(page_size, NOTIFICATIONS_MAX_PAGE_SIZE))
+    notifications = Notification.objects.filter(recipient=user)
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        notifications = notifications.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+
+    notifications = list(notifications.select_related('sender').order_by('-created_at', '-pk')[:page_size + 1])
+    next_cursor = None
+    if len(notifications) > page_size:
+        notifications = notifications[:page_size]
+        next_cursor = encode_cursor(notifications[-1])
+    return notifications, next_cursor
+
+
+def group(notifications):
+    """
+    Folds rows of an aggregated type about the same object (older ones the
+    aggregation window split off) into the newest of them. Each returned
+    notification gets ``group_size``, ``group_actor_count`` and
+    ``group_unread``; ``content`` is re-rendered for the whole group.
+    """
+    groups = OrderedDict()
+    for notification in notifications:
+        kind = notification.notification_type
+        key = (kind, notification.related_id) if kind in AGGREGATED_TYPES and notification.related_id else notification.pk
+        head = groups.get(key)
+        if head is None:
+            notification.group_size = 1
+            notification.group_actor_count = notification.actor_count
+            notification.group_unread = not notification.is_read
+            groups[key] = notification
+        else:
+            head.group_size += 1
+            head.group_actor_count += notification.actor_count
+            head.group_unread = head.group_unread or not notification.is_read
+    for head in groups.values():
+        if head.group_size > 1:
+            head.content = render_content(head.notification_type, head.sender.username, head.group_actor_count)
+    return list(groups.values())
+
+
+def mark_read(user_id, cursor):
+    """
+    Marks the user's unread notifications read up to and including the row
+    ``cursor`` points at, in page order. ``cursor`` is ``encode_cursor`` of
+    the newest row the client has shown; a row merged since then has a newer
+    ``created_at`` (its new actors are unseen) and stays unread. Returns how
+    many changed. Raises ``feed.InvalidCursor`` for a malformed cursor.
+    """
+    created_at, pk = decode_cursor(cursor)
+    updated = Notification.objects.filter(recipient_id=user_id, is_read=False).filter(
+        Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lte=pk)
+    ).update(is_read=True)
+    if updated:
+        counters.adjust(counters.NOTIFICATIONS, user_id, -updated)
+    return updated
+
+
+def prune(days=RETENTION_DAYS, batch_size=PRUNE_BATCH_SIZE):
+    """
+    Deletes read notifications older than ``days`` in batches of
+    ``batch_size``, each in its own short transaction. Returns the number
+    deleted. Unread notifications are kept whatever their age.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted = 0
+    while True:
+        batch = list(Notification.objects.filter(
+            is_read=True, created_at__lt=cutoff
+        ).order_by('created_at').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += Notification.objects.filter(pk__in=batch).delete()[0]
+
+
+def serialize_notification(notification, sender_username):
+    return {
+        "id": notification.id,
+        "notification_type": notification.notification_type,
+        "content": notification.content,
+        "sender": sender_username,
+        "related_id": notification.related_id,
+        "actor_count": notification.actor_count,
+        "created_at": notification.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
@@ -0,0 +1,120 @@
+# presence.py
+"""
+Online presence.
+
+A heartbeat (``touch``) only writes the time to the cache; reads (``is_online``,
+``last_active``) take the newer of that and the stored
+``CustomUser.last_active``. Each process buffers the heartbeats it receives
+and writes them to the database with one ``bulk_update`` at most every
+``PRESENCE_FLUSH_INTERVAL`` seconds, so ``last_active`` survives cache
+eviction without an UPDATE per heartbeat. The rest is flushed when the
+process exits (``apps.py``); a process killed before that loses at most one
+interval, and the cache still has the value. A flush that fails puts its
+heartbeats back for the next one; the heartbeat's request never fails
+because of it.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+ONLINE_WINDOW = timedelta(minutes=3)
+FLUSH_INTERVAL = getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 60)
+# Long enough that list pages rarely need the database value.
+PRESENCE_TIMEOUT = 60 * 60 * 6
+
+_pending = {}
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def _key(user_id):
+    return f"presence:{user_id}"
+
+
+def touch(user_id, now=None):
+    """
+    Records a heartbeat from ``user_id``.
+    """
+    global _last_flush
+    now = now or timezone.now()
+    cache.set(_key(user_id), now, PRESENCE_TIMEOUT)
+    with _lock:
+        _pending[user_id] = now
+        due = time.monotonic() - _last_flush >= FLUSH_INTERVAL
+        if due:
+            _last_flush = time.monotonic()
+    if due:
+        try:
+            flush()
+        except Exception:
+            logger.exception("Presence flush failed")
+
+
+def flush():
+    """
+    Writes the buffered heartbeats to ``CustomUser.last_active``. Returns
+    the number of users written; a deleted user's row is simply not there
+    to update. If the write fails the heartbeats go back to the buffer
+    (unless a newer one arrived meanwhile) and the error is raised.
+    """
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return 0
+    users = [models.CustomUser(pk=user_id, last_active=seen) for user_id, seen in pending.items()]
+    try:
+        models.CustomUser.objects.bulk_update(users, ['last_active'], batch_size=500)
+    except Exception:
+        with _lock:
+            for user_id, seen in pending.items():
+                _pending[user_id] = _newest(_pending.get(user_id), seen)
+        raise
+    return len(users)
+
+
+def _newest(*times):
+    times = [t for t in times if t is not None]
+    return max(times) if times else None
+
+
+def last_active(user):
+    if '_presence_last_active' not in user.__dict__:
+        user._presence_last_active = _newest(cache.get(_key(user.pk)), user.last_active)
+    return user._presence_last_active
+
+
+def attach(users):
+    """
+    Batch variant of ``last_active`` for list pages: one cache round trip
+    for all of ``users``.
+    """
+    found = cache.get_many([_key(user.pk) for user in users])
+    for user in users:
+        user._presence_last_active = _newest(found.get(_key(user.pk)), user.last_active)
+    return users
+
+
+def is_online(user, now=None):
+    seen = last_active(user)
+    return seen is not None and (now or timezone.now()) - seen < ONLINE_WINDOW
+
+
+def online_ids(user_ids):
+    """
+    Which of ``user_ids`` are online, from the cache alone: a heartbeat inside
+    the online window is always still cached.
+    """
+    threshold = timezone.now() - ONLINE_WINDOW
+    found = cache.get_many([_key(user_id) for user_id in user_ids])
+    return {user_id for user_id in user_ids if found.get(_key(user_id)) and found[_key(user_id)] >= threshold}
+
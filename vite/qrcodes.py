@@ -0,0 +1,84 @@
+# qrcodes.py
+"""
+Profile QR codes, rendered on demand instead of at registration.
+
+A QR code only depends on the username, so the PNG is rendered the first
+time it is viewed and kept in an in-process LRU and on disk under
+``QR_CACHE_ROOT`` (keyed by username). ``manage.py backfill_qr_codes`` warms
+that cache for existing users in bulk and can also ``upload`` the images
+to Cloudinary.
+"""
+import os
+import re
+import uuid
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+
+from . import media
+
+PROFILE_URL = "https://yourdomain.com/profile/{username}"  # Replace with your actual domain
+
+
+def render_png(username):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(PROFILE_URL.format(username=username))
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def cache_root():
+    return getattr(settings, 'QR_CACHE_ROOT', os.path.join(settings.BASE_DIR, 'qr_cache'))
+
+
+def _cache_path(username, root):
+    # Usernames may contain '@', '.', '+', '-'; keep anything else off the filesystem.
+    safe = re.sub(r'[^\w.@+-]', '_', username)
+    return os.path.join(root, f"{safe}.png")
+
+
+def render_to_disk(username, root=None):
+    """
+    Renders ``username``'s code into the disk cache (``root``, by default
+    ``cache_root()``) unless it is already there. Returns the file path.
+    Safe to call from worker processes.
+    """
+    root = root or cache_root()
+    path = _cache_path(username, root)
+    if not os.path.exists(path):
+        os.makedirs(root, exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as out:
+            out.write(render_png(username))
+        os.replace(tmp_path, path)
+    return path
+
+
+@lru_cache(maxsize=getattr(settings, 'QR_MEMORY_CACHE_SIZE', 256))
+def get_png(username):
+    with open(render_to_disk(username), 'rb') as f:
+        return f.read()
+
+
+def upload(user_id, username):
+    """
+    Uploads the code to the media backend and returns its URL.
+    """
+    resource = media.upload(
+        render_to_disk(username),
+        folder="qr_codes",
+        public_id=f"user_{user_id}_qr",
+        overwrite=True
+    )
+    return resource.url
@@ -0,0 +1,33 @@
+# realtime.py
+"""
+Thin wrapper around the channel layer used by the WebSocket consumers.
+
+Every payload is delivered to the sockets in ``group`` through their
+``client_push`` handler, which forwards it to the browser as JSON.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+
+def user_group_name(user_id):
+    return f"user_{user_id}"
+
+
+def push_to_group(group, payload):
+    """
+    Sends ``payload`` once the current transaction commits. A missing channel
+    layer just disables the push.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    def _send():
+        async_to_sync(channel_layer.group_send)(group, {"type": "client.push", "payload": payload})
+
+    transaction.on_commit(_send)
+
+
+def push_to_user(user_id, payload):
+    push_to_group(user_group_name(user_id), payload)
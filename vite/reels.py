@@ -0,0 +1,175 @@
+# reels.py
+"""
+Reels feed: small pages in a per-visit order without sorting the whole table.
+
+Reels from the last ``FRESH_WINDOW`` come first, newest first. Older reels are
+then walked down the primary key from a random pivot, wrapping around once,
+so every visit starts somewhere else while each page is still an index range
+scan instead of ``ORDER BY RANDOM()``. Older reels are also shuffled inside
+each page with a seed taken from the cursor.
+
+The cursor carries the pivot, the fresh/old boundary and the position, so a
+visit keeps a stable order even while new reels are posted.
+"""
+import base64
+import json
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Exists, Max, Min, OuterRef, Prefetch
+from django.utils import timezone
+
+from . import reelviews
+from .models import Reel, ReelComment, ReelLike
+
+REELS_PAGE_SIZE = 5
+REELS_MAX_PAGE_SIZE = 20
+REELS_COMMENTS_PREVIEW = 20
+FRESH_WINDOW = timedelta(hours=5)
+
+FRESH, OLD, WRAPPED = range(3)
+SEGMENTS = (FRESH, OLD, WRAPPED)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(state):
+    raw = json.dumps(state, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if state['s'] not in SEGMENTS:
+            raise ValueError(state['s'])
+        return {
+            't': int(state['t']),
+            'p': int(state['p']),
+            's': state['s'],
+            'k': None if state['k'] is None else int(state['k']),
+            'f': None if state['f'] is None else int(state['f']),
+        }
+    except (ValueError, UnicodeDecodeError, KeyError, TypeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def published_reels():
+    # A reel whose video is still uploading (see uploads.py) has no video yet.
+    return Reel.objects.exclude(video='')
+
+
+def _new_state(featured_id):
+    bounds = Reel.objects.aggregate(lo=Min('pk'), hi=Max('pk'))
+    pivot = random.randint(bounds['lo'], bounds['hi']) if bounds['hi'] is not None else 0
+    threshold = timezone.now() - FRESH_WINDOW
+    return {'t': int(threshold.timestamp()), 'p': pivot, 's': FRESH, 'k': None, 'f': featured_id}
+
+
+def _segment_ids(state, segment, limit):
+    threshold = datetime.fromtimestamp(state['t'], tz=dt_timezone.utc)
+    reels = published_reels()
+    if segment == FRESH:
+        reels = reels.filter(created_at__gte=threshold)
+    else:
+        reels = reels.filter(created_at__lt=threshold)
+        reels = reels.filter(pk__lte=state['p']) if segment == OLD else reels.filter(pk__gt=state['p'])
+    if state['f'] is not None:
+        reels = reels.exclude(pk=state['f'])
+    if state['k'] is not None:
+        reels = reels.filter(pk__lt=state['k'])
+    return list(reels.order_by('-pk').values_list('pk', flat=True)[:limit])
+
+
+def annotate_reels(queryset, user):
+    """
+    Attach everything ``reel_template.html`` reads so rendering a reel costs no extra queries.
+    """
+    return queryset.select_related('user').annotate(
+        is_liked=Exists(ReelLike.objects.filter(reel_id=OuterRef('pk'), user=user)),
+    ).prefetch_related(
+        Prefetch(
+            'reel_comments',
+            queryset=ReelComment.objects.select_related('user').order_by('-created_at')[:REELS_COMMENTS_PREVIEW],
+            to_attr='preview_comments',
+        ),
+    )
+
+
+def get_reels_page(user, cursor=None, featured_id=None, page_size=REELS_PAGE_SIZE):
+    """
+    Returns ``(reels, next_cursor)``. On the first page ``featured_id`` (a
+    shared link) is shown first and left out of later pages.
+
+    ``next_cursor`` is ``None`` on the last page. Raises ``InvalidCursor`` for
+    a malformed cursor.
+    """
+    page_size = max(1, min(page_size, REELS_MAX_PAGE_SIZE))
+    if cursor:
+        state = decode_cursor(cursor)
+    else:
+        state = _new_state(featured_id)
+
+    # (segment, pk) pairs; one extra to know whether there is a next page.
+    picked = []
+    if not cursor and featured_id is not None:
+        picked.append((None, featured_id))
+    for segment in SEGMENTS[state['s']:]:
+        last = state['k'] if segment == state['s'] else None
+        ids = _segment_ids({**state, 'k': last}, segment, page_size + 1 - len(picked))
+        picked.extend((segment, pk) for pk in ids)
+        if len(picked) > page_size:
+            break
+
+    next_cursor = None
+    if len(picked) > page_size:
+        picked = picked[:page_size]
+        segment, pk = picked[-1]
+        if segment is None:
+            segment, pk = state['s'], state['k']
+        next_cursor = encode_cursor({**state, 's': segment, 'k': pk})
+
+    by_id = annotate_reels(published_reels().filter(pk__in=[pk for _, pk in picked]), user).in_bulk()
+    leading = [by_id[pk] for segment, pk in picked if segment in (None, FRESH) and pk in by_id]
+    older = [by_id[pk] for segment, pk in picked if segment in (OLD, WRAPPED) and pk in by_id]
+    random.Random(f"{state['p']}:{state['s']}:{state['k']}").shuffle(older)
+
+    reels = reelviews.live_counts(leading + older)
+    for reel in reels:
+        # Oldest first, like the unbounded ``reel_comments`` used to render.
+        reel.preview_comments.reverse()
+    return reels, next_cursor
+
+
+def sample_reels(size):
+    """
+    A cheap random-looking strip for the home page: a run of reels starting
+    at a random primary key, shuffled.
+    """
+    bounds = Reel.objects.aggregate(lo=Min('pk'), hi=Max('pk'))
+    if bounds['hi'] is None:
+        return []
+    pivot = random.randint(bounds['lo'], bounds['hi'])
+    reels = published_reels().select_related('user')
+    picked = list(reels.filter(pk__lte=pivot).order_by('-pk')[:size])
+    if len(picked) < size:
+        picked += list(reels.filter(pk__gt=pivot).order_by('pk')[:size - len(picked)])
+    random.shuffle(picked)
+    return picked
+
+
+def serialize_reel(reel):
+    return {
+        'id': reel.id,
+        'user': reel.user.username,
+        'caption': reel.caption,
+        'video_url': reel.video.url if reel.video else None,
+        'created_at': reel.created_at.isoformat(),
+        'likes_count': reel.likes_count,
+        'comments_count': reel.comments_count,
+        'views_count': reel.views_count,
+        'is_liked': reel.is_liked,
+    }
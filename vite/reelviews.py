@@ -0,0 +1,145 @@
+# reelviews.py
+"""
+Reel view counting without a write per view.
+
+A view is deduplicated per (user, reel) with ``cache.add`` and, when new,
+bumps a live counter in the cache and is buffered in the process. The
+buffer is flushed at most every ``REEL_VIEWS_FLUSH_INTERVAL`` seconds:
+pairs already in ``Reel.viewers`` are dropped, the rest are inserted with
+one ``bulk_create`` and ``views_count`` of every touched reel is raised with
+one UPDATE. The stored count is therefore exact; the live one can run ahead
+by a view when a dedup key was evicted, until it expires
+(``LIVE_COUNT_TIMEOUT``) and is read again from the database. Views still
+buffered are flushed when the process exits (``apps.py``). A flush that
+fails puts its views back for the next one; a view's request never fails
+because of it.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+
+from .models import CustomUser, Reel
+
+logger = logging.getLogger(__name__)
+FLUSH_INTERVAL = getattr(settings, 'REEL_VIEWS_FLUSH_INTERVAL', 30)
+DEDUP_TIMEOUT = 60 * 60 * 24 * 30
+LIVE_COUNT_TIMEOUT = 60 * 5
+
+_pending = set()
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def _seen_key(reel_id, user_id):
+    return f"reel-view:{reel_id}:{user_id}"
+
+
+def _count_key(reel_id):
+    return f"reel-views:{reel_id}"
+
+
+def live_count(reel_id):
+    """
+    Current view count including views not flushed yet. Raises
+    ``Reel.DoesNotExist`` for an unknown reel.
+    """
+    count = cache.get(_count_key(reel_id))
+    if count is None:
+        count = Reel.objects.values_list('views_count', flat=True).get(pk=reel_id)
+        cache.add(_count_key(reel_id), count, LIVE_COUNT_TIMEOUT)
+    return count
+
+
+def live_counts(reels):
+    """
+    Sets ``views_count`` on a page of reels to the live value: one cache round trip.
+    """
+    found = cache.get_many([_count_key(reel.pk) for reel in reels])
+    for reel in reels:
+        reel.views_count = max(reel.views_count, found.get(_count_key(reel.pk), 0))
+    return reels
+
+
+def record_view(reel_id, user_id):
+    """
+    Returns ``(views_count, is_new_view)``.
+    """
+    global _last_flush
+    count = live_count(reel_id)
+    if not cache.add(_seen_key(reel_id, user_id), True, DEDUP_TIMEOUT):
+        return count, False
+
+    try:
+        count = cache.incr(_count_key(reel_id))
+    except ValueError:
+        # The counter expired in between; it is read again on the next view.
+        count += 1
+    with _lock:
+        _pending.add((reel_id, user_id))
+        due = time.monotonic() - _last_flush >= FLUSH_INTERVAL
+        if due:
+            _last_flush = time.monotonic()
+    if due:
+        try:
+            flush()
+        except Exception:
+            logger.exception("Reel views flush failed")
+    return count, True
+
+
+def flush():
+    """
+    Writes the buffered views. Returns the number of new views stored.
+    Views of reels or by users deleted since are dropped. If the write fails
+    the views go back to the buffer and the error is raised.
+    """
+    global _pending
+    with _lock:
+        pending, _pending = _pending, set()
+    if not pending:
+        return 0
+    try:
+        return _write(pending)
+    except Exception:
+        with _lock:
+            _pending |= pending
+        raise
+
+
+def _write(pending):
+    through = Reel.viewers.through
+    reel_ids = {reel_id for reel_id, _ in pending}
+    user_ids = {user_id for _, user_id in pending}
+    with transaction.atomic():
+        known = set(through.objects.filter(
+            reel_id__in=reel_ids, customuser_id__in=user_ids
+        ).values_list('reel_id', 'customuser_id'))
+        new = [pair for pair in pending if pair not in known]
+        # ignore_conflicts covers duplicates only, not a missing reel or user.
+        existing_reels = set(Reel.objects.filter(pk__in={reel_id for reel_id, _ in new}).values_list('pk', flat=True))
+        existing_users = set(CustomUser.objects.filter(
+            pk__in={user_id for _, user_id in new}
+        ).values_list('pk', flat=True))
+        new = [
+            (reel_id, user_id) for reel_id, user_id in new
+            if reel_id in existing_reels and user_id in existing_users
+        ]
+        if not new:
+            return 0
+        through.objects.bulk_create(
+            [through(reel_id=reel_id, customuser_id=user_id) for reel_id, user_id in new],
+            ignore_conflicts=True,
+        )
+        per_reel = Counter(reel_id for reel_id, _ in new)
+        Reel.objects.filter(pk__in=per_reel).update(views_count=F('views_count') + Case(
+            *[When(pk=reel_id, then=Value(views)) for reel_id, views in per_reel.items()],
+            default=Value(0),
+        ))
+    return len(new)
+
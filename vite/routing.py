@@ -0,0 +1,9 @@
+# routing.py
+from django.urls import path
+
+from . import consumers
+
+websocket_urlpatterns = [
+    path('ws/chat/<str:username>/', consumers.ChatConsumer.as_asgi()),
+    path('ws/events/', consumers.UserEventsConsumer.as_asgi()),
+]
@@ -0,0 +1,178 @@
+# search.py
+"""
+User search for the search page and the typeahead.
+
+Names are matched on ``CustomUser.search_name``: the username and full name
+folded by ``normalize`` (case, Arabic diacritics and letter variants), so
+"أحمد", "احمد" and "أَحْمَد" find each other. On Postgres the column has a
+pg_trgm GIN index and matches are substrings or close words; on SQLite (local
+dev and tests) an FTS5 trigram table mirrors it. Both are created by
+migration 0032. ``signals.py`` keeps them current on saves and deletes;
+after writes that skip signals (``bulk_create``, ``update``, raw SQL)
+``rebuild_index`` (``manage.py rebuild_search_index``) recomputes every
+``search_name`` and refills the FTS table.
+
+Results are ranked exact username, then prefix matches, with friends and
+verified users boosted, and are always limited.
+"""
+import re
+import unicodedata
+
+from django.contrib.postgres.lookups import TrigramWordSimilar
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection, transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
+
+from . import graph, images, models
+
+SEARCH_RESULTS_LIMIT = 50
+TYPEAHEAD_LIMIT = 8
+MAX_QUERY_LENGTH = 100
+# Trigram indexes need at least three characters; shorter queries only match prefixes.
+TRIGRAM_MIN_LENGTH = 3
+SQLITE_FTS_TABLE = 'vite_customuser_fts'
+SQLITE_CANDIDATES = 200
+
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')  # التشكيل والتطويل
+_LETTER_FORMS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+})
+
+
+def normalize(text):
+    """
+    Folds ``text`` for matching: case, Arabic diacritics and tatweel, and
+    the alef / ya / ta marbuta variants.
+    """
+    text = unicodedata.normalize('NFKC', text or '')
+    text = _DIACRITICS.sub('', text).translate(_LETTER_FORMS).casefold()
+    return ' '.join(text.split())
+
+
+def search_name_for(user):
+    return normalize(f"{user.username} {user.full_name}")
+
+
+def index_user(user):
+    """
+    Mirrors ``user.search_name`` into the SQLite FTS table. Postgres indexes
+    the column itself.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = %s", [user.pk])
+        cursor.execute(
+            f"INSERT INTO {SQLITE_FTS_TABLE} (rowid, search_name) VALUES (%s, %s)", [user.pk, user.search_name]
+        )
+
+
+def index_users(users):
+    """
+    Adds newly created ``users`` (``pk`` and ``search_name`` loaded) to the
+    SQLite FTS table in one statement, for rows written with ``bulk_create``.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {SQLITE_FTS_TABLE} (rowid, search_name) VALUES (%s, %s)",
+            [(user.pk, user.search_name) for user in users],
+        )
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Recomputes every ``search_name`` and, on SQLite, refills the FTS table
+    from the column. Returns the number of names that had drifted.
+    """
+    users = models.CustomUser.objects.only('pk', 'username', 'full_name', 'search_name').order_by('pk')
+    stale = []
+    for user in users.iterator(chunk_size=batch_size):
+        name = search_name_for(user)
+        if user.search_name != name:
+            user.search_name = name
+            stale.append(user)
+    with transaction.atomic():
+        models.CustomUser.objects.bulk_update(stale, ['search_name'], batch_size=batch_size)
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {SQLITE_FTS_TABLE}")
+                cursor.execute(
+                    f"INSERT INTO {SQLITE_FTS_TABLE} (rowid, search_name) SELECT id, search_name FROM vite_customuser"
+                )
+    return len(stale)
+
+
+def unindex_user(user_id):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = %s", [user_id])
+
+
+def _sqlite_candidates(term):
+    # FTS5 table with the trigram tokenizer; the phrase is quoted so
+    # user input is never parsed as FTS syntax.
+    phrase = '"{}"'.format(term.replace('"', '""'))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s LIMIT %s",
+            [phrase, SQLITE_CANDIDATES],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _matching(term):
+    users = models.CustomUser.objects.all()
+    if len(term) < TRIGRAM_MIN_LENGTH:
+        return users.filter(search_name__startswith=term)
+    if connection.vendor == 'postgresql':
+        return users.filter(Q(search_name__contains=term) | Q(TrigramWordSimilar(F('search_name'), term)))
+    if connection.vendor == 'sqlite':
+        return users.filter(pk__in=_sqlite_candidates(term))
+    return users.filter(search_name__contains=term)
+
+
+def search_users(viewer, query, limit=SEARCH_RESULTS_LIMIT):
+    """
+    Users matching ``query`` best first, at most ``limit`` of them. Users
+    blocked by or blocking ``viewer`` are left out.
+    """
+    raw = query.strip().lstrip('@')[:MAX_QUERY_LENGTH]
+    term = normalize(raw)
+    if not term:
+        return []
+
+    friends_through = models.CustomUser.friends.through
+    is_friend = Exists(friends_through.objects.filter(from_customuser_id=viewer.pk, to_customuser_id=OuterRef('pk')))
+
+    rank = (
+        Case(
+            When(username__iexact=raw, then=Value(100)),
+            When(search_name__startswith=term, then=Value(50)),
+            When(search_name__contains=f" {term}", then=Value(40)),
+            default=Value(0),
+        )
+        + Case(When(is_friend, then=Value(30)), default=Value(0))
+        + Case(When(is_verified=True, then=Value(10)), default=Value(0))
+    )
+    if connection.vendor == 'postgresql':
+        rank = rank + TrigramWordSimilarity(term, 'search_name') * 20
+
+    users = _matching(term).exclude(pk__in=graph.hidden_ids(viewer.id)).annotate(
+        is_friend=is_friend,
+        rank=rank,
+    ).order_by('-rank', 'username')
+    return graph.attach_friend_counts(list(users[:limit]))
+
+
+def serialize_result(user):
+    return {
+        "username": user.username,
+        "full_name": user.full_name,
+        "avatar_url": images.url(user, 'profile_picture', images.AVATAR_WIDTH) or None,
+        "is_friend": user.is_friend,
+        "has_blue_badge": user.has_blue_badge,
+    }
@@ -0,0 +1,284 @@
+# seeding.py
+"""
+Synthetic social graph for tests and benchmarks.
+
+``seed(scale)`` writes everything with ``bulk_create`` (no per-row saves or
+signals): named users (``viewer``, ``friend``, ``stranger``, ``requester``,
+``requester2``, ``blocked``, ``blocker``) plus ``5 * scale`` others, their
+friendships, requests and blocks, and about ``10 * scale`` posts with likes
+and comments, ``5 * scale`` reels with likes, comments and viewers, a story
+per user, message threads and notifications. The denormalized counters are
+recomputed at the end, so the data looks as if it was created through the
+app. Generation is deterministic for a given ``scale`` and ``seed``.
+
+``seed_benchmark`` (``manage.py seed_benchmark``) is its large sibling: it
+streams millions of rows from generators, with ``COPY`` on Postgres and
+batched ``bulk_create`` elsewhere, never holding a table in memory. Friends
+and likers are picked by fixed id offsets rather than random samples, so no
+duplicate pairs have to be filtered out, and the counters are written with
+the rows instead of recomputed.
+"""
+import random
+from array import array
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+from . import engagement, search
+from .models import (
+    Comment, CustomUser, Like, Message, Notification, Post, Reel, ReelComment, ReelLike, SavedPost, Story, StoryLike,
+)
+
+NAMED_USERS = ('viewer', 'friend', 'stranger', 'requester', 'requester2', 'blocked', 'blocker')
+PASSWORD = 'x'
+BATCH_SIZE = 1000
+
+
+def _pairs(through, pairs, from_field, to_field):
+    through.objects.bulk_create(
+        [through(**{from_field: a, to_field: b}) for a, b in pairs], batch_size=BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def seed(scale=1, seed=0):
+    """
+    Returns ``{name: user}`` for the named users.
+    """
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+    names = [*NAMED_USERS, *(f"user{i}" for i in range(5 * scale))]
+    users = CustomUser.objects.bulk_create(
+        [CustomUser(username=name, password=password, search_name=search.normalize(name)) for name in names],
+        batch_size=BATCH_SIZE,
+    )
+    search.index_users(users)
+    named = {user.username: user for user in users[:len(NAMED_USERS)]}
+    viewer, friend = named['viewer'], named['friend']
+    others = users[len(NAMED_USERS):]
+    ids = [user.pk for user in users]
+
+    friendships = {(viewer.pk, friend.pk)}
+    friendships.update((viewer.pk, other.pk) for other in others)
+    for other in others:
+        friendships.update((other.pk, peer.pk) for peer in rng.sample(others, min(3, len(others))) if peer != other)
+    friendships |= {(b, a) for a, b in friendships}
+    _pairs(CustomUser.friends.through, friendships, 'from_customuser_id', 'to_customuser_id')
+    _pairs(CustomUser.friend_requests.through, [
+        (named['requester'].pk, viewer.pk), (named['requester2'].pk, viewer.pk),
+    ], 'from_customuser_id', 'to_customuser_id')
+    _pairs(CustomUser.blocked_users.through, [
+        (viewer.pk, named['blocked'].pk), (named['blocker'].pk, viewer.pk),
+    ], 'from_customuser_id', 'to_customuser_id')
+
+    authors = [viewer, friend, *others]
+    posts = Post.objects.bulk_create(
+        [Post(user=authors[i % len(authors)], content=f"post {i}") for i in range(10 * scale)], batch_size=BATCH_SIZE
+    )
+    Like.objects.bulk_create(
+        [Like(user_id=user_id, post=post) for post in posts for user_id in rng.sample(ids, min(5, len(ids)))],
+        batch_size=BATCH_SIZE,
+    )
+    Comment.objects.bulk_create(
+        [Comment(user_id=rng.choice(ids), post=post, content="comment") for post in posts for _ in range(3)],
+        batch_size=BATCH_SIZE,
+    )
+    SavedPost.objects.bulk_create([SavedPost(user=viewer, post=post) for post in posts[:5]])
+
+    reels = Reel.objects.bulk_create(
+        [Reel(user=authors[i % len(authors)], video='sample', caption=f"reel {i}") for i in range(5 * scale)],
+        batch_size=BATCH_SIZE,
+    )
+    ReelLike.objects.bulk_create(
+        [ReelLike(user_id=user_id, reel=reel) for reel in reels for user_id in rng.sample(ids, min(3, len(ids)))],
+        batch_size=BATCH_SIZE,
+    )
+    ReelComment.objects.bulk_create(
+        [ReelComment(user_id=rng.choice(ids), reel=reel, content="comment") for reel in reels for _ in range(2)],
+        batch_size=BATCH_SIZE,
+    )
+    _pairs(Reel.viewers.through, {
+        (reel.pk, user_id) for reel in reels for user_id in rng.sample(ids, min(3, len(ids)))
+    }, 'reel_id', 'customuser_id')
+
+    expires_at = timezone.now() + timedelta(hours=24)
+    stories = Story.objects.bulk_create(
+        [Story(user=author, image='sample', expires_at=expires_at) for author in authors], batch_size=BATCH_SIZE
+    )
+    StoryLike.objects.bulk_create(
+        [StoryLike(user_id=user_id, story=story) for story in stories for user_id in rng.sample(ids, min(2, len(ids)))],
+        batch_size=BATCH_SIZE,
+    )
+
+    messages = [
+        Message(
+            sender=viewer if i % 2 else friend, receiver=friend if i % 2 else viewer,
+            content=f"message {i}", is_read=i < 15 * scale,
+        )
+        for i in range(20 * scale)
+    ]
+    messages += [Message(sender=other, receiver=viewer, content="hi") for other in others]
+    messages += [Message(sender=viewer, receiver=other, content="hello", is_read=True) for other in others]
+    Message.objects.bulk_create(messages, batch_size=BATCH_SIZE)
+
+    kinds = ['like', 'comment', 'reel_like', 'friend_accept']
+    Notification.objects.bulk_create([
+        Notification(
+            recipient=viewer, sender_id=rng.choice(ids[1:]), notification_type=kinds[i % len(kinds)],
+            related_id=posts[i % len(posts)].pk if posts else None, content="notification", is_read=i % 3 == 0,
+        )
+        for i in range(10 * scale)
+    ], batch_size=BATCH_SIZE)
+
+    engagement.reconcile()
+    return named
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _copy(model, objs):
+    """
+    Streams ``objs`` (unsaved instances) into the model's table with COPY.
+    Returns the number of rows.
+    """
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    rows = 0
+    with connection.cursor() as cursor:
+        with cursor.cursor.copy(f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN") as copy:
+            for obj in objs:
+                copy.write_row([
+                    field.get_db_prep_save(field.pre_save(obj, add=True), connection) for field in fields
+                ])
+                rows += 1
+    return rows
+
+
+def insert(model, objs, batch_size=BATCH_SIZE):
+    """
+    Writes unsaved instances from any iterable without materializing it.
+    Returns the number of rows.
+    """
+    if connection.vendor == 'postgresql':
+        return _copy(model, objs)
+    rows = 0
+    for batch in _batches(objs, batch_size):
+        model.objects.bulk_create(batch)
+        rows += len(batch)
+    return rows
+
+
+def _offsets(rng, count, population):
+    """
+    ``count`` distinct non-zero offsets such that ``i + d`` and ``i - d``
+    never coincide modulo ``population``.
+    """
+    candidates = list(range(1, (population + 1) // 2))
+    return rng.sample(candidates, min(count, len(candidates)))
+
+
+def _new_rows(model, after_pk, *fields):
+    """
+    Columns of the rows added after ``after_pk`` as compact arrays: a
+    streaming cursor cannot stay open while COPY uses the connection.
+    """
+    columns = [array('q') for _ in fields]
+    for row in model.objects.filter(pk__gt=after_pk).order_by('pk').values_list(*fields):
+        for column, value in zip(columns, row):
+            column.append(value)
+    return columns
+
+
+def _max_pk(model):
+    return model.objects.aggregate(top=Max('pk'))['top'] or 0
+
+
+def seed_benchmark(users=10000, friends=10, posts=50000, likes=5, messages=100000, notifications=100000,
+                   reels=5000, viewers=20, prefix='bench', seed=0, log=None):
+    """
+    Generates a benchmark data set. ``friends`` is per user (each friendship
+    is stored in both directions), ``likes`` per post and ``viewers`` per
+    reel. Messages go between friends and notifications to random users.
+    Returns ``{table: rows written}``.
+    """
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+    written = {}
+
+    def run(model, objs):
+        table = model._meta.db_table
+        written[table] = insert(model, objs)
+        log(f"{table}: {written[table]}")
+
+    first_user = _max_pk(CustomUser)
+    run(CustomUser, (
+        CustomUser(username=f"{prefix}{i}", password=password, search_name=search.normalize(f"{prefix}{i}"))
+        for i in range(users)
+    ))
+    ids, = _new_rows(CustomUser, first_user, 'pk')
+    n = len(ids)
+    if connection.vendor == 'sqlite':
+        for batch in _batches(ids, BATCH_SIZE):
+            search.index_users(CustomUser.objects.filter(pk__in=batch).only('pk', 'search_name'))
+    position = {user_id: index for index, user_id in enumerate(ids)}
+
+    friend_offsets = _offsets(rng, friends // 2, n)
+    through = CustomUser.friends.through
+    run(through, (
+        through(from_customuser_id=ids[i], to_customuser_id=ids[(i + sign * d) % n])
+        for d in friend_offsets for sign in (1, -1) for i in range(n)
+    ))
+
+    like_offsets = _offsets(rng, likes, n)
+    first_post = _max_pk(Post)
+    run(Post, (
+        Post(user_id=ids[rng.randrange(n)], content=f"post {i}", likes_count=len(like_offsets))
+        for i in range(posts)
+    ))
+    post_ids, authors = _new_rows(Post, first_post, 'pk', 'user_id')
+    run(Like, (
+        Like(user_id=ids[(position[author] + d) % n], post_id=post_id)
+        for post_id, author in zip(post_ids, authors) for d in like_offsets
+    ))
+
+    run(Message, (
+        Message(
+            sender_id=ids[i % n], receiver_id=ids[(i + friend_offsets[i % len(friend_offsets)]) % n],
+            content=f"message {i}", is_read=rng.random() < 0.9,
+        )
+        for i in range(messages if friend_offsets else 0)
+    ))
+
+    kinds = ['like', 'comment', 'friend_accept', 'reel_like']
+    run(Notification, (
+        Notification(
+            recipient_id=ids[i % n], sender_id=ids[(i + 1 + rng.randrange(n - 1)) % n] if n > 1 else ids[0],
+            notification_type=kinds[i % len(kinds)], content="notification", is_read=rng.random() < 0.7,
+        )
+        for i in range(notifications)
+    ))
+
+    viewer_offsets = _offsets(rng, viewers, n)
+    first_reel = _max_pk(Reel)
+    run(Reel, (
+        Reel(user_id=ids[rng.randrange(n)], video='sample', caption=f"reel {i}", views_count=len(viewer_offsets))
+        for i in range(reels)
+    ))
+    reel_ids, authors = _new_rows(Reel, first_reel, 'pk', 'user_id')
+    through = Reel.viewers.through
+    run(through, (
+        through(reel_id=reel_id, customuser_id=ids[(position[author] + d) % n])
+        for reel_id, author in zip(reel_ids, authors) for d in viewer_offsets
+    ))
+
+    expires_at = timezone.now() + timedelta(hours=24)
+    run(Story, (Story(user_id=ids[i], image='sample', expires_at=expires_at) for i in range(0, n, 10)))
+    return written
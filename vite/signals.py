@@ -0,0 +1,117 @@
+# signals.py
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import caching, counters, engagement, graph, search
+from .models import Comment, CustomUser, Like, Message, Notification, Post, Reel, ReelComment, ReelLike, SavedPost, Story, StoryLike
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'search_name' in update_fields:
+        search.index_user(instance)
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    search.unindex_user(instance.pk)
+
+
+_GRAPH_FIELDS = {
+    CustomUser.friends.through: 'friends',
+    CustomUser.blocked_users.through: 'blocked_users',
+    CustomUser.friend_requests.through: 'friend_requests',
+}
+
+
+@receiver(m2m_changed, sender=CustomUser.friends.through)
+@receiver(m2m_changed, sender=CustomUser.blocked_users.through)
+@receiver(m2m_changed, sender=CustomUser.friend_requests.through)
+def friend_graph_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    own, other = ('to_customuser_id', 'from_customuser_id') if reverse else ('from_customuser_id', 'to_customuser_id')
+    if action == 'pre_clear':
+        # clear() passes no pk_set; remember who is on the other side before the rows go.
+        instance._graph_cleared_ids = set(sender.objects.filter(**{own: instance.pk}).values_list(other, flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_graph_cleared_ids', set())
+    elif action not in ('post_add', 'post_remove'):
+        return
+
+    field = _GRAPH_FIELDS[sender]
+    if reverse:
+        graph.invalidate(field, from_ids=pk_set, to_ids=[instance.pk])
+    else:
+        graph.invalidate(field, from_ids=[instance.pk], to_ids=pk_set)
+
+
+@receiver(post_save, sender=Message)
+def message_created(sender, instance, created, **kwargs):
+    if created and not instance.is_read:
+        counters.adjust(counters.MESSAGES, instance.receiver_id, 1)
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, **kwargs):
+    if not instance.is_read:
+        counters.adjust(counters.MESSAGES, instance.receiver_id, -1)
+
+
+@receiver(post_save, sender=Notification)
+def notification_created(sender, instance, created, **kwargs):
+    if created and not instance.is_read:
+        counters.adjust(counters.NOTIFICATIONS, instance.recipient_id, 1)
+
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    if not instance.is_read:
+        counters.adjust(counters.NOTIFICATIONS, instance.recipient_id, -1)
+
+
+@receiver([post_save, post_delete], sender=Story)
+def story_changed(sender, instance, **kwargs):
+    caching.invalidate(caching.STORIES)
+
+
+@receiver([post_save, post_delete], sender=Reel)
+def reel_changed(sender, instance, update_fields=None, **kwargs):
+    # زيادة المشاهدات وحدها لا تلغي الشريط المخزن؛ يتحدث العدد عند انتهاء صلاحيته
+    if update_fields and set(update_fields) <= {'views_count'}:
+        return
+    caching.invalidate(caching.REELS)
+
+
+@receiver([post_save, post_delete], sender=Post)
+def post_changed(sender, instance, **kwargs):
+    caching.invalidate(caching.post_fragment(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Like)
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=SavedPost)
+def post_interaction_changed(sender, instance, origin=None, **kwargs):
+    # Deleting the post itself already invalidated its fragment (post_changed).
+    if isinstance(origin, Post) and origin.pk == instance.post_id:
+        return
+    caching.invalidate(caching.post_fragment(instance.post_id))
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=ReelLike)
+@receiver(post_save, sender=ReelComment)
+@receiver(post_save, sender=StoryLike)
+def counted_row_created(sender, instance, created, **kwargs):
+    if created:
+        engagement.adjust(instance, 1)
+
+
+@receiver(post_delete, sender=Like)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=ReelLike)
+@receiver(post_delete, sender=ReelComment)
+@receiver(post_delete, sender=StoryLike)
+def counted_row_deleted(sender, instance, origin=None, **kwargs):
+    if not engagement.deleted_with_parent(instance, origin):
+        engagement.adjust(instance, -1)
@@ -270,7 +270,7 @@
                             </div>
                             ${timeAndSeenHTML}`;
                     } else {
-                        if (msg.image_url) mediaHTML = `<img src="${msg.image_url}" alt="Image" style="cursor:pointer;">`;
+                        if (msg.image_url) mediaHTML = `<img src="${msg.image_url}" srcset="${(msg.image_srcset && msg.image_srcset.webp) || ''}" sizes="(max-width: 600px) 70vw, 320px" alt="Image" style="cursor:pointer;">`;
                         else if (msg.video_url) mediaHTML = `<video src="${msg.video_url}" controls></video>`;
                         messageDiv.innerHTML = `${replySection} ${mediaHTML} ${contentHTML} ${timeAndSeenHTML}`;
                     }
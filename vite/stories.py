@@ -0,0 +1,88 @@
+# stories.py
+"""
+Stories tray for the home page.
+
+The tray (every user with an active story and the preview of their latest
+one) is the same for everybody, so it is built with a single query and kept
+in the cache under the current ``caching.STORIES`` generation; preview URLs
+are computed once when the tray is built. Per viewer only the blocked users
+are filtered out and the order is set. Neither the tray nor a rendered strip
+(``fragment_timeout``) is cached past the first expiry in it.
+"""
+import random
+
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from . import caching, graph, images
+from .models import Story
+
+DEFAULT_PREVIEW = '/static/images/default_profile.png'
+
+
+def active_stories(now=None):
+    # Stories whose media is still uploading (see uploads.py) have neither field set yet.
+    # Expired ones stay until expiry.sweep removes them.
+    return Story.objects.filter(expires_at__gt=now or timezone.now()).exclude(image__isnull=True, video__isnull=True)
+
+
+def _build_tray(now):
+    active = active_stories(now)
+    latest_per_user = active.filter(user_id=OuterRef('user_id')).order_by('-created_at', '-pk').values('pk')[:1]
+    latest = active.filter(pk=Subquery(latest_per_user)).select_related('user').order_by('-created_at')
+
+    tray = []
+    for story in latest:
+        tray.append({
+            'user_id': story.user_id,
+            'username': story.user.username,
+            'avatar_url': images.url(story.user, 'profile_picture', images.AVATAR_WIDTH) or DEFAULT_PREVIEW,
+            'preview_url': story.preview_url,
+            'expires_at': story.expires_at,
+        })
+    return tray
+
+
+def _timeout(tray, now):
+    if not tray:
+        return caching.FRAGMENT_TIMEOUT
+    first_expiry = min(entry['expires_at'] for entry in tray)
+    return max(1, min(caching.FRAGMENT_TIMEOUT, int((first_expiry - now).total_seconds())))
+
+
+def get_tray():
+    """
+    Cached tray shared by all viewers. Entries drop out when their story
+    expires: the cache entry never outlives the oldest story in it.
+    """
+    key = f"stories:tray:{caching.get_generation(caching.STORIES)}"
+    tray = cache.get(key)
+    if tray is None:
+        now = timezone.now()
+        tray = _build_tray(now)
+        cache.set(key, tray, _timeout(tray, now))
+    return tray
+
+
+def fragment_timeout():
+    """
+    Seconds a rendered strip may be cached: ``caching.FRAGMENT_TIMEOUT``,
+    but not past the first expiry in the tray.
+    """
+    return _timeout(get_tray(), timezone.now())
+
+
+def tray_for(user):
+    """
+    Active stories for the home page, the viewer's own first and the rest shuffled.
+    """
+    now = timezone.now()
+    blocked_ids = graph.blocked_ids(user.id)
+    own, others = [], []
+    for entry in get_tray():
+        if entry['user_id'] in blocked_ids or entry['expires_at'] <= now:
+            continue
+        (own if entry['user_id'] == user.id else others).append(entry)
+    random.shuffle(others)
+    return own + others
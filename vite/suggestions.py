@@ -0,0 +1,122 @@
+# suggestions.py
+"""
+"People you may know": friends of friends ranked by mutual friends.
+
+Suggestions are computed in a batch job (``manage.py
+compute_friend_suggestions``) over the whole friend graph held as a sparse
+adjacency matrix ``A``: the mutual friend counts of a block of users are the
+rows of ``A[block] @ A.T``. Current friends, blocked users (either way) and
+pending requests (either way) are masked out, the top
+``SUGGESTIONS_PER_USER`` of each row are kept and stored in
+``FriendSuggestion``. Serving a user's suggestions is one indexed query plus
+the cached sets of ``graph.py`` to drop anything that changed since the last
+run.
+"""
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+from scipy import sparse
+
+from . import graph, images
+from .models import CustomUser, FriendSuggestion
+
+SUGGESTIONS_PER_USER = 50
+SUGGESTIONS_PAGE_SIZE = 10
+BLOCK_SIZE = 2000
+
+
+def _edges(field, index):
+    through = getattr(CustomUser, field).through
+    pairs = np.array(
+        list(through.objects.values_list('from_customuser_id', 'to_customuser_id')), dtype=np.int64
+    ).reshape(-1, 2)
+    size = len(index)
+    rows, cols = np.searchsorted(index, pairs[:, 0]), np.searchsorted(index, pairs[:, 1])
+    return sparse.csr_matrix((np.ones(len(pairs), dtype=np.int32), (rows, cols)), shape=(size, size))
+
+
+def _top(row_values, row_columns, limit):
+    if len(row_values) > limit:
+        keep = np.argpartition(-row_values, limit)[:limit]
+        row_values, row_columns = row_values[keep], row_columns[keep]
+    order = np.lexsort((row_columns, -row_values))
+    return row_values[order], row_columns[order]
+
+
+def compute(user_ids=None, limit=SUGGESTIONS_PER_USER, block_size=BLOCK_SIZE):
+    """
+    Rebuilds the stored suggestions of ``user_ids`` (everyone by default).
+    Returns the number of rows written.
+    """
+    index = np.array(sorted(CustomUser.objects.values_list('pk', flat=True)), dtype=np.int64)
+    if not len(index):
+        return 0
+    friends = _edges('friends', index)
+    friends.data[:] = 1  # duplicate edges must not count twice
+    blocked = _edges('blocked_users', index)
+    requests = _edges('friend_requests', index)
+    excluded = (friends + blocked + blocked.T + requests + requests.T + sparse.identity(len(index), format='csr')).tocsr()
+    excluded.data[:] = 1
+    friends_t = friends.T.tocsr()
+
+    rows = np.arange(len(index)) if user_ids is None else np.searchsorted(index, np.intersect1d(index, list(user_ids)))
+    now = timezone.now()
+    written = 0
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        mutual = (friends[block] @ friends_t).tocsr()
+        mutual = (mutual - mutual.multiply(excluded[block])).tocsr()
+        mutual.eliminate_zeros()
+
+        objs = []
+        for offset, row in enumerate(block):
+            begin, end = mutual.indptr[offset], mutual.indptr[offset + 1]
+            counts, columns = _top(mutual.data[begin:end], mutual.indices[begin:end], limit)
+            user_id = int(index[row])
+            objs.extend(
+                FriendSuggestion(user_id=user_id, suggested_id=int(index[column]), mutual_count=int(count), computed_at=now)
+                for count, column in zip(counts, columns)
+            )
+        with transaction.atomic():
+            FriendSuggestion.objects.filter(user_id__in=index[block].tolist()).delete()
+            FriendSuggestion.objects.bulk_create(objs, batch_size=1000)
+        written += len(objs)
+    return written
+
+
+def for_user(user, limit=SUGGESTIONS_PAGE_SIZE):
+    """
+    Stored suggestions for ``user``, best first, minus users that became
+    friends, got blocked or got a request since the last run. Those are
+    dropped in Python rather than sent to the database as id lists: rows
+    are read ``2 * limit`` at a time until ``limit`` are left.
+    """
+    stale = (
+        graph.friend_ids(user.id)
+        | graph.hidden_ids(user.id)
+        | graph.get_ids(graph.SENT_REQUESTS, user.id)
+        | graph.get_ids(graph.RECEIVED_REQUESTS, user.id)
+    )
+    rows = FriendSuggestion.objects.filter(user=user).select_related('suggested').order_by('-mutual_count', 'suggested_id')
+    batch_size = max(1, 2 * limit)
+    suggested, start = [], 0
+    while len(suggested) < limit:
+        batch = list(rows[start:start + batch_size])
+        for row in batch:
+            if row.suggested_id not in stale and len(suggested) < limit:
+                row.suggested.mutual_count = row.mutual_count
+                suggested.append(row.suggested)
+        if len(batch) < batch_size:
+            break
+        start += batch_size
+    return graph.attach_friend_counts(suggested)
+
+
+def serialize_suggestion(user):
+    return {
+        "username": user.username,
+        "full_name": user.full_name,
+        "avatar_url": images.url(user, 'profile_picture', images.AVATAR_WIDTH) or None,
+        "mutual_count": user.mutual_count,
+        "has_blue_badge": user.has_blue_badge,
+    }
@@ -0,0 +1,20 @@
+# responsive.py
+"""
+``{% srcset post 'image' %}`` and ``{% image_url user 'profile_picture' 160 %}``
+over the variants recorded by ``images.py``.
+"""
+from django import template
+
+from .. import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def srcset(instance, field_name, fmt=images.DEFAULT_FORMAT):
+    return images.srcset(instance, field_name, fmt)
+
+
+@register.simple_tag
+def image_url(instance, field_name, width=images.AVATAR_WIDTH):
+    return images.url(instance, field_name, width)
@@ -1,3 +1,1253 @@
-from django.test import TestCase
+import json
+import os
+import re
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    caching, counters, engagement, expiry, feed, graph, images, media, messaging, metrics, notify, presence, qrcodes,
+    realtime, reelviews, search, seeding, stories, suggestions, uploads,
+)
+from .consumers import ChatConsumer, UserEventsConsumer
+from .models import (
+    Comment, CustomUser, DeletedMessage, FriendSuggestion, Like, MediaDeletion, MediaUpload, Message, Notification,
+    Post, Reel, ReelComment, ReelLike, Story, StoryLike,
+)
+
+# Tables that grow with activity; a query touching them must go through an index.
+HOT_TABLES = {
+    'vite_post', 'vite_like', 'vite_comment', 'vite_message', 'vite_deletedmessage',
+    'vite_notification', 'vite_story', 'vite_reel',
+}
+
+
+def _sqlite_full_scans(sql):
+    # Subqueries alias their tables (``"vite_message" U0``); EXPLAIN reports the alias.
+    aliases = {alias: table for table, alias in re.findall(r'"(\w+)" ([A-Z]\d+)\b', sql)}
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        details = [row[-1] for row in cursor.fetchall()]
+    # ``ORDER BY <pk> ... LIMIT n`` without a sort step walks the rowid (the
+    # primary key) and stops after n rows; that is an index walk, not a scan.
+    pk_walk = re.search(r'ORDER BY "(\w+)"\."id" (?:ASC|DESC) LIMIT \d+$', sql)
+    if pk_walk and not any('TEMP B-TREE FOR ORDER BY' in detail for detail in details):
+        pk_walk = pk_walk.group(1)
+    else:
+        pk_walk = None
+
+    scans = set()
+    for detail in details:
+        match = re.fullmatch(r'SCAN (\w+)', detail)
+        if match and match.group(1) != pk_walk:
+            scans.add(aliases.get(match.group(1), match.group(1)))
+    return scans
+
+
+def _postgres_full_scans(sql):
+    with connection.cursor() as cursor:
+        # Tiny test tables are cheaper to scan; make the planner show whether an index *can* be used.
+        cursor.execute('SET enable_seqscan = off')
+        try:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+        finally:
+            cursor.execute('RESET enable_seqscan')
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scans = set()
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan':
+            scans.add(node['Relation Name'])
+        nodes.extend(node.get('Plans', []))
+    return scans
+
+
+PLAN_READERS = {'postgresql': _postgres_full_scans, 'sqlite': _sqlite_full_scans}
+
+
+def full_scans(sql):
+    """
+    Hot tables that the plan of ``sql`` reads without an index.
+    """
+    return PLAN_READERS[connection.vendor](sql) & HOT_TABLES
+
+
+class IndexUsageTests(TestCase):
+    """
+    Runs each hot view against a seeded database and EXPLAINs every SELECT it
+    issues. A full scan of a hot table means an index is missing.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('viewer', password='x')
+        cls.friend = CustomUser.objects.create_user('friend', password='x')
+        others = [CustomUser.objects.create_user(f'user{i}', password='x') for i in range(5)]
+        cls.user.friends.add(cls.friend, *others)
+        cls.friend.friends.add(cls.user)
+
+        for author in [cls.friend, *others]:
+            for i in range(4):
+                post = Post.objects.create(user=author, content=f'post {i}')
+                Like.objects.create(user=cls.user, post=post)
+                Comment.objects.create(user=cls.friend, post=post, content='comment')
+            Story.objects.create(user=author, image='sample')
+            Reel.objects.create(user=author, video='sample')
+            Notification.objects.create(recipient=cls.user, sender=author, notification_type='like')
+
+        messages = [
+            Message.objects.create(sender=sender, receiver=receiver, content=f'message {i}')
+            for i in range(10)
+            for sender, receiver in ((cls.user, cls.friend), (cls.friend, cls.user))
+        ]
+        DeletedMessage.objects.create(sender=cls.friend, receiver=cls.user, message_id=messages[-1].id + 1)
+
+    def setUp(self):
+        if connection.vendor not in PLAN_READERS:
+            self.skipTest(f"no query plan reader for {connection.vendor}")
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def assertUsesIndexes(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertLess(response.status_code, 400, url)
+
+        selects = [q['sql'] for q in queries.captured_queries if q['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertTrue(selects, url)
+        for sql in selects:
+            with self.subTest(url=url, sql=sql[:200]):
+                self.assertEqual(full_scans(sql), set())
+
+    def test_home(self):
+        self.assertUsesIndexes('/home/')
+
+    def test_feed_page(self):
+        self.assertUsesIndexes('/feed/')
+
+    def test_profile(self):
+        self.assertUsesIndexes(f'/profile/{self.friend.username}/')
+
+    def test_chat_list(self):
+        self.assertUsesIndexes(f'/chat/list/{self.user.username}/')
+
+    def test_conversation_history(self):
+        self.assertUsesIndexes(f'/chat/{self.friend.username}/get-messages/')
+
+    def test_conversation_sync(self):
+        last_id = Message.objects.order_by('-id').values_list('id', flat=True)[0]
+        since = (timezone.now() - timedelta(minutes=5)).isoformat()
+        self.assertUsesIndexes(
+            f'/chat/{self.friend.username}/get-messages/?after_id={last_id - 5}&since={since.replace("+", "%2B")}'
+        )
+
+    def test_unread_counts(self):
+        self.assertUsesIndexes('/notifications/unread_count/')
+        self.assertUsesIndexes('/messages/unread_count/')
+
+    def test_notifications(self):
+        self.assertUsesIndexes('/notifications/')
+        self.assertUsesIndexes('/notifications/page/?limit=2')
+
+    def test_stories(self):
+        self.assertUsesIndexes(f'/stories/{self.friend.username}/')
+
+    def test_reels(self):
+        self.assertUsesIndexes('/reels/')
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.user = CustomUser.objects.create_user('viewer', password='x')
+        self.client.force_login(self.user)
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get('/home/')
+        self.client.get('/home/')
+        self.assertEqual(self.client.get('/metrics/').status_code, 404)
+
+        self.user.is_staff = True
+        self.user.save()
+        body = self.client.get('/metrics/').content.decode()
+        self.assertIn('vite_request_duration_seconds_count{view="home"} 2', body)
+        self.assertIn('vite_request_queries_count{view="home"} 2', body)
+        self.assertIn('vite_requests_total{view="home",status="2xx"} 2', body)
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        presence._pending.clear()
+        self.addCleanup(presence._pending.clear)
+        self.user = CustomUser.objects.create_user('viewer', password='x')
+
+    def test_heartbeats_are_written_once_per_interval(self):
+        presence._last_flush = time.monotonic()
+        presence.touch(self.user.pk, timezone.now() - timedelta(minutes=1))
+        presence.touch(self.user.pk)
+        self.assertIsNone(CustomUser.objects.get(pk=self.user.pk).last_active)
+        self.assertTrue(presence.is_online(CustomUser.objects.get(pk=self.user.pk)))
+
+        now = timezone.now()
+        with mock.patch.object(presence, 'FLUSH_INTERVAL', 0), self.assertNumQueries(1):
+            presence.touch(self.user.pk, now)
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).last_active, now)
+        self.assertEqual(presence.flush(), 0)
+
+    def test_flush_writes_the_latest_heartbeat_per_user(self):
+        other = CustomUser.objects.create_user('other', password='x')
+        presence._last_flush = time.monotonic()
+        first, last = timezone.now() - timedelta(seconds=30), timezone.now()
+        presence.touch(self.user.pk, first)
+        presence.touch(self.user.pk, last)
+        presence.touch(other.pk, first)
+        self.assertEqual(presence.flush(), 2)
+        self.assertEqual(
+            dict(CustomUser.objects.values_list('pk', 'last_active')), {self.user.pk: last, other.pk: first}
+        )
+
+    def test_a_failed_flush_keeps_its_heartbeats_and_does_not_fail_the_request(self):
+        gone = CustomUser.objects.create_user('gone')
+        gone_id = gone.pk
+        presence.touch(gone_id)
+        gone.delete()
+        now = timezone.now()
+        failing = mock.patch.object(CustomUser.objects, 'bulk_update', side_effect=DatabaseError)
+        with failing, mock.patch.object(presence, 'FLUSH_INTERVAL', 0), self.assertLogs('vite.presence', 'ERROR'):
+            presence.touch(self.user.pk, now)
+        self.assertEqual(set(presence._pending), {gone_id, self.user.pk})
+        self.assertEqual(presence.flush(), 2)
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).last_active, now)
+
+
+class ReelViewsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reelviews._pending.clear()
+        self.addCleanup(reelviews._pending.clear)
+        reelviews._last_flush = time.monotonic()
+        self.author, self.a, self.b = (CustomUser.objects.create_user(name, password='x') for name in ('author', 'a', 'b'))
+        self.reel = Reel.objects.create(user=self.author, video='sample')
+        self.other_reel = Reel.objects.create(user=self.author, video='sample')
+
+    def test_a_viewer_counts_once(self):
+        self.assertEqual(reelviews.record_view(self.reel.pk, self.a.pk), (1, True))
+        self.assertEqual(reelviews.record_view(self.reel.pk, self.a.pk), (1, False))
+        self.assertEqual(reelviews.record_view(self.reel.pk, self.b.pk), (2, True))
+        self.assertEqual(Reel.objects.get(pk=self.reel.pk).views_count, 0)
+
+    def test_flush_stores_new_viewers_and_raises_counts_in_bulk(self):
+        # Seen before the dedup key was evicted: already stored, not counted again.
+        self.reel.viewers.add(self.b)
+        for reel, user in ((self.reel, self.a), (self.reel, self.b), (self.other_reel, self.a)):
+            reelviews.record_view(reel.pk, user.pk)
+        gone = Reel.objects.create(user=self.author, video='sample')
+        reelviews.record_view(gone.pk, self.a.pk)
+        gone.delete()
+        left = CustomUser.objects.create_user('left')
+        reelviews.record_view(self.other_reel.pk, left.pk)
+        left.delete()
+
+        # Known pairs, live reels, live users, INSERT, UPDATE, plus the savepoint around them.
+        with self.assertNumQueries(7):
+            self.assertEqual(reelviews.flush(), 2)
+        self.assertEqual(
+            dict(Reel.objects.values_list('pk', 'views_count')), {self.reel.pk: 1, self.other_reel.pk: 1}
+        )
+        self.assertEqual(set(self.reel.viewers.all()), {self.a, self.b})
+        self.assertEqual(reelviews.flush(), 0)
+
+    def test_a_failed_flush_keeps_its_views_and_does_not_fail_the_view(self):
+        reelviews.record_view(self.reel.pk, self.a.pk)
+        failing = mock.patch.object(Reel.viewers.through.objects, 'bulk_create', side_effect=DatabaseError)
+        with failing, mock.patch.object(reelviews, 'FLUSH_INTERVAL', 0), self.assertLogs('vite.reelviews', 'ERROR'):
+            self.assertEqual(reelviews.record_view(self.reel.pk, self.b.pk), (2, True))
+        self.assertEqual(reelviews._pending, {(self.reel.pk, self.a.pk), (self.reel.pk, self.b.pk)})
+        self.assertEqual(reelviews.flush(), 2)
+        self.assertEqual(Reel.objects.get(pk=self.reel.pk).views_count, 2)
+
+
+class CountersTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('viewer', password='x')
+        self.layer = get_channel_layer()
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(realtime.user_group_name(self.user.pk), self.channel)
+        self.addCleanup(async_to_sync(self.layer.flush))
+
+    def test_changes_are_applied_and_pushed_on_commit_without_counting(self):
+        self.assertEqual(counters.get_unread_count(counters.NOTIFICATIONS, self.user.pk), 0)
+        with self.assertNumQueries(0):
+            with self.captureOnCommitCallbacks(execute=True):
+                counters.adjust(counters.NOTIFICATIONS, self.user.pk, 2)
+                self.assertEqual(cache.get(counters._key(counters.NOTIFICATIONS, self.user.pk)), 0)
+        message = async_to_sync(self.layer.receive)(self.channel)
+        # The message counter is not cached, so it is left out instead of counted.
+        self.assertEqual(message['payload'], {'type': 'counters', 'notifications': 2})
+
+    def test_the_events_socket_gets_the_counters_on_connect(self):
+        friend = CustomUser.objects.create_user('friend', password='x')
+        Message.objects.create(sender=friend, receiver=self.user, content='hi')
+        communicator = WebsocketCommunicator(UserEventsConsumer.as_asgi(), '/ws/events/')
+        communicator.scope['user'] = self.user
+
+        async def connect():
+            connected, _ = await communicator.connect()
+            payload = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return connected, payload
+
+        self.assertEqual(
+            async_to_sync(connect)(), (True, {'type': 'counters', 'notifications': 0, 'messages': 1})
+        )
+
+    def test_a_rolled_back_change_is_dropped(self):
+        counters.get_unread_count(counters.MESSAGES, self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                counters.adjust(counters.MESSAGES, self.user.pk, 1)
+                transaction.set_rollback(True)
+        self.assertEqual(callbacks, [])
+        self.assertEqual(counters.get_unread_count(counters.MESSAGES, self.user.pk), 0)
+
+
+class EngagementTests(TestCase):
+    def setUp(self):
+        self.author, self.a, self.b = (CustomUser.objects.create_user(name) for name in ('author', 'a', 'b'))
+        self.post = Post.objects.create(user=self.author, content='hi')
+        self.reel = Reel.objects.create(user=self.author, video='sample')
+        for user in (self.a, self.b):
+            Like.objects.create(user=user, post=self.post)
+        Comment.objects.create(user=self.a, post=self.post, content='nice')
+        ReelLike.objects.create(user=self.a, reel=self.reel)
+
+    def counts(self):
+        return (
+            Post.objects.values_list('likes_count', 'comments_count').get(pk=self.post.pk),
+            Reel.objects.values_list('likes_count', flat=True).get(pk=self.reel.pk),
+        )
+
+    def test_signals_keep_the_counters(self):
+        self.assertEqual(self.counts(), ((2, 1), 1))
+        Like.objects.filter(user=self.b).get().delete()
+        self.assertEqual(self.counts(), ((1, 1), 1))
+
+    def test_reconcile_counters_reports_and_repairs_drift(self):
+        # A raw UPDATE skips the signals, like a bulk delete or hand-written SQL would.
+        Post.objects.filter(pk=self.post.pk).update(likes_count=99)
+        Reel.objects.filter(pk=self.reel.pk).update(likes_count=0)
+
+        out = StringIO()
+        call_command('reconcile_counters', '--model', 'reel', stdout=out)
+        self.assertIn('Reel.likes_count: repaired=1', out.getvalue())
+        self.assertNotIn('Post.', out.getvalue())
+        self.assertEqual(self.counts(), ((99, 1), 1))
+
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('Post.likes_count: repaired=1', out.getvalue())
+        self.assertIn('Post.comments_count: repaired=0', out.getvalue())
+        self.assertEqual(out.getvalue().splitlines()[-1], 'repaired=1')
+        self.assertEqual(self.counts(), ((2, 1), 1))
+        self.assertEqual(sum(engagement.reconcile().values()), 0)
+
+
+class ChatConsumerTests(TransactionTestCase):
+    """
+    Not a ``TestCase``: events fan out on commit, which needs real commits.
+    """
+    def setUp(self):
+        cache.clear()
+        self.me, self.friend = (CustomUser.objects.create_user(name) for name in ('me', 'friend'))
+        self.me.friends.add(self.friend)
+        self.friend.friends.add(self.me)
+
+    def communicator(self, user, other):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/{other.username}/')
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'username': other.username}}
+        return communicator
+
+    def converse(self, steps):
+        """
+        Connects both users, then sends each ``(sender, action)`` of ``steps``
+        and collects what every socket receives. ``action`` may be a callable
+        taking the events so far. Returns ``(mine, theirs)``.
+        """
+        async def run():
+            mine, theirs = self.communicator(self.me, self.friend), self.communicator(self.friend, self.me)
+            for communicator in (mine, theirs):
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+            received = {self.me: [], self.friend: []}
+            for sender, action in steps:
+                if callable(action):
+                    action = await sync_to_async(action)(received)
+                await (mine if sender == self.me else theirs).send_json_to(action)
+                for user, communicator in ((self.me, mine), (self.friend, theirs)):
+                    while not await communicator.receive_nothing(timeout=0.2):
+                        received[user].append(await communicator.receive_json_from())
+            for communicator in (mine, theirs):
+                await communicator.disconnect()
+            return received[self.me], received[self.friend]
+
+        return async_to_sync(run)()
+
+    def test_send_seen_and_delete_reach_both_sides(self):
+        mine, theirs = self.converse([
+            (self.me, {'action': 'send', 'content': 'hello'}),
+            (self.friend, {'action': 'seen'}),
+            (self.me, lambda received: {'action': 'delete', 'id': received[self.me][0]['message']['id']}),
+        ])
+        self.assertEqual(mine, theirs)
+        self.assertEqual([event['type'] for event in mine], ['message', 'seen', 'deleted'])
+        self.assertEqual(mine[0]['message']['content'], 'hello')
+        self.assertEqual(mine[1]['ids'], [mine[0]['message']['id']])
+        self.assertFalse(Message.objects.exists())
+
+    def test_malformed_ids_are_rejected_without_closing_the_socket(self):
+        mine, theirs = self.converse([
+            (self.me, {'action': 'send', 'content': 'hi', 'reply_to': 'abc'}),
+            (self.me, {'action': 'delete', 'id': {'x': 1}}),
+            (self.me, {'action': 'send', 'content': 'still here'}),
+        ])
+        self.assertEqual([event['type'] for event in mine], ['error', 'error', 'message'])
+        self.assertEqual([event['type'] for event in theirs], ['message'])
+
+    def test_unfriending_stops_sending_mid_session(self):
+        def unfriend(received):
+            self.friend.friends.remove(self.me)
+            self.me.friends.remove(self.friend)
+            return {'action': 'send', 'content': 'too late'}
+
+        mine, theirs = self.converse([(self.me, {'action': 'send', 'content': 'hi'}), (self.me, unfriend)])
+        self.assertEqual([event['type'] for event in mine], ['message', 'error'])
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['hi'])
+
+
+class MessageSyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.me, self.friend = (CustomUser.objects.create_user(name, password='x') for name in ('me', 'friend'))
+        self.me.friends.add(self.friend)
+        self.friend.friends.add(self.me)
+        self.client.force_login(self.me)
+        self.url = reverse('get_messages', args=[self.friend.username])
+
+    def test_delta_returns_new_messages_receipts_and_deletions(self):
+        sent, gone = (Message.objects.create(sender=self.me, receiver=self.friend, content=text) for text in 'ab')
+        first = self.client.get(self.url).json()
+        self.assertEqual([m['id'] for m in first['messages']], [sent.pk, gone.pk])
+
+        Message.objects.filter(pk=sent.pk).update(is_read=True, seen_at=timezone.now())
+        gone_id = gone.pk
+        messaging.delete_message(gone)
+        new = Message.objects.create(sender=self.friend, receiver=self.me, content='c')
+        delta = self.client.get(self.url, {'after_id': first['last_id'], 'since': first['server_time']}).json()
+        self.assertEqual([m['id'] for m in delta['messages']], [new.pk])
+        self.assertEqual([u['id'] for u in delta['updated']], [sent.pk])
+        self.assertEqual(delta['deleted'], [gone_id])
+        self.assertEqual(delta['last_id'], new.pk)
+
+    def test_chat_page_leaves_history_to_get_messages_and_keeps_flash_messages(self):
+        Message.objects.create(sender=self.friend, receiver=self.me, content='hello')
+        response = self.client.get(reverse('chat', args=[self.friend.username]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIsInstance(response.context['messages'], QuerySet)
+        self.assertTrue(Message.objects.get().is_read)
+
+    def test_unchanged_conversation_answers_304(self):
+        Message.objects.create(sender=self.me, receiver=self.friend, content='a')
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        Message.objects.create(sender=self.friend, receiver=self.me, content='b')
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_since_must_be_a_valid_datetime(self):
+        for since in ('2024-13-01T00:00', 'yesterday'):
+            with self.subTest(since=since):
+                self.assertEqual(self.client.get(self.url, {'after_id': 0, 'since': since}).status_code, 400)
+        # A naive value is read in the current time zone rather than failing the comparison.
+        response = self.client.get(self.url, {'after_id': 0, 'since': '2024-01-01T00:00'})
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(NOTIFICATIONS_INLINE=True)
+class NotifyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(notify._buffer.clear)
+        self.owner, self.a, self.b, self.c = (
+            CustomUser.objects.create_user(name, password='x') for name in ('owner', 'a', 'b', 'c')
+        )
+
+    def notify(self, *senders, kind='like', related_id=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            for sender in senders:
+                notify.enqueue(self.owner.pk, sender.pk, kind, related_id)
+
+    def test_collapse_groups_aggregated_types_and_counts_each_sender_once(self):
+        now = timezone.now()
+        events = [
+            (self.owner.pk, self.a.pk, 'like', 1, now),
+            (self.owner.pk, self.b.pk, 'like', 1, now),
+            (self.owner.pk, self.a.pk, 'like', 1, now),
+            (self.owner.pk, self.a.pk, 'like', 2, now),
+            (self.owner.pk, self.a.pk, 'friend_request', self.a.pk, now),
+            (self.owner.pk, self.a.pk, 'friend_request', self.a.pk, now),
+        ]
+        self.assertEqual(list(notify._collapse(events).values()), [
+            [self.b.pk, self.a.pk], [self.a.pk], [self.a.pk], [self.a.pk],
+        ])
+
+    def test_events_merge_into_the_unread_notification(self):
+        self.notify(self.a)
+        self.notify(self.b)
+        self.notify(self.c, kind='comment')
+        like = Notification.objects.get(notification_type='like')
+        self.assertEqual((like.sender, like.actor_count), (self.b, 2))
+        self.assertEqual(like.content, notify.render_content('like', 'b', 2))
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_an_actor_counts_once_across_flushes(self):
+        for sender in (self.a, self.b, self.a, self.b):
+            self.notify(sender)
+        like = Notification.objects.get()
+        self.assertEqual((like.sender, like.actor_count, like.actor_ids), (self.b, 2, [self.a.pk, self.b.pk]))
+
+    def test_read_or_old_notifications_are_not_merged(self):
+        self.notify(self.a)
+        Notification.objects.update(is_read=True)
+        self.notify(self.b)
+        Notification.objects.filter(is_read=False).update(created_at=timezone.now() - notify.AGGREGATION_WINDOW)
+        self.notify(self.c)
+        self.assertEqual(list(Notification.objects.order_by('pk').values_list('actor_count', flat=True)), [1, 1, 1])
+
+    def test_own_actions_are_not_notified(self):
+        self.notify(self.owner)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_only_new_rows_raise_the_unread_counter(self):
+        self.assertEqual(counters.get_unread_count(counters.NOTIFICATIONS, self.owner.pk), 0)
+        self.notify(self.a)
+        self.notify(self.b)
+        self.assertEqual(counters.get_unread_count(counters.NOTIFICATIONS, self.owner.pk), 1)
+        self.notify(self.a, kind='comment')
+        self.assertEqual(counters.get_unread_count(counters.NOTIFICATIONS, self.owner.pk), 2)
+
+    def create(self, sender, kind='like', related_id=1, **fields):
+        return Notification.objects.create(
+            recipient=self.owner, sender=sender, notification_type=kind, related_id=related_id, **fields
+        )
+
+    def test_pages_do_not_skip_or_repeat_rows_with_the_same_created_at(self):
+        for sender in (self.a, self.b, self.c, self.a, self.b):
+            self.create(sender, kind='comment')
+        Notification.objects.update(created_at=timezone.now())
+        seen, cursor = [], None
+        while True:
+            page, cursor = notify.get_page(self.owner, cursor, page_size=2)
+            seen += [notification.pk for notification in page]
+            if cursor is None:
+                break
+        self.assertEqual(seen, sorted(Notification.objects.values_list('pk', flat=True), reverse=True))
+
+    def test_group_folds_rows_about_the_same_object(self):
+        self.create(self.a, actor_count=2)
+        self.create(self.c, kind='friend_request', related_id=self.c.pk)
+        self.create(self.b, actor_count=3, is_read=True)
+        page, _ = notify.get_page(self.owner)
+        like, request = notify.group(page)
+        self.assertEqual((like.group_size, like.group_actor_count, like.group_unread), (2, 5, True))
+        self.assertEqual(like.content, notify.render_content('like', 'b', 5))
+        self.assertEqual((request.notification_type, request.group_size), ('friend_request', 1))
+
+    def test_a_failed_flush_keeps_its_events_for_the_next_one(self):
+        failing = mock.patch.object(Notification.objects, 'bulk_create', side_effect=DatabaseError)
+        with failing, self.assertLogs('vite.notify', 'ERROR'):
+            self.notify(self.a, self.b)
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual([event[1] for event in notify._buffer], [self.a.pk, self.b.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(notify.flush(), (1, 0))
+        self.assertEqual(Notification.objects.get().actor_ids, [self.a.pk, self.b.pk])
+        self.assertEqual(notify._buffer, [])
+
+    def test_mark_read_lowers_the_unread_counter(self):
+        _, second, third = (self.create(sender, related_id=i) for i, sender in enumerate((self.a, self.b, self.c)))
+        self.assertEqual(counters.get_unread_count(counters.NOTIFICATIONS, self.owner.pk), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(notify.mark_read(self.owner.pk, feed.encode_cursor(second)), 2)
+        self.assertEqual(counters.get_unread_count(counters.NOTIFICATIONS, self.owner.pk), 1)
+        self.assertEqual(notify.mark_read(self.owner.pk, feed.encode_cursor(second)), 0)
+        self.assertFalse(Notification.objects.get(pk=third.pk).is_read)
+
+    def test_mark_read_keeps_a_row_merged_after_the_client_saw_it_unread(self):
+        self.notify(self.a)
+        seen = Notification.objects.get()
+        up_to = feed.encode_cursor(seen)
+        self.notify(self.b)
+        merged = Notification.objects.get()
+        self.assertEqual((merged.pk, merged.actor_count), (seen.pk, 2))
+        self.assertEqual(notify.mark_read(self.owner.pk, up_to), 0)
+        self.assertFalse(Notification.objects.get().is_read)
+        self.assertEqual(notify.mark_read(self.owner.pk, feed.encode_cursor(merged)), 1)
+
+    def test_mark_notifications_read_rejects_a_malformed_watermark(self):
+        self.client.force_login(self.owner)
+        for up_to in ('', '42', 'not-a-cursor'):
+            with self.subTest(up_to=up_to):
+                response = self.client.post(reverse('mark_notifications_read'), {'up_to': up_to})
+                self.assertEqual(response.status_code, 400)
+
+    def test_prune_deletes_old_read_rows_in_batches_and_keeps_unread_ones(self):
+        old = timezone.now() - timedelta(days=notify.RETENTION_DAYS + 1)
+        for i in range(5):
+            self.create(self.a, related_id=i, is_read=True)
+        unread = self.create(self.b, related_id=10)
+        Notification.objects.update(created_at=old)
+        recent = self.create(self.c, related_id=11, is_read=True)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(notify.prune(batch_size=2), 5)
+        deletes = [query for query in queries if query['sql'].startswith('DELETE FROM "vite_notification"')]
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(set(Notification.objects.values_list('pk', flat=True)), {unread.pk, recent.pk})
+
+
+class CachingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author, self.reader = (CustomUser.objects.create_user(name, password='x') for name in ('author', 'reader'))
+        self.post = Post.objects.create(user=self.author, content='post')
+
+    def generation(self):
+        return caching.get_generation(caching.post_fragment(self.post.pk))
+
+    def test_post_fragments_are_retired_by_changes_to_the_post(self):
+        generation = self.generation()
+        Like.objects.create(user=self.reader, post=self.post)
+        Comment.objects.create(user=self.reader, post=self.post, content='hi')
+        self.post.content = 'edited'
+        self.post.save()
+        self.assertEqual(self.generation(), generation + 3)
+
+    def test_invalidating_an_unused_generation_stores_nothing(self):
+        caching.invalidate(caching.post_fragment(self.post.pk))
+        self.assertIsNone(cache.get(caching._generation_key(caching.post_fragment(self.post.pk))))
+
+    def test_home_renders_a_post_card_again_after_a_comment(self):
+        self.author.friends.add(self.reader)
+        self.reader.friends.add(self.author)
+        self.client.force_login(self.reader)
+        self.assertNotContains(self.client.get(reverse('home')), 'fresh comment')
+        Comment.objects.create(user=self.author, post=self.post, content='fresh comment')
+        self.assertContains(self.client.get(reverse('home')), 'fresh comment')
+
+    def test_pages_are_cached_for_anonymous_visitors_only(self):
+        reel = Reel.objects.create(user=self.author, video='sample')
+        url = reverse('reel_detail', args=[reel.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.client.force_login(self.reader)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertTrue(any('"vite_reel"' in query['sql'] for query in queries))
+
+
+class StoriesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('author')
+
+    def test_the_strip_is_not_cached_past_the_first_expiry(self):
+        self.assertEqual(stories.fragment_timeout(), caching.FRAGMENT_TIMEOUT)
+        other = CustomUser.objects.create_user('other')
+        Story.objects.create(user=self.user, image='sample', expires_at=timezone.now() + timedelta(hours=1))
+        Story.objects.create(user=other, image='sample', expires_at=timezone.now() + timedelta(seconds=90))
+        self.assertTrue(85 <= stories.fragment_timeout() <= 90)
+
+
+class GraphTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.a, self.b, self.c = (CustomUser.objects.create_user(name) for name in 'abc')
+
+    def test_sets_are_cached(self):
+        graph.friend_ids(self.a.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(graph.are_friends(self.a.pk, self.b.pk))
+
+    def test_adding_and_removing_drops_the_cached_sets(self):
+        self.assertFalse(graph.are_friends(self.a.pk, self.b.pk))
+        self.a.friends.add(self.b)
+        self.assertTrue(graph.are_friends(self.a.pk, self.b.pk))
+        self.a.friends.remove(self.b)
+        self.assertFalse(graph.are_friends(self.a.pk, self.b.pk))
+
+    def test_both_sides_of_a_block_or_request_are_dropped(self):
+        self.assertEqual(graph.hidden_ids(self.a.pk), set())
+        self.assertFalse(graph.has_received_request(self.b.pk, self.a.pk))
+        # Through the reverse managers: the change is seen from the other user.
+        self.a.blocked_by.add(self.b)
+        self.b.received_friend_requests.add(self.a)
+        self.assertEqual(graph.hidden_ids(self.a.pk), {self.b.pk})
+        self.assertTrue(graph.is_blocked(self.b.pk, self.a.pk))
+        self.assertTrue(graph.has_sent_request(self.a.pk, self.b.pk))
+        self.assertTrue(graph.has_received_request(self.b.pk, self.a.pk))
+
+    def test_clear_drops_the_sets_of_everyone_involved(self):
+        self.a.blocked_users.add(self.b, self.c)
+        self.assertEqual(graph.hidden_ids(self.c.pk), {self.a.pk})
+        self.a.blocked_users.clear()
+        self.assertEqual(graph.blocked_ids(self.a.pk), set())
+        self.assertEqual(graph.hidden_ids(self.b.pk), set())
+        self.assertEqual(graph.hidden_ids(self.c.pk), set())
+
+
+class SuggestionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        names = ('me', 'f1', 'f2', 'x', 'y', 'blocked', 'requested', 'loner')
+        self.users = {name: CustomUser.objects.create_user(name) for name in names}
+        for a, b in (('me', 'f1'), ('me', 'f2'), ('f1', 'x'), ('f2', 'x'), ('f1', 'y'), ('f1', 'blocked'),
+                     ('f2', 'requested')):
+            self.users[a].friends.add(self.users[b])
+            self.users[b].friends.add(self.users[a])
+        self.me = self.users['me']
+        self.users['blocked'].blocked_users.add(self.me)
+        self.me.friend_requests.add(self.users['requested'])
+
+    def suggested(self, user):
+        return [(user.username, user.mutual_count) for user in suggestions.for_user(user)]
+
+    def test_friends_of_friends_ranked_by_mutual_friends(self):
+        suggestions.compute()
+        self.assertEqual(self.suggested(self.me), [('x', 2), ('y', 1)])
+        self.assertEqual(self.suggested(self.users['loner']), [])
+        self.assertEqual(FriendSuggestion.objects.filter(user=self.users['x'], suggested=self.me).get().mutual_count, 2)
+
+    def test_only_the_top_suggestions_of_the_given_users_are_stored(self):
+        self.assertEqual(suggestions.compute(user_ids=[self.me.pk], limit=1), 1)
+        self.assertEqual(
+            list(FriendSuggestion.objects.values_list('user', 'suggested')), [(self.me.pk, self.users['x'].pk)]
+        )
+
+    def test_changes_since_the_last_run_are_dropped_when_served(self):
+        suggestions.compute()
+        self.me.blocked_users.add(self.users['x'])
+        self.me.friends.add(self.users['y'])
+        self.assertEqual(self.suggested(self.me), [])
+
+    def test_stale_rows_are_skipped_without_sending_id_lists(self):
+        for name in ('a', 'b', 'c', 'd'):
+            user = CustomUser.objects.create_user(name)
+            FriendSuggestion.objects.create(user=self.me, suggested=user, mutual_count=1)
+            if name != 'd':
+                self.me.friends.add(user)
+        suggestions.for_user(self.me, limit=1)  # Loads the cached graph sets.
+        with CaptureQueriesContext(connection) as queries:
+            found = suggestions.for_user(self.me, limit=1)
+        self.assertEqual([user.username for user in found], ['d'])
+        # Two rows at a time: a and b are stale, then c is stale and d is kept.
+        reads = [query['sql'] for query in queries if 'vite_friendsuggestion' in query['sql']]
+        self.assertEqual(len(reads), 2)
+        self.assertTrue(all(' IN (' not in sql for sql in reads))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.viewer = CustomUser.objects.create_user('viewer')
+        self.exact, self.prefix, self.word, self.inside = (
+            CustomUser.objects.create_user(name, full_name=full_name)
+            for name, full_name in (('ahmad', ''), ('ahmadx', ''), ('sara', 'Sara Ahmad'), ('mahmadi', ''))
+        )
+
+    def search(self, query):
+        return [user.username for user in search.search_users(self.viewer, query)]
+
+    def test_exact_username_then_friends_then_prefix_matches(self):
+        self.viewer.friends.add(self.word)
+        self.assertEqual(self.search('Ahmad'), ['ahmad', 'sara', 'ahmadx', 'mahmadi'])
+
+    def test_arabic_spelling_variants_match(self):
+        CustomUser.objects.create_user('u1', full_name='أَحْمَد')
+        self.assertEqual(self.search('احمد'), ['u1'])
+
+    def test_short_queries_only_match_prefixes(self):
+        self.assertEqual(self.search('ah'), ['ahmad', 'ahmadx'])
+
+    def test_blocked_users_are_left_out(self):
+        self.viewer.blocked_users.add(self.prefix)
+        self.inside.blocked_users.add(self.viewer)
+        self.assertEqual(self.search('ahmad'), ['ahmad', 'sara'])
+
+    def test_rebuild_index_picks_up_rows_written_without_signals(self):
+        CustomUser.objects.bulk_create([CustomUser(username='ghost')])
+        CustomUser.objects.filter(pk=self.inside.pk).update(username='renamed')
+        self.assertEqual(self.search('ghost'), [])
+        self.assertEqual(search.rebuild_index(), 2)
+        self.assertEqual(self.search('ghost'), ['ghost'])
+        self.assertEqual(self.search('renamed'), ['renamed'])
+        self.assertEqual(self.search('mahmadi'), [])
+
+
+def _png(width=80, height=40):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+
+class LocalMediaMixin:
+    """
+    Runs the class against ``media.LocalBackend`` in a temporary directory.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = cls.enterClassContext(tempfile.TemporaryDirectory())
+        cls.enterClassContext(override_settings(MEDIA_BACKEND='vite.media.LocalBackend', MEDIA_LOCAL_ROOT=cls.media_root))
+        cls.enterClassContext(mock.patch.object(uploads, 'SPOOL_ROOT', os.path.join(cls.media_root, 'spool')))
+        super().setUpClass()
+
+
+class LocalMediaTests(LocalMediaMixin, TestCase):
+    def test_upload_serve_and_destroy(self):
+        resource = media.upload(_png(), folder='posts')
+        self.assertTrue(resource.public_id.startswith('posts/'))
+        self.assertEqual((resource.format, resource.metadata['width']), ('png', 80))
+
+        response = self.client.get(urlsplit(resource.build_url(**media.POSTER, format='jpg')).path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content)[:3], b'\xff\xd8\xff')
+
+        self.assertEqual(media.destroy(resource.public_id), {'result': 'ok'})
+        self.assertEqual(self.client.get(urlsplit(resource.url).path).status_code, 404)
+
+    def test_only_listed_renditions_are_rendered_once(self):
+        resource = media.upload(_png(), folder='posts')
+        derived = os.path.join(self.media_root, 'derived')
+        before = set(os.listdir(derived)) if os.path.isdir(derived) else set()
+        for options in ({'width': 100000, 'height': 100000, 'crop': 'fill'}, {'width': 640}):
+            response = self.client.get(urlsplit(resource.build_url(**options)).path)
+            self.assertEqual(response.status_code, 404)
+        # Equivalent spellings of the poster share one file.
+        for crop in ('fill', 'thumb'):
+            response = self.client.get(urlsplit(resource.build_url(**{**media.POSTER, 'crop': crop})).path)
+            with Image.open(BytesIO(b''.join(response.streaming_content))) as rendered:
+                self.assertEqual(rendered.size, media.POSTER_SIZE)
+        self.assertEqual(len(set(os.listdir(derived)) - before), 1)
+
+    def test_posters_are_built_through_the_backend(self):
+        user = CustomUser.objects.create_user('poster')
+        video = media.upload(BytesIO(b'not really a video'), folder='reels', resource_type='video')
+        reel = Reel.objects.create(user=user, video=video)
+        story = Story.objects.create(user=user, video=video, expires_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(reel.thumbnail_url, story.preview_url)
+        response = self.client.get(urlsplit(reel.thumbnail_url).path)
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as rendered:
+            self.assertEqual((rendered.format, rendered.size), ('JPEG', media.POSTER_SIZE))
+
+    @override_settings(MEDIA_UPLOADS_INLINE=True)
+    def test_uploaded_image_is_stripped_and_gets_variants(self):
+        user = CustomUser.objects.create_user('poster', password='x')
+        post = Post.objects.create(user=user, content='photo')
+        exif = Image.Exif()
+        exif[0x010F] = 'camera'
+        buffer = BytesIO()
+        Image.new('RGB', (3000, 1500), 'red').save(buffer, format='JPEG', exif=exif)
+        with self.captureOnCommitCallbacks(execute=True):
+            uploads.enqueue(user, post, {'image': SimpleUploadedFile('photo.jpg', buffer.getvalue())})
+
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants['image']['widths'], list(images.WIDTHS))
+        with Image.open(media.get_backend()._find('image', 'upload', post.image.public_id)) as stored:
+            self.assertEqual(stored.size, (images.MAX_WIDTH, images.MAX_WIDTH // 2))
+            self.assertEqual(dict(stored.getexif()), {})
+        self.assertIn(' 320w, ', images.srcset(post, 'image'))
+        self.assertIn('_w160_webp', images.url(post, 'image', 100))
+        response = self.client.get(urlsplit(images.url(post, 'image', 100)).path)
+        self.assertEqual(response.status_code, 200)
+
+
+    @override_settings(MEDIA_UPLOADS_INLINE=False)
+    def test_a_failed_upload_is_retried_with_backoff(self):
+        user = CustomUser.objects.create_user('poster')
+        post = Post.objects.create(user=user, content='photo')
+        upload, = uploads.enqueue(user, post, {'image': SimpleUploadedFile('photo.png', _png().getvalue())})
+        failing = mock.patch.object(media, 'upload', side_effect=OSError('unreachable'))
+        with failing, mock.patch.object(uploads.threading, 'Timer') as timer, self.assertLogs('vite.uploads', 'WARNING'):
+            for _ in range(uploads.MAX_ATTEMPTS):
+                uploads.process(upload.pk)
+        backoff = uploads.RETRY_BACKOFF
+        self.assertEqual(timer.call_args_list, [
+            mock.call(backoff, uploads.submit, args=(upload.pk,)),
+            mock.call(backoff * 2, uploads.submit, args=(upload.pk,)),
+        ])
+        upload.refresh_from_db()
+        self.assertEqual((upload.status, upload.attempts), (MediaUpload.FAILED, uploads.MAX_ATTEMPTS))
+        self.assertFalse(os.path.exists(upload.spool_path))
+
+    def test_a_new_user_shows_the_default_picture_while_theirs_uploads(self):
+        response = self.client.post(reverse('register'), {
+            'username': 'newcomer', 'full_name': 'New Comer', 'email': 'new@example.com',
+            'password1': 'Str0ng-pass-123', 'password2': 'Str0ng-pass-123',
+            'profile_picture': SimpleUploadedFile('me.png', _png().getvalue()),
+        })
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        user = CustomUser.objects.get(username='newcomer')
+        upload = MediaUpload.objects.get(owner=user)
+        self.addCleanup(os.remove, upload.spool_path)
+        self.assertEqual((upload.field_name, upload.status), ('profile_picture', MediaUpload.PENDING))
+        self.assertEqual(user.profile_picture.public_id, 'profile_pics/default_profile')
+
+
+class QRCodeTests(LocalMediaMixin, TestCase):
+    def setUp(self):
+        self.qr_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(QR_CACHE_ROOT=self.qr_root))
+        qrcodes.get_png.cache_clear()
+        self.addCleanup(qrcodes.get_png.cache_clear)
+        self.user = CustomUser.objects.create_user('viewer')
+        self.client.force_login(self.user)
+
+    def test_a_code_is_rendered_on_first_view_then_served_from_memory_and_disk(self):
+        self.assertEqual((os.listdir(self.qr_root), self.user.qr_code), ([], None))
+        url = reverse('qr_code_image', args=[self.user.username])
+        with mock.patch.object(qrcodes, 'render_png', wraps=qrcodes.render_png) as render:
+            first = self.client.get(url).content
+            self.assertEqual(self.client.get(url).content, first)
+            self.assertEqual(qrcodes.get_png.cache_info().hits, 1)
+            qrcodes.get_png.cache_clear()
+            self.assertEqual(self.client.get(url).content, first)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first[:8], b'\x89PNG\r\n\x1a\n')
+        self.assertEqual(os.listdir(self.qr_root), ['viewer.png'])
+
+    def test_backfill_renders_missing_codes_and_uploads_them_on_request(self):
+        CustomUser.objects.create_user('other@example.com')
+        out = StringIO()
+        call_command('backfill_qr_codes', workers=1, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'rendered=2')
+        self.assertEqual(sorted(os.listdir(self.qr_root)), ['other@example.com.png', 'viewer.png'])
+
+        call_command('backfill_qr_codes', '--upload', workers=1, upload_threads=1, stdout=out)
+        self.assertIn('uploaded=2', out.getvalue())
+        user = CustomUser.objects.get(pk=self.user.pk)
+        self.assertIn(f'/qr_codes/user_{user.pk}_qr', user.qr_code.url)
+        with open(os.path.join(self.qr_root, 'viewer.png'), 'rb') as f:
+            self.assertEqual(b''.join(self.client.get(urlsplit(user.qr_code.url).path).streaming_content), f.read())
+
+        out = StringIO()
+        call_command('backfill_qr_codes', workers=1, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'لا يوجد مستخدمون بحاجة إلى كود QR.')
+
+
+class ExpiryTests(LocalMediaMixin, TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('author')
+        self.liker = CustomUser.objects.create_user('liker')
+
+    def story(self, expires_in):
+        resource = media.upload(_png(), folder='stories')
+        with Image.open(_png()) as image:
+            entry = images.upload_variants(image, resource)
+        return Story.objects.create(
+            user=self.user, image=resource, image_variants={'image': entry}, expires_at=timezone.now() + expires_in
+        )
+
+    def stored(self, public_id):
+        return media.get_backend()._find('image', 'upload', public_id) is not None
+
+    def test_sweep_deletes_expired_stories_and_queues_their_media(self):
+        expired, also_expired = self.story(timedelta(hours=-1)), self.story(timedelta(seconds=-1))
+        live = self.story(timedelta(hours=1))
+        StoryLike.objects.create(user=self.liker, story=expired)
+        variants = images.deletions(expired.image_variants['image'])
+
+        self.assertEqual(expiry.sweep(batch_size=1), (2, 2 * (1 + len(variants))))
+        self.assertEqual(list(Story.objects.all()), [live])
+        self.assertFalse(StoryLike.objects.exists())
+        queued = set(MediaDeletion.objects.values_list('public_id', flat=True))
+        self.assertIn(expired.image.public_id, queued)
+        self.assertLessEqual({deletion.public_id for deletion in variants}, queued)
+
+        self.assertEqual(expiry.purge_media(), (len(queued), 0))
+        self.assertFalse(MediaDeletion.objects.exists())
+        self.assertFalse(self.stored(expired.image.public_id))
+        self.assertFalse(any(self.stored(deletion.public_id) for deletion in variants))
+        self.assertTrue(self.stored(live.image.public_id))
+
+    def test_failed_deletions_are_retried_then_given_up(self):
+        MediaDeletion.objects.create(public_id='stories/gone')
+        with mock.patch.object(media, 'delete_many', side_effect=RuntimeError('unreachable')):
+            for _ in range(1, expiry.MAX_ATTEMPTS):
+                self.assertEqual(expiry.purge_media(), (0, 0))
+            self.assertEqual(expiry.purge_media(), (0, 1))
+        deletion = MediaDeletion.objects.get()
+        self.assertEqual(
+            (deletion.status, deletion.attempts, deletion.error),
+            (MediaDeletion.FAILED, expiry.MAX_ATTEMPTS, 'unreachable'),
+        )
+        # Failed rows are left for an operator, not retried forever.
+        self.assertEqual(expiry.purge_media(), (0, 0))
+
+
+# Queries per request with a cold cache. Every route in vite/urls.py must be
+# listed here or in UNBUDGETED_ROUTES; the same numbers hold for every SCALE.
+QUERY_BUDGETS = {
+    'home': 12,
+    'feed_page': 6,
+    'register': 0,
+    'login': 0,
+    'create_post': 2,
+    'create_post:post': 6,
+    'edit_post': 4,
+    'delete_post': 13,
+    'like_post': 9,
+    'add_comment': 5,
+    'profile': 11,
+    'edit_profile': 2,
+    'edit_profile:post': 8,
+    'friends': 12,
+    'friend_suggestions': 8,
+    'send_friend_request': 6,
+    'accept_friend_request': 9,
+    'reject_friend_request': 5,
+    'search_users': 7,
+    'search_typeahead': 7,
+    'block_user': 9,
+    'unblock_user': 4,
+    'logout_view': 4,
+    'delete_message': 8,
+    'screenshot_notification': 4,
+    'chat': 7,
+    'delete_comment': 7,
+    'send_message': 6,
+    'get_messages': 9,
+    'chat_list': 3,
+    'qr_code_view': 3,
+    'qr_code_image': 3,
+    'notifications': 5,
+    'reels_feed': 6,
+    'reels_page': 6,
+    'upload_reel': 2,
+    'upload_reel:post': 5,
+    'media_upload_status': 3,
+    'like_reel': 9,
+    'add_reel_comment': 6,
+    'delete_reel': 10,
+    'reel_detail': 9,
+    'record_reel_view': 3,
+    'unread_notifications_count': 3,
+    'unread_messages_count': 3,
+    'metrics': 2,
+    'notifications_page': 3,
+    'mark_notifications_read': 4,
+    'update_user_activity': 2,
+    'upload_story': 2,
+    'upload_story:post': 5,
+    'view_stories': 6,
+    'like_story': 9,
+    'delete_story': 6,
+    'local_media': 0,
+}
+# Routes that call external services (Gemini).
+UNBUDGETED_ROUTES = {'ask_gemini'}
+METRICS_TOKEN = 'budget-token'
+
+
+class QueryBudgetMixin(LocalMediaMixin):
+    """
+    Requests every route against ``seeding.seed(SCALE)`` with an empty cache
+    and checks its query count against ``QUERY_BUDGETS``. Subclasses differ
+    only in ``SCALE``, so a count that grows with the data fails one of them.
+    """
+    SCALE = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        users = seeding.seed(cls.SCALE)
+        for name, user in users.items():
+            setattr(cls, name, user)
+        cls.post = Post.objects.create(user=cls.viewer, content='own post')
+        cls.friend_post = Post.objects.filter(user=cls.friend).first()
+        cls.comment = Comment.objects.create(user=cls.viewer, post=cls.friend_post, content='own comment')
+        cls.reel = Reel.objects.create(user=cls.viewer, video='sample')
+        # Deleting the own post and reel must not cost a query per like or comment
+        # (twenty of each, under the 100 rows Django deletes per statement).
+        fans = list(CustomUser.objects.exclude(pk=cls.viewer.pk)[:20])
+        Like.objects.bulk_create(Like(user=fan, post=cls.post) for fan in fans)
+        Comment.objects.bulk_create(Comment(user=fan, post=cls.post, content='nice') for fan in fans)
+        ReelLike.objects.bulk_create(ReelLike(user=fan, reel=cls.reel) for fan in fans)
+        ReelComment.objects.bulk_create(ReelComment(user=fan, reel=cls.reel, content='nice') for fan in fans)
+        cls.friend_reel = Reel.objects.filter(user=cls.friend).first()
+        cls.story = Story.objects.create(user=cls.viewer, image='sample')
+        cls.friend_story = Story.objects.filter(user=cls.friend).first()
+        cls.message = Message.objects.create(sender=cls.viewer, receiver=cls.friend, content='own message')
+        cls.image = media.upload(_png(), folder='posts')
+        cls.upload = MediaUpload.objects.create(
+            owner=cls.viewer, target_type=ContentType.objects.get_for_model(Reel), target_id=cls.reel.pk,
+            field_name='video', spool_path='upload.mp4',
+        )
+
+    def setUp(self):
+        cache.clear()
+        # Keep the buffered writers from flushing in the middle of a measured request.
+        presence._last_flush = reelviews._last_flush = time.monotonic()
+        # The home strip of reels starts at a random id; start at the first so it always takes both queries.
+        patcher = mock.patch('vite.reels.random.randint', side_effect=lambda lo, hi: lo)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Nothing measured here may still be buffered when the test database goes away.
+        self.addCleanup(presence._pending.clear)
+        self.addCleanup(reelviews._pending.clear)
+        self.client.force_login(self.viewer)
+
+    def route(self, name):
+        """
+        ``(method, url, data, content_type)`` for a successful request to ``name``;
+        ``<route>:post`` is the form submission of a route that also renders the form.
+        """
+        friend, viewer = self.friend.username, self.viewer.username
+        image = SimpleUploadedFile('photo.png', _png().getvalue(), content_type='image/png')
+        video = SimpleUploadedFile('clip.mp4', b'\x00' * 64, content_type='video/mp4')
+        routes = {
+            'home': ('get', reverse('home'), None),
+            'feed_page': ('get', reverse('feed_page'), None),
+            'register': ('get', reverse('register'), None),
+            'login': ('get', reverse('login'), None),
+            'create_post': ('get', reverse('create_post'), None),
+            'create_post:post': ('post', reverse('create_post'), {'content': 'new post', 'image': image}),
+            'edit_post': ('get', reverse('edit_post', args=[self.post.pk]), None),
+            'delete_post': ('post', reverse('delete_post', args=[self.post.pk]), {}),
+            'like_post': ('post', reverse('like_post', args=[self.friend_post.pk]), {}),
+            'add_comment': ('post', reverse('add_comment', args=[self.friend_post.pk]), {'content': 'hi'}),
+            'profile': ('get', reverse('profile', args=[friend]), None),
+            'edit_profile': ('get', reverse('edit_profile', args=[viewer]), None),
+            'edit_profile:post': ('post', reverse('edit_profile', args=[viewer]), {
+                'username': viewer, 'full_name': 'Viewer', 'email': 'viewer@example.com', 'bio': 'hi',
+                'profile_picture': image,
+            }),
+            'friends': ('get', reverse('friends'), None),
+            'friend_suggestions': ('get', reverse('friend_suggestions'), None),
+            'send_friend_request': ('get', reverse('send_friend_request', args=[self.stranger.username]), None),
+            'accept_friend_request': ('get', reverse('accept_friend_request', args=[self.requester.username]), None),
+            'reject_friend_request': ('get', reverse('reject_friend_request', args=[self.requester2.username]), None),
+            'search_users': ('get', reverse('search_users') + '?q=user', None),
+            'search_typeahead': ('get', reverse('search_typeahead') + '?q=user', None),
+            'block_user': ('get', reverse('block_user', args=[self.stranger.username]), None),
+            'unblock_user': ('get', reverse('unblock_user', args=[self.blocked.username]), None),
+            'logout_view': ('post', reverse('logout_view'), {}),
+            'delete_message': ('post', reverse('delete_message', args=[self.message.pk]), {}),
+            'chat': ('get', reverse('chat', args=[friend]), None),
+            'delete_comment': ('post', reverse('delete_comment', args=[self.comment.pk]), {}),
+            'send_message': ('post', reverse('send_message'), {'receiver': friend, 'content': 'hi'}),
+            'get_messages': ('get', reverse('get_messages', args=[friend]), None),
+            'chat_list': ('get', reverse('chat_list', args=[viewer]), None),
+            'qr_code_view': ('get', reverse('qr_code_view', args=[viewer]), None),
+            'qr_code_image': ('get', reverse('qr_code_image', args=[viewer]), None),
+            'notifications': ('get', reverse('notifications'), None),
+            'reels_feed': ('get', reverse('reels_feed'), None),
+            'reels_page': ('get', reverse('reels_page'), None),
+            'upload_reel': ('get', reverse('upload_reel'), None),
+            'upload_reel:post': ('post', reverse('upload_reel'), {'video': video, 'caption': 'new reel'}),
+            'media_upload_status': ('get', reverse('media_upload_status', args=[self.upload.pk]), None),
+            'like_reel': ('post', reverse('like_reel', args=[self.friend_reel.pk]), {}),
+            'add_reel_comment': ('post', reverse('add_reel_comment', args=[self.friend_reel.pk]), {'content': 'hi'}),
+            'delete_reel': ('post', reverse('delete_reel', args=[self.reel.pk]), {}),
+            'reel_detail': ('get', reverse('reel_detail', args=[self.friend_reel.pk]), None),
+            'record_reel_view': ('post', reverse('record_reel_view', args=[self.friend_reel.pk]), {}),
+            'unread_notifications_count': ('get', reverse('unread_notifications_count'), None),
+            'unread_messages_count': ('get', reverse('unread_messages_count'), None),
+            'metrics': ('get', reverse('metrics'), None),
+            'notifications_page': ('get', reverse('notifications_page'), None),
+            'mark_notifications_read': ('post', reverse('mark_notifications_read'), {
+                'up_to': feed.encode_cursor(Notification(pk=10 ** 9, created_at=timezone.now())),
+            }),
+            'update_user_activity': ('post', reverse('update_user_activity'), {}),
+            'screenshot_notification': ('post', reverse('screenshot_notification'), {'receiver': friend}),
+            'upload_story': ('get', reverse('upload_story'), None),
+            'upload_story:post': ('post', reverse('upload_story'), {'image': image}),
+            'view_stories': ('get', reverse('view_stories', args=[friend]), None),
+            'like_story': ('post', reverse('like_story', args=[self.friend_story.pk]), {}),
+            'delete_story': ('post', reverse('delete_story', args=[self.story.pk]), {}),
+            'local_media': ('get', urlsplit(self.image.build_url(**media.POSTER)).path, None),
+        }
+        method, url, data = routes[name]
+        content_type = 'application/json' if name == 'screenshot_notification' else None
+        return method, url, data, content_type
+
+    def request(self, name):
+        method, url, data, content_type = self.route(name)
+        if name == 'metrics':
+            return self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {METRICS_TOKEN}')
+        if method == 'get':
+            return self.client.get(url)
+        if content_type:
+            return self.client.post(url, json.dumps(data), content_type=content_type)
+        return self.client.post(url, data)
+
+    def test_every_route_is_budgeted(self):
+        names = {pattern.name for pattern in get_resolver('vite.urls').url_patterns if getattr(pattern, 'name', None)}
+        self.assertEqual(names - set(QUERY_BUDGETS) - UNBUDGETED_ROUTES, set())
+        self.assertEqual({name.partition(':')[0] for name in QUERY_BUDGETS} - names, set())
+
+    def test_query_budgets(self):
+        for name, budget in QUERY_BUDGETS.items():
+            with self.subTest(route=name):
+                # logout_view ends the session; every route starts signed in and with a cold cache.
+                self.client.force_login(self.viewer)
+                cache.clear()
+                ContentType.objects.clear_cache()
+                # Each route sees the same data, whatever the ones before it changed.
+                with transaction.atomic():
+                    with self.assertNumQueries(budget):
+                        response = self.request(name)
+                    self.assertLess(response.status_code, 400)
+                    if name.endswith(':post'):
+                        # A form with errors renders with 200; a submission that went through redirects.
+                        self.assertEqual(response.status_code, 302)
+                    transaction.set_rollback(True)
+
+
+@override_settings(METRICS_TOKEN=METRICS_TOKEN)
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    SCALE = 1
+
+
+@override_settings(METRICS_TOKEN=METRICS_TOKEN)
+class QueryBudgetAtScaleTests(QueryBudgetMixin, TestCase):
+    SCALE = 100
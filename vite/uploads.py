@@ -0,0 +1,223 @@
+# uploads.py
+"""
+Background media uploads.
+
+Views ``detach`` the uploaded files from a bound instance before saving it,
+so its ``CloudinaryField`` does not upload inside the request, then
+``enqueue`` them once the instance exists. Each file is spooled to
+``MEDIA_SPOOL_ROOT`` and recorded as a pending ``MediaUpload``. After the
+transaction commits a worker thread uploads it through the media backend
+(``media.py``) with the field's own Cloudinary options, saves the result on
+the instance and pushes the outcome to the owner's sockets; clients without
+a socket poll ``uploads/<id>/status/``. Images are stripped of metadata and
+get resized WebP/AVIF variants on the way (``images.py``).
+
+A failed attempt is resubmitted after ``MEDIA_UPLOAD_RETRY_BACKOFF`` seconds,
+doubling per attempt, up to ``MAX_ATTEMPTS``. Uploads left behind by a
+restart are retried by ``manage.py process_media_uploads``. With
+``MEDIA_UPLOADS_INLINE = True`` the jobs run synchronously right after commit
+instead of on the thread pool, and failed attempts wait for that command.
+"""
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import images, media
+from .messaging import send_conversation_event, serialize_message
+from .models import MediaUpload, Message
+from .realtime import push_to_user
+
+logger = logging.getLogger(__name__)
+
+SPOOL_ROOT = getattr(settings, 'MEDIA_SPOOL_ROOT', os.path.join(settings.BASE_DIR, 'media_spool'))
+WORKERS = getattr(settings, 'MEDIA_UPLOAD_WORKERS', 2)
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = getattr(settings, 'MEDIA_UPLOAD_RETRY_BACKOFF', 5)
+# Voice notes are stored as Cloudinary videos but have nothing to show.
+AUDIO_FIELDS = {'voice_note'}
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='media-upload')
+    return _executor
+
+
+def detach(instance, files, field_names, previous=None):
+    """
+    Takes the uploaded files for ``field_names`` off ``instance`` so saving it
+    does not upload them. Each field goes back to ``previous[name]`` (its value
+    before the form was bound) or to the field's default, e.g. the default
+    profile picture while a new user's own one uploads. Returns ``{field: file}``.
+    """
+    previous = previous or {}
+    pending = {}
+    for name in field_names:
+        uploaded = files.get(name)
+        if not uploaded:
+            continue
+        pending[name] = uploaded
+        placeholder = previous[name] if name in previous else instance._meta.get_field(name).get_default()
+        setattr(instance, name, placeholder)
+    return pending
+
+
+def _spool(uploaded):
+    os.makedirs(SPOOL_ROOT, exist_ok=True)
+    extension = os.path.splitext(uploaded.name or '')[1].lower()
+    path = os.path.join(SPOOL_ROOT, f"{uuid.uuid4().hex}{extension}")
+    with open(path, 'wb') as out:
+        for chunk in uploaded.chunks():
+            out.write(chunk)
+    return path
+
+
+def enqueue(owner, instance, files):
+    """
+    Spools ``files`` (as returned by ``detach``) for the saved ``instance`` and
+    schedules them for when the current transaction commits. Returns the
+    pending ``MediaUpload`` rows.
+    """
+    target_type = ContentType.objects.get_for_model(instance)
+    uploads = []
+    for name, uploaded in files.items():
+        upload = MediaUpload.objects.create(
+            owner=owner,
+            target_type=target_type,
+            target_id=instance.pk,
+            field_name=name,
+            spool_path=_spool(uploaded),
+            original_name=(uploaded.name or '')[:255],
+        )
+        transaction.on_commit(lambda upload_id=upload.pk: submit(upload_id))
+        uploads.append(upload)
+    return uploads
+
+
+def submit(upload_id):
+    if getattr(settings, 'MEDIA_UPLOADS_INLINE', False):
+        process(upload_id)
+    else:
+        _get_executor().submit(_run_in_thread, upload_id)
+
+
+def _retry_later(upload):
+    if getattr(settings, 'MEDIA_UPLOADS_INLINE', False):
+        return
+    timer = threading.Timer(RETRY_BACKOFF * 2 ** (upload.attempts - 1), submit, args=(upload.pk,))
+    timer.daemon = True
+    timer.start()
+
+
+def _run_in_thread(upload_id):
+    close_old_connections()
+    try:
+        process(upload_id)
+    except Exception:
+        logger.exception("Media upload %s crashed", upload_id)
+    finally:
+        close_old_connections()
+
+
+def process(upload_id):
+    """
+    Uploads one spooled file. Returns the upload, or ``None`` if another
+    worker already claimed it.
+    """
+    claimed = MediaUpload.objects.filter(pk=upload_id, status=MediaUpload.PENDING).update(
+        status=MediaUpload.PROCESSING, attempts=F('attempts') + 1, updated_at=timezone.now()
+    )
+    if not claimed:
+        return None
+
+    upload = MediaUpload.objects.select_related('owner', 'target_type').get(pk=upload_id)
+    target = upload.target
+    if target is None:
+        return _finish(upload, MediaUpload.FAILED, error='target deleted')
+
+    field = target._meta.get_field(upload.field_name)
+    options = {"type": field.type, "resource_type": field.resource_type}
+    options.update({key: val(target) if callable(val) else val for key, val in field.options.items()})
+    has_poster = field.resource_type == 'video' and upload.field_name not in AUDIO_FIELDS
+    if has_poster:
+        # Let Cloudinary render the poster now rather than on its first view.
+        options.update(eager=[{**media.POSTER, 'format': 'jpg'}], eager_async=True)
+    prepared = None
+    if upload.field_name in images.FIELDS and hasattr(target, 'image_variants'):
+        prepared = images.prepare(upload.spool_path)
+
+    try:
+        resource = media.upload(upload.spool_path, **options)
+    except Exception as e:
+        logger.warning("Media upload %s failed (attempt %s): %s", upload.pk, upload.attempts, e)
+        if upload.attempts < MAX_ATTEMPTS:
+            upload.status = MediaUpload.PENDING
+            upload.error = str(e)
+            upload.save(update_fields=['status', 'error', 'updated_at'])
+            _retry_later(upload)
+            return upload
+        return _finish(upload, MediaUpload.FAILED, error=str(e))
+
+    if prepared is not None:
+        images.save_variants(target, upload.field_name, resource, prepared)
+    else:
+        setattr(target, upload.field_name, resource)
+        target.save(update_fields=[upload.field_name])
+
+    upload.url = resource.url
+    if has_poster:
+        upload.thumbnail_url = media.poster_url(resource.public_id)
+    return _finish(upload, MediaUpload.DONE, target=target)
+
+
+def _finish(upload, status, error='', target=None):
+    upload.status = status
+    upload.error = error
+    upload.save(update_fields=['status', 'error', 'url', 'thumbnail_url', 'updated_at'])
+    try:
+        os.remove(upload.spool_path)
+    except FileNotFoundError:
+        pass
+
+    push_to_user(upload.owner_id, {"type": "media", **serialize_upload(upload)})
+    if isinstance(target, Message):
+        send_conversation_event(target.sender_id, target.receiver_id, {
+            "type": "updated",
+            "message": serialize_message(target),
+        })
+    return upload
+
+
+def requeue_stale(older_than):
+    """
+    Puts uploads whose worker died mid-upload back in the queue.
+    """
+    return MediaUpload.objects.filter(
+        status=MediaUpload.PROCESSING, updated_at__lt=timezone.now() - older_than
+    ).update(status=MediaUpload.PENDING)
+
+
+def pending_uploads():
+    return MediaUpload.objects.filter(status=MediaUpload.PENDING).order_by('created_at')
+
+
+def serialize_upload(upload):
+    return {
+        "id": upload.id,
+        "status": upload.status,
+        "field": upload.field_name,
+        "url": upload.url or None,
+        "thumbnail_url": upload.thumbnail_url or None,
+        "error": upload.error or None,
+    }
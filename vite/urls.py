@@ -8,6 +8,7 @@ from .views import logout_view
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('feed/', views.feed_page, name='feed_page'),
     path('register/', views.register, name='register'),
     path('accounts/login/', auth_views.LoginView.as_view(template_name='social/login.html'), name='login'),
     path('post/create/', views.create_post, name='create_post'),
@@ -18,25 +19,32 @@ urlpatterns = [
     path('profile/<str:username>/', views.profile, name='profile'),
     path('profile/<str:username>/edit/', views.edit_profile, name='edit_profile'),
     path('friends/', views.friends, name='friends'),
+    path('friends/suggestions/', views.friend_suggestions, name='friend_suggestions'),
     path('friend_request/<str:username>/', views.send_friend_request, name='send_friend_request'),
     path('accept_request/<str:username>/', views.accept_friend_request, name='accept_friend_request'),
     path('reject_request/<str:username>/', views.reject_friend_request, name='reject_friend_request'),
     path('search/', views.search_users, name='search_users'),
+    path('search/typeahead/', views.search_typeahead, name='search_typeahead'),
     path('block_user/<str:username>/', views.block_user, name='block_user'),
     path('unblock_user/<str:username>/', views.unblock_user, name='unblock_user'),
     path('logout/', logout_view, name='logout_view'),
     path('message/<int:message_id>/delete/', views.delete_message, name='delete_message'),
 
+    # قبل chat/<username>/ وإلا يعامل "screenshot-notification" كاسم مستخدم
+    path("chat/screenshot-notification/", views.screenshot_notification, name="screenshot_notification"),
     path("chat/<str:username>/", views.chat_view, name="chat"),
     path('comment/<int:comment_id>/delete/', views.delete_comment, name='delete_comment'),
     path("send-message/", views.send_message, name="send_message"),
     path("chat/<str:username>/get-messages/", views.get_messages, name="get_messages"),
     path('chat/list/<str:username>/', views.chat_list, name='chat_list'),
     path('profile/<str:username>/qr/', views.qr_code_view, name='qr_code_view'),
+    path('profile/<str:username>/qr.png', views.qr_code_image, name='qr_code_image'),
     path('notifications/', views.notifications, name='notifications'),
     
     path('reels/', views.reels_feed, name='reels_feed'),
+    path('reels/page/', views.reels_page, name='reels_page'),
     path('reels/upload/', views.upload_reel, name='upload_reel'),
+    path('uploads/<int:upload_id>/status/', views.media_upload_status, name='media_upload_status'),
     path('reels/<int:reel_id>/like/', views.like_reel, name='like_reel'),
     path('reels/<int:reel_id>/comment/', views.add_reel_comment, name='add_reel_comment'),
     path('reels/<int:reel_id>/delete/', views.delete_reel, name='delete_reel'),
@@ -46,10 +54,11 @@ urlpatterns = [
 
     path('notifications/unread_count/', views.get_unread_notifications_count, name='unread_notifications_count'),
     path('messages/unread_count/', views.get_unread_messages_count, name='unread_messages_count'),
-    path('notifications/mark_as_read/<int:notification_id>/', views.mark_notification_as_read, name='mark_notification_as_read'),
+    path('metrics/', views.prometheus_metrics, name='metrics'),
+    path('media/cloudinary/<path:path>', views.local_media, name='local_media'),
+    path('notifications/page/', views.notifications_page, name='notifications_page'),
+    path('notifications/mark_read/', views.mark_notifications_read, name='mark_notifications_read'),
     path('activity/update/', views.update_user_activity, name='update_user_activity'),
-    
-    path("chat/screenshot-notification/", views.screenshot_notification, name="screenshot_notification"),
 
     # URLs for Stories
     path('story/upload/', views.upload_story, name='upload_story'),
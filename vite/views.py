@@ -4,9 +4,11 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login as auth_login
 from .forms import CustomUserCreationForm, PostForm, FriendRequestForm, ProfileEditForm, PostEditForm, ReelForm
-from .models import Post, Like, Comment, SavedPost, CustomUser, Notification, Message, Reel, ReelLike, ReelComment, Story, StoryLike
-from django.http import JsonResponse, Http404, HttpResponseForbidden
-import cloudinary.uploader
+from .models import Post, Like, Comment, SavedPost, CustomUser, Message, Reel, ReelLike, ReelComment, Story, StoryLike, MediaUpload
+from django.http import FileResponse, HttpResponse, JsonResponse, Http404, HttpResponseForbidden, HttpResponseNotModified
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.template.loader import render_to_string
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 from django.contrib.auth.forms import AuthenticationForm
@@ -14,15 +16,19 @@ from django.views.decorators.http import require_POST
 from django.db import models as django_models
 import json
 from django.utils import timezone
-import pytz
+from django.utils.dateparse import parse_datetime
 from django.utils.html import strip_tags, escape
+from django.utils.crypto import constant_time_compare
 from django.contrib.auth import get_user_model
 from datetime import timedelta
 from django.db.models import F, Exists, OuterRef
 import google.generativeai as genai
 from django import forms
-import random
-from django.views.decorators.cache import cache_page
+from functools import partial
+from django.utils.functional import SimpleLazyObject
+from . import caching, counters, feed, graph, media, metrics, notify, presence, qrcodes, reels, reelviews, search, stories, suggestions, uploads
+from . import messaging
+from .messaging import broadcast_new_message, mark_conversation_seen, serialize_message
 
 
 User = get_user_model()
@@ -44,75 +50,47 @@ class StoryForm(forms.ModelForm):
             raise forms.ValidationError("لا يمكن رفع صورة وفيديو في نفس القصة. يرجى اختيار واحد فقط.")
         return cleaned_data
 
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
 @login_required
 def home(request):
-    blocked_users = request.user.blocked_users.all()
-    posts = Post.objects.exclude(user__in=blocked_users).order_by('-created_at')
-    for post in posts:
-        post.is_liked = post.likes.filter(user=request.user).exists()
-        post.is_saved = SavedPost.objects.filter(user=request.user, post=post).exists()
-    
-    home_reels = Reel.objects.select_related('user').order_by('?')[:10]
+    posts, next_cursor = feed.get_feed_page(request.user)
 
-    # --- Start of Stories Logic ---
-    twenty_four_hours_ago = timezone.now() - timedelta(hours=24)
-    
-    story_user_ids = Story.objects.filter(
-        created_at__gte=twenty_four_hours_ago
-    ).exclude(
-        user__in=blocked_users
-    ).values_list('user_id', flat=True).distinct()
+    # Both are only evaluated if their cached fragment is missing
+    home_reels = SimpleLazyObject(partial(reels.sample_reels, 10))
+    stories_data = partial(stories.tray_for, request.user)
 
-    all_story_users = list(CustomUser.objects.filter(id__in=story_user_ids))
-    
-    current_user_with_story = None
-    for i, user in enumerate(all_story_users):
-        if user.id == request.user.id:
-            current_user_with_story = all_story_users.pop(i)
-            break
-            
-    random.shuffle(all_story_users)
-    
-    sorted_story_users = []
-    if current_user_with_story:
-        sorted_story_users.append(current_user_with_story)
-    sorted_story_users.extend(all_story_users)
+    unread_counts = counters.get_unread_counts(request.user.id)
 
-    users_with_previews = []
-    for user in sorted_story_users:
-        try:
-            latest_story = Story.objects.filter(
-                user=user, created_at__gte=twenty_four_hours_ago
-            ).latest('created_at')
-            users_with_previews.append({
-                'user': user,
-                'preview_story': latest_story
-            })
-        except Story.DoesNotExist:
-            continue
-    # --- End of Stories Logic ---
-
-    unread_messages_count = Message.objects.filter(
-        receiver=request.user, is_read=False
-    ).count()
-    
-    unread_notifications_count = Notification.objects.filter(
-        recipient=request.user, is_read=False
-    ).count()
-    
     context = {
         'posts': posts,
+        'next_cursor': next_cursor,
         'home_reels': home_reels,
-        'stories_data': {
-            'users_with_previews': users_with_previews
-        },
-        'unread_messages_count': unread_messages_count,
-        'unread_count': unread_notifications_count,
+        'stories_data': stories_data,
+        'stories_generation': caching.get_generation(caching.STORIES),
+        'stories_timeout': stories.fragment_timeout,
+        'reels_generation': caching.get_generation(caching.REELS),
+        'unread_messages_count': unread_counts[counters.MESSAGES],
+        'unread_count': unread_counts[counters.NOTIFICATIONS],
     }
     return render(request, 'social/home.html', context)
 
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
+@login_required
+def feed_page(request):
+    try:
+        page_size = int(request.GET.get('limit', feed.FEED_PAGE_SIZE))
+        posts, next_cursor = feed.get_feed_page(request.user, request.GET.get('cursor'), page_size)
+    except (ValueError, feed.InvalidCursor):
+        return JsonResponse({'error': 'مؤشر الصفحة غير صالح.'}, status=400)
+
+    html = ''.join(
+        render_to_string('social/post_template.html', {'post': post}, request=request)
+        for post in posts
+    )
+    return JsonResponse({
+        'posts': [feed.serialize_post(post) for post in posts],
+        'html': html,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
+    })
 
 @login_required
 def upload_story(request):
@@ -121,8 +99,10 @@ def upload_story(request):
         if form.is_valid():
             story = form.save(commit=False)
             story.user = request.user
+            pending = uploads.detach(story, request.FILES, ['image', 'video'])
             story.save()
-            messages.success(request, 'تم نشر قصتك بنجاح!')
+            uploads.enqueue(request.user, story, pending)
+            messages.success(request, 'تم استلام قصتك، وستظهر فور اكتمال رفعها.')
             return redirect('home')
         else:
             # Pass the form with errors back to the template
@@ -131,20 +111,16 @@ def upload_story(request):
     form = StoryForm()
     return render(request, 'social/upload_story.html', {'form': form})
 
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
-
 @login_required
 def view_stories(request, username):
     try:
         story_user = get_object_or_404(CustomUser, username=username)
-        twenty_four_hours_ago = timezone.now() - timedelta(hours=24)
 
-        if story_user in request.user.blocked_users.all():
+        if graph.is_blocked(request.user.id, story_user.id):
             raise Http404("User not found.")
 
-        user_stories = Story.objects.filter(
-            user=story_user,
-            created_at__gte=twenty_four_hours_ago
+        user_stories = stories.active_stories().filter(
+            user=story_user
         ).annotate(
             is_liked=Exists(StoryLike.objects.filter(story_id=OuterRef('pk'), user=request.user))
         ).order_by('created_at')
@@ -165,7 +141,7 @@ def view_stories(request, username):
 @login_required
 @require_POST
 def like_story(request, story_id):
-    story = get_object_or_404(Story, id=story_id)
+    story = get_object_or_404(stories.active_stories(), id=story_id)
     like, created = StoryLike.objects.get_or_create(user=request.user, story=story)
 
     if not created:
@@ -173,14 +149,8 @@ def like_story(request, story_id):
         liked = False
     else:
         liked = True
-        if request.user != story.user:
-            Notification.objects.create(
-                recipient=story.user,
-                sender=request.user,
-                notification_type='story_like',
-                content=f"أعجب {request.user.username} بقصتك",
-                related_id=story.id
-            )
+        notify.enqueue(story.user_id, request.user.id, 'story_like', story.id)
+    story.refresh_from_db(fields=['likes_count'])
     return JsonResponse({'liked': liked, 'likes_count': story.likes_count})
 
 
@@ -194,17 +164,12 @@ def delete_story(request, story_id):
     story.delete()
     return JsonResponse({'success': True, 'message': 'Story deleted successfully.'})
 
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
-
 @login_required
 @require_POST
 def update_user_activity(request):
-    request.user.last_active = timezone.now()
-    request.user.save(update_fields=['last_active'])
+    presence.touch(request.user.id)
     return JsonResponse({'status': 'success'})
 
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
-
 @login_required
 def create_post(request):
     if request.method == 'POST':
@@ -212,15 +177,10 @@ def create_post(request):
         if form.is_valid():
             post = form.save(commit=False)
             post.user = request.user
-            if 'image' in request.FILES:
-                upload_result = cloudinary.uploader.upload(request.FILES['image'])
-                post.image = upload_result.get('secure_url', upload_result.get('url'))
-            if 'video' in request.FILES:
-                upload_result = cloudinary.uploader.upload(request.FILES['video'], resource_type="video")
-                post.video = upload_result.get('secure_url', upload_result.get('url'))
+            pending = uploads.detach(post, request.FILES, ['image', 'video'])
             post.save()
-            request.user.points += 10
-            request.user.save()
+            uploads.enqueue(request.user, post, pending)
+            CustomUser.objects.filter(pk=request.user.pk).update(points=F('points') + 10)
             return redirect('home')
     else:
         form = PostForm()
@@ -232,19 +192,13 @@ def like_post(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     like, created = Like.objects.get_or_create(user=request.user, post=post)
     if created:
-        if request.user != post.user:
-            Notification.objects.create(
-                recipient=post.user,
-                sender=request.user,
-                notification_type='like',
-                content=f"{request.user.username} أعجب بمنشورك",
-                related_id=post.id
-            )
+        notify.enqueue(post.user_id, request.user.id, 'like', post.id)
     else:
         like.delete()
+    post.refresh_from_db(fields=['likes_count'])
     return JsonResponse({
         'liked': created,
-        'likes_count': post.likes.count(),
+        'likes_count': post.likes_count,
         'post_id': post_id
     })
 
@@ -258,14 +212,7 @@ def add_comment(request, post_id):
         post = get_object_or_404(Post, id=post_id)
         comment = Comment.objects.create(user=request.user, post=post, content=content)
         
-        if request.user != post.user:
-            Notification.objects.create(
-                recipient=post.user,
-                sender=request.user,
-                notification_type='comment',
-                content=f"{request.user.username} علق على منشورك",
-                related_id=post.id
-            )
+        notify.enqueue(post.user_id, request.user.id, 'comment', post.id)
         return JsonResponse({
             'success': True,
             'username': request.user.username,
@@ -278,48 +225,37 @@ def add_comment(request, post_id):
 @login_required
 def send_friend_request(request, username):
     receiver = get_object_or_404(CustomUser, username=username)
-    if request.user != receiver and receiver not in request.user.friend_requests.all():
+    if request.user != receiver and not graph.has_sent_request(request.user.id, receiver.id):
         request.user.friend_requests.add(receiver)
-        Notification.objects.create(
-            recipient=receiver,
-            sender=request.user,
-            notification_type='friend_request',
-            content=f"{request.user.username} أرسل لك طلب صداقة",
-            related_id=request.user.id
-        )
+        notify.enqueue(receiver.id, request.user.id, 'friend_request', request.user.id)
     return redirect('profile', username=username)
 
 @login_required
 def accept_friend_request(request, username):
     sender = get_object_or_404(CustomUser, username=username)
-    if sender in request.user.received_friend_requests.all():
+    if graph.has_received_request(request.user.id, sender.id):
         request.user.friends.add(sender)
         sender.friends.add(request.user)
         request.user.received_friend_requests.remove(sender)
-        Notification.objects.create(
-            recipient=sender,
-            sender=request.user,
-            notification_type='friend_accept',
-            content=f"{request.user.username} قبل طلب صداقتك",
-            related_id=request.user.id
-        )
+        notify.enqueue(sender.id, request.user.id, 'friend_accept', request.user.id)
     return redirect('friends')
 
 @login_required
 def reject_friend_request(request, username):
     sender = get_object_or_404(CustomUser, username=username)
-    if sender in request.user.received_friend_requests.all():
+    if graph.has_received_request(request.user.id, sender.id):
         request.user.received_friend_requests.remove(sender)
     return redirect('friends')
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
-
 @login_required
 def profile(request, username):
     user_profile = get_object_or_404(CustomUser, username=username)
-    posts = user_profile.posts.all().order_by('-created_at')
-    is_friend = user_profile in request.user.friends.all()
-    has_sent_request = user_profile in request.user.friend_requests.all()
-    has_received_request = request.user in user_profile.friend_requests.all()
+    posts = feed.finalize_posts(list(
+        feed.annotate_posts(user_profile.posts.all(), request.user).order_by('-created_at')
+    ))
+    user_profile.friends_total = graph.friend_count(user_profile.id)
+    is_friend = graph.are_friends(request.user.id, user_profile.id)
+    has_sent_request = graph.has_sent_request(request.user.id, user_profile.id)
+    has_received_request = graph.has_received_request(request.user.id, user_profile.id)
     context = {
         'profile_user': user_profile,
         'posts': posts,
@@ -328,43 +264,68 @@ def profile(request, username):
         'has_received_request': has_received_request,
     }
     return render(request, 'social/profile.html', context)
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
-
 @login_required
 def qr_code_view(request, username):
     user_profile = get_object_or_404(CustomUser, username=username)
-    if not user_profile.qr_code:
-        user_profile.generate_qr_code()
-    return render(request, 'social/qr_code.html', {'profile_user': user_profile})
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
+    # الكود يرسم محليا عند أول عرض ولا يرفع إلى Cloudinary أثناء الطلب
+    if user_profile.qr_code:
+        qr_code_url = user_profile.qr_code.url
+    else:
+        qr_code_url = reverse('qr_code_image', args=[user_profile.username])
+    return render(request, 'social/qr_code.html', {'profile_user': user_profile, 'qr_code_url': qr_code_url})
 
 @login_required
+def qr_code_image(request, username):
+    user_profile = get_object_or_404(CustomUser, username=username)
+    response = HttpResponse(qrcodes.get_png(user_profile.username), content_type='image/png')
+    patch_cache_control(response, private=True, max_age=60 * 60 * 24)
+    return response
+@login_required
 def friends(request):
-    user_friends = request.user.friends.all()
+    user_friends = list(request.user.friends.all())
     received_requests = request.user.received_friend_requests.all()
     sent_requests = request.user.friend_requests.all()
     context = {
         'friends': user_friends,
+        'online_ids': presence.online_ids([friend.id for friend in user_friends]),
         'received_requests': received_requests,
         'sent_requests': sent_requests,
+        'suggestions': suggestions.for_user(request.user),
     }
     return render(request, 'social/friends.html', context)
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
 
 @login_required
+def friend_suggestions(request):
+    try:
+        limit = max(1, min(int(request.GET.get('limit', suggestions.SUGGESTIONS_PAGE_SIZE)), suggestions.SUGGESTIONS_PER_USER))
+    except ValueError:
+        return JsonResponse({'error': 'قيمة limit غير صالحة.'}, status=400)
+    results = suggestions.for_user(request.user, limit=limit)
+    return JsonResponse({'suggestions': [suggestions.serialize_suggestion(user) for user in results]})
+@login_required
 def search_users(request):
     query = request.GET.get('q', '')
-    users_results = CustomUser.objects.filter(username__icontains=query) | CustomUser.objects.filter(full_name__icontains=query)
-    return render(request, 'social/search_results.html', {'users': users_results, 'query': query})
+    users_results = search.search_users(request.user, query)
+    return render(request, 'social/search_results.html', {
+        'users': users_results,
+        'query': query,
+        'is_truncated': len(users_results) == search.SEARCH_RESULTS_LIMIT,
+    })
+
+@login_required
+def search_typeahead(request):
+    query = request.GET.get('q', '')
+    results = search.search_users(request.user, query, limit=search.TYPEAHEAD_LIMIT)
+    return JsonResponse({'query': query, 'results': [search.serialize_result(user) for user in results]})
 
 def register(request):
     if request.method == 'POST':
         form = CustomUserCreationForm(request.POST, request.FILES)
         if form.is_valid():
             user_obj = form.save(commit=False)
-            if 'profile_picture' in request.FILES:
-                user_obj.profile_picture = cloudinary.uploader.upload(request.FILES['profile_picture'])['url']
+            pending = uploads.detach(user_obj, request.FILES, ['profile_picture'])
             user_obj.save()
+            uploads.enqueue(user_obj, user_obj, pending)
             auth_login(request, user_obj)
             return redirect('home')
     else:
@@ -411,25 +372,23 @@ def unblock_user(request, username):
     user_to_unblock = get_object_or_404(CustomUser, username=username)
     request.user.blocked_users.remove(user_to_unblock)
     return redirect('profile', username=username)
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
-
 @login_required
 def edit_profile(request, username):
     if request.user.username != username:
         return redirect('profile', username=username)
     if request.method == 'POST':
+        # الصور الحالية تبقى ظاهرة إلى أن يكتمل رفع الجديدة
+        previous = {'profile_picture': request.user.profile_picture, 'cover_photo': request.user.cover_photo}
         form = ProfileEditForm(request.POST, request.FILES, instance=request.user)
         if form.is_valid():
             user_instance = form.save(commit=False)
-            if 'profile_picture' in request.FILES:
-                user_instance.profile_picture = cloudinary.uploader.upload(request.FILES['profile_picture'])['url']
-            elif 'profile_picture-clear' in request.POST:
+            pending = uploads.detach(user_instance, request.FILES, ['profile_picture', 'cover_photo'], previous)
+            if 'profile_picture' not in pending and 'profile_picture-clear' in request.POST:
                 user_instance.profile_picture = None
-            if 'cover_photo' in request.FILES:
-                user_instance.cover_photo = cloudinary.uploader.upload(request.FILES['cover_photo'])['url']
-            elif 'cover_photo-clear' in request.POST:
+            if 'cover_photo' not in pending and 'cover_photo-clear' in request.POST:
                 user_instance.cover_photo = None
             user_instance.save()
+            uploads.enqueue(request.user, user_instance, pending)
             return redirect('profile', username=username)
     else:
         form = ProfileEditForm(instance=request.user)
@@ -441,14 +400,13 @@ def edit_post(request, post_id):
     if request.user != post_instance.user:
         return redirect('home')
     if request.method == 'POST':
+        previous = {'image': post_instance.image, 'video': post_instance.video}
         form = PostEditForm(request.POST, request.FILES, instance=post_instance)
         if form.is_valid():
             post_to_edit = form.save(commit=False)
-            if 'image' in request.FILES:
-                post_to_edit.image = cloudinary.uploader.upload(request.FILES['image'])['url']
-            if 'video' in request.FILES:
-                post_to_edit.video = cloudinary.uploader.upload(request.FILES['video'], resource_type="video")['url']
+            pending = uploads.detach(post_to_edit, request.FILES, ['image', 'video'], previous)
             post_to_edit.save()
+            uploads.enqueue(request.user, post_to_edit, pending)
             return redirect('profile', username=request.user.username)
     else:
         form = PostEditForm(instance=post_instance)
@@ -466,30 +424,16 @@ def delete_post(request, post_id):
         return redirect('profile', username=request.user.username)
     return render(request, 'social/confirm_delete.html', {'post': post_to_delete})
 
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
-
 @login_required
 def chat_view(request, username):
     other_user = get_object_or_404(User, username=username)
-    if other_user not in request.user.friends.all():
+    if not graph.are_friends(request.user.id, other_user.id):
         messages.error(request, "لا يمكنك بدء محادثة مع شخص ليس صديقك.")
         return redirect('home')
         
-    unread_messages = Message.objects.filter(
-        sender=other_user,
-        receiver=request.user,
-        is_read=False
-    )
-    for msg in unread_messages:
-        msg.mark_as_seen()
-    messages_qs = Message.objects.filter(
-        sender__in=[request.user, other_user],
-        receiver__in=[request.user, other_user]
-    ).order_by("timestamp")
-    return render(request, "chat.html", {
-        "messages": messages_qs,
-        "other_user": other_user
-    })
+    mark_conversation_seen(request.user, other_user)
+    # The history is loaded page by page from get_messages; "messages" stays the messages framework's.
+    return render(request, "chat.html", {"other_user": other_user})
 
 # views.py (تعديل دالة send_message)
 @login_required
@@ -501,7 +445,7 @@ def send_message(request):
 
     receiver = get_object_or_404(CustomUser, username=receiver_username)
 
-    if receiver not in request.user.friends.all():
+    if not graph.are_friends(request.user.id, receiver.id):
         return JsonResponse({"error": "لا يمكنك إرسال رسائل إلى شخص ليس صديقك."}, status=403)
 
     content = request.POST.get("content", "").strip()
@@ -531,83 +475,81 @@ def send_message(request):
         reply_to=reply_to_message  # تعيين الرسالة المردود عليها
     )
 
-    if image_file:
-        message.image = image_file
-
-    if video_file:
-        message.video = video_file
-    
-    if voice_file:
-        message.voice_note = voice_file
-
     message.save()
-    
-    response_data = {
-        "id": message.id,
-        "sender": message.sender.username,
-        "receiver": receiver.username,
-        "content": message.content,
-        "image_url": message.image.url if message.image else None,
-        "video_url": message.video.url if message.video else None,
-        "voice_note_url": message.voice_note.url if message.voice_note else None,
-        "timestamp": message.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-        "is_read": message.is_read,
-        "seen_at": None,
-        "is_system_message": message.is_system_message,
-        "reply_to": None
-    }
-
-    # إضافة بيانات الرسالة المردود عليها إذا وجدت
-    if reply_to_message:
-        response_data["reply_to"] = {
-            "id": reply_to_message.id,
-            "sender": reply_to_message.sender.username,
-            "content": reply_to_message.content,
-            "image_url": reply_to_message.image.url if reply_to_message.image else None,
-            "video_url": reply_to_message.video.url if reply_to_message.video else None,
-            "voice_note_url": reply_to_message.voice_note.url if reply_to_message.voice_note else None,
-        }
+    pending = uploads.enqueue(request.user, message, {
+        name: uploaded
+        for name, uploaded in (('image', image_file), ('video', video_file), ('voice_note', voice_file))
+        if uploaded
+    })
+    # الوسائط ترفع في الخلفية ويصل الرابط لاحقا في حدث "updated"
+    message.media_pending = bool(pending)
+    broadcast_new_message(message)
 
-    return JsonResponse(response_data)
+    return JsonResponse({
+        **serialize_message(message),
+        'uploads': [uploads.serialize_upload(upload) for upload in pending],
+    })
 
 # views.py (تعديل دالة get_messages)
 @login_required
 def get_messages(request, username):
+    """
+    Conversation sync endpoint.
+
+    - no parameters: the latest ``limit`` messages.
+    - ``before_id``: the ``limit`` messages before it (history scroll).
+    - ``after_id`` (+ ``since``, the ``server_time`` of the previous sync):
+      only new messages, read receipts and deletions since then.
+
+    Sends an ETag and answers ``If-None-Match`` with 304 when nothing changed.
+    """
     other_user = get_object_or_404(CustomUser, username=username)
-    if other_user not in request.user.friends.all():
+    if not graph.are_friends(request.user.id, other_user.id):
         return JsonResponse({"error": "لا يمكنك عرض الرسائل مع شخص ليس صديقك."}, status=403)
-        
-    messages_qs = Message.objects.filter(
-        (django_models.Q(sender=request.user, receiver=other_user) |
-         django_models.Q(sender=other_user, receiver=request.user))
-    ).select_related('reply_to').order_by("timestamp")
-
-    Message.objects.filter(sender=other_user, receiver=request.user, is_read=False).update(is_read=True, seen_at=timezone.now())
-
-    return JsonResponse([
-        {
-            "id": msg.id,
-            "sender": msg.sender.username,
-            "receiver": msg.receiver.username,
-            "content": msg.content,
-            "image_url": msg.image.url if msg.image else None,
-            "video_url": msg.video.url if msg.video else None,
-            "voice_note_url": msg.voice_note.url if msg.voice_note else None,
-            "timestamp": msg.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            "is_read": msg.is_read,
-            "seen_at": msg.seen_at.strftime("%Y-%m-%d %H:%M:%S") if msg.seen_at else None,
-            "is_system_message": msg.is_system_message,
-            "reply_to": {
-                "id": msg.reply_to.id,
-                "sender": msg.reply_to.sender.username,
-                "content": msg.reply_to.content,
-                "image_url": msg.reply_to.image.url if msg.reply_to.image else None,
-                "video_url": msg.reply_to.video.url if msg.reply_to.video else None,
-                "voice_note_url": msg.reply_to.voice_note.url if msg.reply_to.voice_note else None,
-            } if msg.reply_to else None
-        }
-        for msg in messages_qs
-    ], safe=False)
+
+    try:
+        limit = min(int(request.GET.get('limit', messaging.MESSAGES_PAGE_SIZE)), messaging.MESSAGES_MAX_PAGE_SIZE)
+        before_id = int(request.GET['before_id']) if request.GET.get('before_id') else None
+        after_id = int(request.GET['after_id']) if request.GET.get('after_id') else None
+        since = None
+        if request.GET.get('since'):
+            since = parse_datetime(request.GET['since'])
+            if since is None:
+                raise ValueError(request.GET['since'])
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+    except ValueError:
+        return JsonResponse({"error": "معاملات غير صالحة."}, status=400)
+    limit = max(limit, 1)
+
+    server_time = timezone.now()
+    mark_conversation_seen(request.user, other_user)
+
+    etag = messaging.conversation_etag(request.user, other_user)
+    if before_id is None and request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    updated, deleted = [], []
+    if before_id is not None:
+        page, has_more = messaging.get_history_page(request.user, other_user, before_id, limit)
+    elif after_id is not None:
+        page, updated, deleted, has_more = messaging.get_changes(request.user, other_user, after_id, since)
+    else:
+        page, has_more = messaging.get_history_page(request.user, other_user, limit=limit)
+
+    response = JsonResponse({
+        "messages": [serialize_message(msg) for msg in page],
+        "updated": updated,
+        "deleted": deleted,
+        "has_more": has_more,
+        "last_id": page[-1].id if page else after_id,
+        "server_time": server_time.isoformat(),
+    })
+    response['ETag'] = etag
+    return response
+
 # --- إضافة جديدة ---
 @login_required
 @require_POST
@@ -617,7 +559,7 @@ def delete_message(request, message_id):
         message = get_object_or_404(Message, id=message_id, sender=request.user)
         
         # قم بحذف الرسالة
-        message.delete()
+        messaging.delete_message(message)
         
         return JsonResponse({'success': True, 'message_id': message_id})
 
@@ -627,52 +569,12 @@ def delete_message(request, message_id):
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 # ------------------
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
-
 @login_required
 def chat_list(request, username):
     try:
         current_user = request.user
-        friends = current_user.friends.all() 
-        query = request.GET.get('q', '')
-        if query:
-            friends = friends.filter(username__icontains=strip_tags(query))
-            
-        user_data = []
-        for user_item in friends: 
-            last_sent = Message.objects.filter(
-                sender=current_user,
-                receiver=user_item
-            ).order_by('-timestamp').first()
-            last_received = Message.objects.filter(
-                sender=user_item,
-                receiver=current_user
-            ).order_by('-timestamp').first()
-            last_message = None
-            if last_sent and last_received:
-                last_message = last_sent if last_sent.timestamp > last_received.timestamp else last_received
-            else:
-                last_message = last_sent or last_received
-            is_new = False
-            if last_message and last_message.receiver == current_user and not last_message.is_read:
-                is_new = True
-            
-            last_message_content = "لا توجد رسائل"
-            if last_message:
-                if last_message.content:
-                    last_message_content = strip_tags(last_message.content)
-                elif last_message.image:
-                    last_message_content = "📷 صورة"
-                elif last_message.video:
-                    last_message_content = "🎥 فيديو"
-
-            user_data.append({
-                'user': user_item,
-                'last_message': last_message_content,
-                'last_time': last_message.timestamp if last_message else None,
-                'is_new': is_new
-            })
-        user_data.sort(key=lambda x: x['last_time'] or timezone.datetime.min.replace(tzinfo=pytz.UTC), reverse=True)
+        user_data = messaging.conversation_summaries(current_user, request.GET.get('q', ''))
+        presence.attach([row['user'] for row in user_data])
         return render(request, 'chat_list.html', {
             'all_users': user_data,
             'current_user': current_user
@@ -680,12 +582,10 @@ def chat_list(request, username):
     except Exception as e:
         raise Http404(f"حدث خطأ: {str(e)}")
 
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
-
 @login_required
 def chat(request, username):
     other_user = get_object_or_404(User, username=username)
-    if other_user not in request.user.friends.all():
+    if not graph.are_friends(request.user.id, other_user.id):
         messages.error(request, "لا يمكنك بدء محادثة مع شخص ليس صديقك.")
         return redirect('home')
         
@@ -695,39 +595,90 @@ def chat(request, username):
     return render(request, 'chat.html', context)
 
 
+@caching.anonymous_cache_page(60 * 15)
 def splash(request):
     return render(request, 'splash.html')
 
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
-
 @login_required
 def notifications(request):
-    Notification.objects.filter(recipient=request.user, is_read=False).update(is_read=True)
-    notifications_qs = Notification.objects.filter(recipient=request.user).order_by('-created_at')
-    
+    notifications_list, next_cursor = notify.get_page(request.user)
+    groups = notify.group(notifications_list)
+    unread_count = counters.get_unread_count(counters.NOTIFICATIONS, request.user.id)
+    # Opening the page reads what it shows (and anything older), not rows that arrive afterwards.
+    up_to = feed.encode_cursor(notifications_list[0]) if notifications_list else ''
+    if up_to:
+        notify.mark_read(request.user.id, up_to)
+
     return render(request, 'social/notifications.html', {
-        'notifications': notifications_qs,
+        'notifications': groups,
+        'next_cursor': next_cursor,
+        'up_to': up_to,
+        'unread_count': unread_count,
     })
 
 @login_required
-def mark_notification_as_read(request, notification_id):
-    if request.method == 'POST':
-        notification = get_object_or_404(Notification, id=notification_id, recipient=request.user)
-        notification.is_read = True
-        notification.save()
-        return JsonResponse({'status': 'success'})
-    return JsonResponse({'status': 'error'}, status=400)
+def notifications_page(request):
+    try:
+        page_size = int(request.GET.get('limit', notify.NOTIFICATIONS_PAGE_SIZE))
+        notifications_list, next_cursor = notify.get_page(request.user, request.GET.get('cursor'), page_size)
+    except (ValueError, feed.InvalidCursor):
+        return JsonResponse({'error': 'مؤشر الصفحة غير صالح.'}, status=400)
+
+    html = ''.join(
+        render_to_string('social/notification_item.html', {'notification': notification}, request=request)
+        for notification in notify.group(notifications_list)
+    )
+    return JsonResponse({
+        'html': html,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
+    })
+
+@login_required
+@require_POST
+def mark_notifications_read(request):
+    try:
+        updated = notify.mark_read(request.user.id, request.POST.get('up_to', ''))
+    except feed.InvalidCursor:
+        return JsonResponse({'status': 'error'}, status=400)
+    return JsonResponse({
+        'status': 'success',
+        'updated': updated,
+        'unread_count': counters.get_unread_count(counters.NOTIFICATIONS, request.user.id),
+    })
 
 @login_required
 def get_unread_notifications_count(request):
-    count = Notification.objects.filter(recipient=request.user, is_read=False).count()
+    count = counters.get_unread_count(counters.NOTIFICATIONS, request.user.id)
     return JsonResponse({'count': count})
 
 @login_required
 def get_unread_messages_count(request):
-    count = Message.objects.filter(receiver=request.user, is_read=False).count()
+    count = counters.get_unread_count(counters.MESSAGES, request.user.id)
     return JsonResponse({'count': count})
 
+def prometheus_metrics(request):
+    # Scrapers send the token from METRICS_TOKEN; staff can open it in the browser.
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorized = request.user.is_staff or (
+        token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    )
+    if not authorized:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def local_media(request, path):
+    # روابط الوسائط عند استعمال LocalBackend بدلا من Cloudinary (vite/media.py)
+    backend = media.get_backend()
+    if not isinstance(backend, media.LocalBackend):
+        raise Http404
+    try:
+        response = FileResponse(open(backend.render(path), 'rb'))
+    except (FileNotFoundError, ValueError):
+        raise Http404
+    patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365)
+    return response
+
 @login_required
 def delete_comment(request, comment_id):
     comment = get_object_or_404(Comment, id=comment_id)
@@ -741,58 +692,59 @@ def delete_comment(request, comment_id):
 
 def game_view(request):
     return render(request, 'game.html')
-@cache_page(60 * 1)  # التخزين المؤقت للصفحة لمدة دقيقة واحدة
+def _reel_context(reel):
+    return {
+        'reel': reel,
+        'is_liked_by_user': reel.is_liked,
+        'comments_list': reel.preview_comments,
+    }
+
 
 @login_required
 def reels_feed(request):
-    featured_reel_id = request.GET.get('show_reel')
-    reels_list = []
+    try:
+        featured_reel_id = int(request.GET['show_reel'])
+    except (KeyError, ValueError):
+        featured_reel_id = None
+    reels_list, next_cursor = reels.get_reels_page(request.user, featured_id=featured_reel_id)
 
-    if featured_reel_id:
-        try:
-            featured_reel = Reel.objects.select_related('user').prefetch_related(
-                'reel_likes', 'reel_comments__user'
-            ).get(id=featured_reel_id)
-            reels_list.append(featured_reel)
-
-            other_reels = Reel.objects.exclude(id=featured_reel_id).select_related('user').prefetch_related(
-                'reel_likes', 'reel_comments__user'
-            ).order_by('?')
-            reels_list.extend(list(other_reels))
-
-        except Reel.DoesNotExist:
-            featured_reel_id = None
-    
-    if not featured_reel_id:
-        time_threshold = timezone.now() - timedelta(hours=5)
-        new_reels = Reel.objects.filter(created_at__gte=time_threshold).select_related('user').prefetch_related(
-            'reel_likes', 'reel_comments__user'
-        ).order_by('-created_at')
-        old_reels = Reel.objects.filter(created_at__lt=time_threshold).select_related('user').prefetch_related(
-            'reel_likes', 'reel_comments__user'
-        ).order_by('?')
-        reels_list = list(new_reels) + list(old_reels)
-
-    reels_data = []
-    for reel in reels_list:
-        is_liked_by_user = reel.reel_likes.filter(user=request.user).exists()
-        comments_for_reel = reel.reel_comments.all().order_by('created_at')
-        reels_data.append({
-            'reel': reel,
-            'is_liked_by_user': is_liked_by_user,
-            'comments_list': comments_for_reel,
-        })
-        
     user_profile_pic_url = request.user.profile_picture.url if request.user.profile_picture else \
                            '/static/images/default_profile.png'
 
     context = {
-        'reels_data': reels_data,
+        'reels_data': [_reel_context(reel) for reel in reels_list],
+        'next_cursor': next_cursor,
         'user_profile_pic_url': user_profile_pic_url,
     }
     return render(request, 'social/reels_feed.html', context)
 
 
+@login_required
+def reels_page(request):
+    try:
+        page_size = int(request.GET.get('limit', reels.REELS_PAGE_SIZE))
+        reels_list, next_cursor = reels.get_reels_page(request.user, request.GET.get('cursor'), page_size=page_size)
+    except (ValueError, reels.InvalidCursor):
+        return JsonResponse({'error': 'مؤشر الصفحة غير صالح.'}, status=400)
+
+    html = ''.join(
+        render_to_string('social/reel_template.html', {'data': _reel_context(reel)}, request=request)
+        for reel in reels_list
+    )
+    return JsonResponse({
+        'reels': [reels.serialize_reel(reel) for reel in reels_list],
+        'html': html,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
+    })
+
+
+@login_required
+def media_upload_status(request, upload_id):
+    upload = get_object_or_404(MediaUpload, id=upload_id, owner=request.user)
+    return JsonResponse(uploads.serialize_upload(upload))
+
+
 @login_required
 def upload_reel(request):
     if request.method == 'POST':
@@ -800,8 +752,10 @@ def upload_reel(request):
         if form.is_valid():
             reel = form.save(commit=False)
             reel.user = request.user
+            pending = uploads.detach(reel, request.FILES, ['video'])
             reel.save()
-            messages.success(request, 'تم نشر الريل بنجاح!')
+            uploads.enqueue(request.user, reel, pending)
+            messages.success(request, 'تم استلام الريل، وسيظهر فور اكتمال رفعه.')
             return redirect('reels_feed')
         else:
             messages.error(request, 'حدث خطأ أثناء رفع الريل. يرجى التحقق من النموذج.')
@@ -821,14 +775,8 @@ def like_reel(request, reel_id):
         liked = False
     else:
         liked = True
-        if request.user != reel.user:
-            Notification.objects.create(
-                recipient=reel.user,
-                sender=request.user,
-                notification_type='reel_like',
-                content=f"أعجب {request.user.username} بالريل الخاص بك",
-                related_id=reel.id
-            )
+        notify.enqueue(reel.user_id, request.user.id, 'reel_like', reel.id)
+    reel.refresh_from_db(fields=['likes_count'])
     return JsonResponse({'liked': liked, 'likes_count': reel.likes_count})
 
 @login_required
@@ -842,17 +790,11 @@ def add_reel_comment(request, reel_id):
 
     comment = ReelComment.objects.create(user=request.user, reel=reel, content=content)
     
-    if request.user != reel.user:
-        Notification.objects.create(
-            recipient=reel.user,
-            sender=request.user,
-            notification_type='reel_comment',
-            content=f"علق {request.user.username} على الريل الخاص بك",
-            related_id=reel.id
-        )
+    notify.enqueue(reel.user_id, request.user.id, 'reel_comment', reel.id)
     
     profile_picture_url = request.user.profile_picture.url if request.user.profile_picture else \
                           '/static/images/default_profile.png'
+    reel.refresh_from_db(fields=['comments_count'])
 
     return JsonResponse({
         'success': True,
@@ -880,7 +822,7 @@ def delete_reel(request, reel_id):
     
     try:
         if reel.video and hasattr(reel.video, 'public_id'):
-            cloudinary.uploader.destroy(reel.video.public_id, resource_type="video")
+            media.destroy(reel.video.public_id, resource_type="video")
 
         reel.delete()
         return JsonResponse({'success': True})
@@ -888,6 +830,7 @@ def delete_reel(request, reel_id):
         print(f"Error deleting reel {reel_id}: {e}")
         return JsonResponse({'success': False, 'error': 'حدث خطأ أثناء محاولة حذف الريل.'}, status=500)
 
+@caching.anonymous_cache_page(60 * 1)
 def reel_detail_view(request, reel_id):
     reel = get_object_or_404(Reel.objects.select_related('user').prefetch_related('reel_comments__user'), id=reel_id)
 
@@ -912,33 +855,14 @@ def reel_detail_view(request, reel_id):
 @require_POST
 def record_reel_view(request, reel_id):
     try:
-        reel = get_object_or_404(Reel, pk=reel_id)
-        
-        if request.user not in reel.viewers.all():
-            reel.viewers.add(request.user)
-            reel.views_count = F('views_count') + 1
-            reel.save(update_fields=['views_count'])
-            
-            reel.refresh_from_db()
-            
-            return JsonResponse({
-                'success': True, 
-                'views_count': reel.views_count,
-                'is_new_view': True
-            })
-        else:
-            return JsonResponse({
-                'success': True, 
-                'views_count': reel.views_count,
-                'is_new_view': False
-            })
-            
-    except Exception as e:
-        print(f"Error recording reel view: {e}")
-        return JsonResponse({
-            'success': False, 
-            'error': 'An internal error occurred'
-        }, status=500)
+        views_count, is_new_view = reelviews.record_view(reel_id, request.user.id)
+    except Reel.DoesNotExist:
+        raise Http404("Reel not found.")
+    return JsonResponse({
+        'success': True,
+        'views_count': views_count,
+        'is_new_view': is_new_view
+    })
 
 @login_required
 @require_POST
@@ -1042,12 +966,13 @@ def screenshot_notification(request):
 
         receiver = get_object_or_404(CustomUser, username=receiver_username)
 
-        Message.objects.create(
+        message = Message.objects.create(
             sender=request.user,
             receiver=receiver,
             content=f"لقد قام {request.user.username} بلقطة شاشة",
             is_system_message=True
         )
+        broadcast_new_message(message)
 
         return JsonResponse({'success': True})
     except Exception as e: